@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+from __future__ import print_function, unicode_literals, absolute_import
+from itertools import chain, count
+
+#Shared by all buffers so a version is never reused, even by a new buffer
+_versions = count(1)
+
+
+class GapBuffer(object):
+    '''List of characters with a gap at the last edit position.
+
+    The characters before the gap are kept in order in before, those after
+    it in reverse order in after, so inserting or deleting at the gap only
+    appends to or pops from the end of a list. Moving the gap moves the
+    characters between it and the new position from one list to the other,
+    so editing near the last edit is cheap however long the line is.
+
+    Supports the list operations TextLine and the editing modes use on
+    line_buffer. Slices are returned as lists. version changes on every
+    modification, TextLine keys its cached values on it.
+
+    While edits is a list every modification appends a (start, removed,
+    inserted) tuple to it: the position, the characters removed there and
+    the number of characters put in their place. See UndoLog.
+    '''
+    def __init__(self, chars=()):
+        self.before = list(chars)
+        self.after = []
+        self.version = next(_versions)
+        self.edits = None
+
+    def _record(self, start, removed, inserted):
+        if removed or inserted:
+            self.edits.append((start, removed, inserted))
+
+    def _move_gap(self, pos):
+        before = self.before
+        after = self.after
+        if pos < len(before):
+            moved = before[pos:]
+            moved.reverse()
+            after.extend(moved)
+            del before[pos:]
+        elif pos > len(before):
+            count = pos - len(before)
+            moved = after[-count:]
+            moved.reverse()
+            before.extend(moved)
+            del after[-count:]
+
+    def _index(self, index):
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("line buffer index out of range")
+        return index
+
+    def _range(self, key):
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            return None
+        return start, max(start, stop)
+
+    def __len__(self):
+        return len(self.before) + len(self.after)
+
+    def __iter__(self):
+        return chain(self.before, reversed(self.after))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            bounds = self._range(key)
+            if bounds is None:
+                return list(self)[key]
+            start, stop = bounds
+            gap = len(self.before)
+            if stop <= gap:
+                return self.before[start:stop]
+            after = self.after
+            size = len(after)
+            tail = after[max(size - (stop - gap), 0):size - max(start - gap, 0)]
+            tail.reverse()
+            if start >= gap:
+                return tail
+            return self.before[start:] + tail
+        index = self._index(key)
+        gap = len(self.before)
+        if index < gap:
+            return self.before[index]
+        return self.after[len(self.after) - 1 - (index - gap)]
+
+    def __setitem__(self, key, value):
+        self.version = next(_versions)
+        if isinstance(key, slice):
+            bounds = self._range(key)
+            if bounds is None:
+                old = list(self)
+                chars = old[:]
+                chars[key] = value
+                self.before = chars
+                self.after = []
+                if self.edits is not None:
+                    self._record(0, old, len(chars))
+                return
+            start, stop = bounds
+            if value is self:
+                value = list(value)
+            self._move_gap(start)
+            after = self.after
+            removed = after[len(after) - (stop - start):]
+            del after[len(after) - (stop - start):]
+            size = len(self.before)
+            self.before.extend(value)
+            if self.edits is not None:
+                removed.reverse()
+                self._record(start, removed, len(self.before) - size)
+            return
+        index = self._index(key)
+        if self.edits is not None:
+            self._record(index, [self[index]], 1)
+        gap = len(self.before)
+        if index < gap:
+            self.before[index] = value
+        else:
+            self.after[len(self.after) - 1 - (index - gap)] = value
+
+    def __delitem__(self, key):
+        if not isinstance(key, slice):
+            index = self._index(key)
+            key = slice(index, index + 1)
+        self[key] = ()
+
+    def insert(self, index, char):
+        size = len(self)
+        if index < 0:
+            index = max(index + size, 0)
+        index = min(index, size)
+        self._move_gap(index)
+        self.before.append(char)
+        self.version = next(_versions)
+        if self.edits is not None:
+            self._record(index, [], 1)
+
+    def append(self, char):
+        self.insert(len(self), char)
+
+    def extend(self, chars):
+        size = len(self)
+        self._move_gap(size)
+        self.before.extend(chars)
+        self.version = next(_versions)
+        if self.edits is not None:
+            self._record(size, [], len(self) - size)
+
+    def count(self, char):
+        return self.before.count(char) + self.after.count(char)
+
+    def __contains__(self, char):
+        return char in self.before or char in self.after
+
+    def __eq__(self, other):
+        if isinstance(other, (GapBuffer, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
@@ -6,7 +6,9 @@
 #  the file COPYING, distributed as part of this software.
 #*****************************************************************************
 from __future__ import print_function, unicode_literals, absolute_import
-import re, operator, string, sys, os
+import re, operator, string, sys, os, heapq, time
+from bisect import bisect_left, bisect_right
+from itertools import islice
 
 from pyreadline.unicode_helper import ensure_unicode, ensure_str
 if "pyreadline" in sys.modules:
@@ -14,7 +16,22 @@ if "pyreadline" in sys.modules:
 else:
     import pyreadline
 
-from . import lineobj
+from . import lineobj, historyfile
+from .historyindex import TrigramIndex, DuplicateIndex, PrefixIndex, \
+                           FrecencyIndex, PatternCache, HistoryStats, \
+                           newest_first, fuzzy_score, fuzzy_best_score
+from .historyfile import open_history_file, remove_sidecar, frecency_name, \
+                          is_compressed, read_history_lines, \
+                          write_compressed, append_compressed, \
+                          HistoryLock, file_identity, read_tail, \
+                          compact_file, split_meta, join_meta, parse_meta, \
+                          format_meta, namespace_name, archive_name, \
+                          trigram_name
+from .historystore import HistoryStore, HistoryMetadata
+from .historydb import is_database, HistoryDatabase
+from .historywriter import HistoryWriter
+from .historyarchive import HistoryArchive
+from .historyimport import importers, detect_format
 
 class EscapeHistory(Exception):
     pass
@@ -23,14 +40,70 @@ from pyreadline.logger import log
 
 
 class LineHistory(object):
+    #Options copied to the history of a namespace, see copy_settings
+    _settings = ("history_length", "history_control", "history_journal",
+                 "history_frecency", "history_compression", "history_shared",
+                 "history_writer", "history_writer_interval",
+                 "history_writer_batch", "history_writer_timeout",
+                 "history_database", "history_timestamps", "history_session",
+                 "history_archive", "history_archive_workers", "fuzzy_limit",
+                 "fuzzy_scan")
+
     def __init__(self):
-        self.history = []
+        self.history = HistoryStore()
         self._history_length = 100
         self._history_cursor = 0
         self.history_filename = os.path.expanduser('~/.history') #Cannot expand unicode strings correctly on python2.4
         self.lastcommand = None
         self.query = ""
         self.last_search_for = ""
+        self._index = TrigramIndex()
+        self._duplicates = DuplicateIndex()
+        self._prefixes = PrefixIndex()
+        self._match_stack = []
+        self.fuzzy_limit = 100
+        self.fuzzy_scan = None
+        self.last_fuzzy_search_for = None
+        self._fuzzy_results = []
+        self._fuzzy_rank = 0
+        self._patterns = PatternCache()
+        self.last_regex_search_for = None
+        self._frecency = FrecencyIndex()
+        self._stats = HistoryStats()
+        self._ranked = None
+        self._rank = -1
+        self._frecent_line = ""
+        self.history_frecency = False
+        self.history_compression = False
+        self.history_control = "ignoredups"
+        self.history_journal = False
+        self._journal_flushed = 0
+        self._journal_lines = 0
+        self.history_shared = False
+        self._shared_offset = None
+        self._shared_identity = None
+        self.history_writer = False
+        self.history_writer_interval = 5.0
+        self.history_writer_batch = 50
+        self.history_writer_timeout = 1.0
+        self._writer = None
+        self.history_database = False
+        self._database = None
+        self._database_key = None
+        self.history_timestamps = False
+        self.history_archive = False
+        self.history_archive_workers = 2
+        self._archive = None
+        self.last_archive_search_for = None
+        self._archive_results = None
+        self._archive_line = ""
+        self.history_session = "%x-%x"%(os.getpid(), int(time.time()))
+        self._command = None
+
+    def copy_settings(self, other):
+        '''Use the options of LineHistory other, but not its file.'''
+        for name in self._settings:
+            setattr(self, name, getattr(other, name))
 
     def get_current_history_length(self):
         '''Return the number of lines currently in the history.
@@ -49,13 +122,54 @@ class LineHistory(object):
 
     def get_history_item(self, index):
         '''Return the current contents of history item at index (starts with index 1).'''
-        item = self.history[index - 1]
+        item = self.history.get_text(index - 1)
         log("get_history_item: index:%d item:%r"%(index, item))
-        return item.get_line_text()
+        return item
+
+    def get_history_metadata(self, index):
+        '''Return the (timestamp, duration, cwd, session) of history item
+        at index (starts with index 1). Unknown fields are 0.0, -1.0 and
+        empty strings, see HistoryMetadata.'''
+        return self.history.get_meta(index - 1)
+
+    def entries_between(self, start, stop):
+        '''Return the indexes, starting with 1, of the history items with
+        a timestamp t such that start <= t < stop.'''
+        history = self.history
+        result = []
+        for eid in history.ids_between(start, stop):
+            pos = history.position(eid)
+            if pos is not None:
+                result.append(pos + 1)
+        return result
+
+    def finish_command(self):
+        '''Record the time since the last line was added to the history
+        as its duration, called when the next prompt is shown.'''
+        if self._command is None:
+            return
+        eid, started = self._command
+        self._command = None
+        pos = self.history.position(eid)
+        if pos is not None:
+            self.history.set_duration(pos, time.time() - started)
 
     def set_history_length(self, value):
         log("set_history_length: old:%d new:%d"%(self._history_length, value))
         self._history_length = value
+        evicted = self._evict()
+        self.history_cursor = max(self.history_cursor - evicted, 0)
+
+    def _evict(self):
+        '''Remove the oldest entries until at most history_length are
+        left, a history_length of zero or less means no limit. Returns the
+        number of entries removed.'''
+        count = len(self.history) - self._history_length
+        if self._history_length <= 0 or count <= 0:
+            return 0
+        self._uncount(range(count))
+        self.history.evict(count)
+        return count
 
     def get_history_cursor(self):
         value = self._history_cursor
@@ -71,59 +185,759 @@ class LineHistory(object):
 
     def clear_history(self):
         '''Clear readline history.'''
-        self.history[:] = []
+        self.history.close()
+        self.history = HistoryStore()
         self.history_cursor = 0
+        self._clear_indexes()
+        self._journal_flushed = 0
+
+    def _clear_indexes(self):
+        self._index.clear()
+        self._duplicates.clear()
+        self._prefixes.clear()
+        del self._match_stack[:]
+        self._frecency.clear()
+        self._stats.clear()
+
+    def _sync_index(self, index, first=0):
+        '''Add the history entries added since the last call to index.
+        Entries are indexed by id, starting at id first at the earliest.
+        The index is rebuilt from the oldest entry when the text of evicted
+        entries has been dropped.'''
+        history = self.history
+        if (index.size > history.id_count() or index.size < first or
+                getattr(index, "generation", None) != history.generation):
+            index.clear(max(history.first_id(), first))
+            index.generation = history.generation
+        for text in history.iter_text_by_id(index.size, history.id_count()):
+            index.add(text)
+
+    def _sync_trigrams(self, first):
+        '''Bring the trigram index up to date. The postings of the lines
+        of a large history file are saved next to it once they have been
+        built, and loaded instead of built again in later sessions.'''
+        index = self._index
+        history = self.history
+        base = history.base
+        signature = getattr(base, "signature", None)
+        if signature is None or index.signature == signature:
+            self._sync_index(index, first)
+            return
+        filename = trigram_name(base.filename)
+        if index.size == 0 and history.generation == 0:
+            if index.load(filename, signature):
+                index.generation = history.generation
+                log("trigram index of %d lines loaded"%index.size)
+        self._sync_index(index, first)
+        if (index.signature != signature and index.first == 0 and
+                len(base) >= historyfile.SIDECAR_MIN_LINES):
+            try:
+                index.save(filename, signature, len(base))
+            except (IOError, OSError):
+                log("could not save trigram index to %s"%filename)
+
+    def _sync_frecency(self):
+        '''Count the uses of the entries added since the last call. Unlike
+        the other indexes scores are kept when entries are evicted.'''
+        history = self.history
+        frecency = self._frecency
+        frecency.size = max(min(frecency.size, history.id_count()),
+                            history.first_id())
+        for text in history.iter_text_by_id(frecency.size,
+                                            history.id_count()):
+            frecency.add(text)
+
+    def _sync_stats(self):
+        '''Count the entries added since the last call, see HistoryStats.
+        Entries deleted or evicted before they were counted are skipped.'''
+        history = self.history
+        stats = self._stats
+        start = max(stats.size, history.first_id())
+        stop = history.id_count()
+        entries = zip(history.iter_text_by_id(start, stop),
+                      history.iter_time_by_id(start, stop))
+        for eid, (text, timestamp) in enumerate(entries, start):
+            if history.position(eid) is not None:
+                stats.add(text, timestamp)
+        stats.size = stop
+
+    def _uncount(self, positions):
+        '''Remove the entries at positions, in increasing order, from the
+        statistics before they leave the history.'''
+        history = self.history
+        stats = self._stats
+        for pos in positions:
+            eid = history.entry_id(pos)
+            if eid >= stats.size:
+                break
+            stats.remove(history.get_text_by_id(eid),
+                         history.get_meta_by_id(eid)[0])
+
+    def history_stats(self, n=10):
+        '''Return a dict with the total number of entries, the number of
+        distinct entries, the n most used entries with their counts, and
+        the number of entries added in each hour of the day, local time.
+        The statistics are kept up to date as entries come and go.'''
+        self._merge_shared()
+        self._sync_stats()
+        stats = self._stats
+        return {"total": stats.total, "distinct": len(stats.counts),
+                "top": stats.top(n), "hours": list(stats.hours)}
+
+    def _matches(self, searchfor):
+        '''Return the sorted ids of the entries containing searchfor, or
+        None for an empty searchfor. Deleted entries may be included.
+
+        The matches of the last searches are kept on a stack. When an
+        incremental search query grows only the matches of the shorter
+        query are checked, and deleting a character of the query brings
+        back the matches found before it was typed. Entries read from a
+        history database are not indexed, they are found with
+        HistoryDatabase.search.'''
+        if not searchfor:
+            return None
+        history = self.history
+        base = history.base
+        if hasattr(base, "search"):
+            first = len(base)
+        else:
+            first = 0
+        self._sync_trigrams(first)
+        key = (history.id_count(), len(history))
+        stack = self._match_stack
+        if stack and stack[-1][0] != key:
+            del stack[:]
+        while stack and not searchfor.startswith(stack[-1][1]):
+            stack.pop()
+        if stack and stack[-1][1] == searchfor:
+            return stack[-1][2]
+        ids = self._index.exact(searchfor)
+        if ids is None:
+            ids = self._index.candidates(searchfor)
+            if stack:
+                found = stack[-1][2]
+                found = found[bisect_left(found, first):]
+                if len(found) < len(ids):
+                    ids = found
+            get_text = history.get_text_by_id
+            ids = [eid for eid in ids if searchfor in get_text(eid)]
+        if first:
+            ids = base.search(searchfor) + list(ids)
+        stack.append((key, searchfor, ids))
+        return ids
+
+    def forget_search_matches(self):
+        '''Drop the matches kept by _matches, called when an incremental
+        search ends.'''
+        del self._match_stack[:]
+        if self._archive_results is not None:
+            self._archive_results.close()
+            self._archive_results = None
+        self.last_archive_search_for = None
+
+    def _find(self, searchfor, startpos, direction):
+        '''Return the index of the nearest history entry containing
+        searchfor, starting at startpos and moving in direction. Reverse
+        searches never reach the first entry. Returns None if there is no
+        match.'''
+        history = self.history
+        if direction < 0:
+            startpos = min(startpos, len(history) - 1)
+            if startpos <= 0:
+                return None
+        elif startpos >= len(history):
+            return None
+        ids = self._matches(searchfor)
+        if ids is None:
+            return startpos
+        if direction < 0:
+            stop = history.entry_id(0)
+            i = bisect_right(ids, history.entry_id(startpos)) - 1
+            while i >= 0 and ids[i] > stop:
+                pos = history.position(ids[i])
+                if pos is not None:
+                    return pos
+                i -= 1
+        else:
+            i = bisect_left(ids, history.entry_id(startpos))
+            while i < len(ids):
+                pos = history.position(ids[i])
+                if pos is not None:
+                    return pos
+                i += 1
+        return None
 
     def read_history_file(self, filename=None): 
-        '''Load a readline history file.'''
+        '''Load a readline history file, plain, compressed or a database.
+
+        If the history is empty only the offsets and bytes of the lines of
+        the file are kept and lines are decoded when they are used, see
+        MappedHistoryFile. Only the index of a compressed
+        file is read, its blocks are decompressed when they are used. Lines
+        of a database are read with a query when they are used.'''
         if filename is None:
             filename = self.history_filename
+        self._database_key = None
+        #Lines read from the file are not written back to it
+        modes = self.history_shared, self.history_writer
+        self.history_shared = self.history_writer = False
         try:
-            for line in open(filename, 'r'):
-                self.add_history(lineobj.ReadLineTextBuffer(ensure_unicode(line.rstrip())))
-        except IOError:
-            self.history = []
-            self.history_cursor = 0
+            if len(self.history) == 0:
+                self.history.close()
+                self.history = HistoryStore(open_history_file(
+                    filename, self._history_length,
+                    self._get_history_control(), self.history_timestamps))
+                self._clear_indexes()
+                self._evict()
+                self.history_cursor = len(self.history)
+                nlines = self.history.base.nlines
+            else:
+                bare = self.history_timestamps
+                lines, metas = split_meta(read_history_lines(filename), bare)
+                for line, meta in zip(lines, metas):
+                    if meta is not None:
+                        meta = parse_meta(meta, bare)
+                    self._add_history(lineobj.ReadLineTextBuffer(
+                        ensure_unicode(line.rstrip())), meta)
+                nlines = len(lines)
+        except (IOError, OSError):
+            self.history_shared, self.history_writer = modes
+            self.clear_history()
+            if filename == self.history_filename:
+                self._reset_shared()
+        else:
+            self.history_shared, self.history_writer = modes
+            if filename == self.history_filename:
+                self._journal_flushed = self.history.id_count()
+                self._journal_lines = nlines
+                self._reset_shared()
+                if self.history_frecency:
+                    self._frecency.load(frecency_name(filename),
+                                        self.history.id_count())
+
+    def import_history(self, filename, format=None):
+        '''Add the entries of the history file of another shell, "bash",
+        "zsh" or "fish", guessed from the file if format is None. Returns
+        the number of entries added.
+
+        The file is read a line at a time and history_control is applied
+        as the entries come in, so only the entries kept are held in
+        memory. They are saved like lines added with add_history.'''
+        if format is None:
+            format = detect_format(filename)
+        reader = importers[format]
+        history = self.history
+        first = history.id_count()
+        fp = open(filename, 'rb')
+        try:
+            self._merge_shared()
+            self._add_entries(reader(fp))
+        finally:
+            fp.close()
+        positions = range(history.first_position(first), len(history))
+        texts = [history.get_text(i) for i in positions]
+        if texts:
+            database = self._get_database()
+            if database is not None:
+                saved = self._append_database(database, texts)
+            elif self.history_shared:
+                saved = self._append_shared(texts, [history.get_meta(i) for
+                                                    i in positions])
+            else:
+                saved = False
+            if saved:
+                self._journal_flushed = history.id_count()
+                self._journal_lines += len(texts)
+        self.history_cursor = len(history)
+        log("import_history: %d %s entries from %s"%(len(texts), format,
+                                                     filename))
+        return len(texts)
+
+    def _add_entries(self, entries):
+        '''Append the (text, meta) pairs of entries to the history as
+        add_history would, without saving them.'''
+        control = self._get_history_control()
+        history = self.history
+        ignorespace = "ignorespace" in control
+        ignoredups = "ignoredups" in control
+        erasedups = "erasedups" in control
+        last = history.get_text(-1) if len(history) else None
+        #Evicting in batches leaves the same entries as evicting each time
+        batch = self._history_length + 1024
+        pending = 0
+        for text, meta in entries:
+            if not text or (ignorespace and text[0] == " "):
+                continue
+            if ignoredups and text == last:
+                continue
+            if erasedups:
+                self._erase_duplicates(text)
+            history.append(text, meta)
+            last = text
+            pending += 1
+            if pending == batch:
+                self._evict()
+                pending = 0
+        self._evict()
+        if self.history_frecency:
+            self._sync_frecency()
 
     def write_history_file(self, filename = None): 
-        '''Save a readline history file.'''
+        '''Save a readline history file.
+
+        In journal mode the default history file is never rewritten, only
+        the lines added since the last save are appended to it. With
+        history_writer this is done by a background thread, see
+        _flush_writer. With history_compression the file is written as
+        zlib compressed blocks, see CompressedHistoryFile. Lines are
+        inserted into a history database as they are added, so saving it
+        only compacts it.'''
         if filename is None:
             filename = self.history_filename
+        if filename == self.history_filename:
+            self._save_frecency()
+            if self._get_database() is not None:
+                self._flush_journal()
+                return
+            if self.history_writer and not self.history_shared:
+                self._flush_writer()
+                return
+        if ((self.history_journal or self.history_shared) and
+                filename == self.history_filename):
+            self._flush_journal()
+            return
+        if self.history.is_mapped(filename):
+            self.history.unmap()
+        history = self.history
+        positions = range(len(history))[-self.history_length:]
+        lines = [ensure_str(history.get_text(i)) for i in positions]
+        if self._is_database_file(filename):
+            database = HistoryDatabase(filename)
+            try:
+                database.replace(lines)
+            finally:
+                database.close()
+            return
+        remove_sidecar(filename)
         fp = open(filename, 'wb')
-        for line in self.history[-self.history_length:]:
-            fp.write(ensure_str(line.get_line_text()))
-            fp.write('\n'.encode('ascii'))
+        if self._compressed_writes():
+            write_compressed(fp, lines)
+        else:
+            self._write_lines(fp, self._stamp(lines, positions))
+        fp.close()
+
+    def append_history_file(self, nelements, filename=None):
+        '''Append the last nelements items of the history to a file.'''
+        if filename is None:
+            filename = self.history_filename
+        if nelements <= 0:
+            return
+        history = self.history
+        positions = range(len(history))[-nelements:]
+        lines = [ensure_str(history.get_text(i)) for i in positions]
+        if self._is_database_file(filename):
+            database = HistoryDatabase(filename)
+            try:
+                database.append(lines)
+            finally:
+                database.close()
+            return
+        if is_compressed(filename):
+            if history.is_mapped(filename):
+                history.unmap()
+            append_compressed(filename, lines)
+            return
+        fp = open(filename, 'ab')
+        if self._compressed_writes() and fp.tell() == 0:
+            write_compressed(fp, lines)
+        else:
+            self._write_lines(fp, self._stamp(lines, positions))
         fp.close()
 
+    def _is_database_file(self, filename):
+        '''Return True if filename is a history database, or should become
+        one because history_database is set and it is missing or empty.'''
+        if self.history_database:
+            try:
+                if os.path.getsize(filename) == 0:
+                    return True
+            except OSError:
+                return True
+        return is_database(filename)
+
+    def _get_database(self):
+        '''Return the open history database if the default history file is
+        one, or None.'''
+        key = (self.history_filename, self.history_database)
+        if key != self._database_key:
+            if self._database is not None:
+                self._database.close()
+                self._database = None
+            self._database_key = key
+            if self._is_database_file(self.history_filename):
+                try:
+                    self._database = HistoryDatabase(self.history_filename)
+                except IOError:
+                    log("could not open history database %s"%
+                        self.history_filename)
+        return self._database
+
+    def _append_database(self, database, lines):
+        try:
+            database.append(lines)
+        except IOError:
+            log("could not add to history database %s"%database.filename)
+            return False
+        return True
+
+    def _compressed_writes(self):
+        '''A shared history file is kept as plain text, see _merge_shared.'''
+        return self.history_compression and not self.history_shared
+
+    def _save_frecency(self):
+        if self.history_frecency:
+            self._sync_frecency()
+            try:
+                self._frecency.save(frecency_name(self.history_filename))
+            except (IOError, OSError):
+                log("could not save frecency scores")
+
+    def _write_lines(self, fp, lines):
+        for line in lines:
+            fp.write(ensure_str(line))
+            fp.write('\n'.encode('ascii'))
+
+    def _stamp(self, lines, positions=None, metas=None):
+        '''Return lines with a metadata line before each of them if
+        history_timestamps is set, taken from metas or from the history
+        entries at positions. Entries without a timestamp get none.'''
+        if not self.history_timestamps:
+            return lines
+        if metas is None:
+            metas = [self.history.get_meta(i) for i in positions]
+        return join_meta(lines, [format_meta(meta) if meta[0] else None
+                                 for meta in metas])
+
+    def _flush_journal(self):
+        '''Append the lines added since the last flush to the history file
+        and compact the file once it holds twice history_length lines. In
+        shared mode and for a database lines are saved as they are added,
+        so only the compaction is left to do unless the file could not be
+        shared.'''
+        history = self.history
+        pending = len(history) - history.first_position(self._journal_flushed)
+        saved = ((self.history_shared and self._shared_offset is not None) or
+                 self._get_database() is not None)
+        if pending > 0 and not saved:
+            self.append_history_file(pending)
+            self._journal_lines += pending
+        self._journal_flushed = history.id_count()
+        if 0 < self.history_length < self._journal_lines // 2:
+            self.compact_history_file()
+
+    def _get_writer(self):
+        '''Return the background writer of the history file, starting it
+        if needed.'''
+        writer = self._writer
+        if (writer is None or not writer.is_alive() or
+                writer.filename != self.history_filename):
+            if writer is not None:
+                writer.close(0)
+            writer = self._writer = HistoryWriter(self.history_filename)
+        writer.interval = self.history_writer_interval
+        writer.batch = self.history_writer_batch
+        writer.compressed = self._compressed_writes()
+        writer.archive = self._get_archive()
+        writer.bare = self.history_timestamps
+        return writer
+
+    def _get_archive(self):
+        '''Return the archive of the history file if history_archive is
+        set, or None.'''
+        if not self.history_archive:
+            return None
+        dirname = archive_name(self.history_filename)
+        archive = self._archive
+        if archive is None or archive.dirname != dirname:
+            if archive is not None:
+                archive.close()
+            archive = self._archive = HistoryArchive(dirname)
+        archive.workers = self.history_archive_workers
+        return archive
+
+    def _flush_writer(self):
+        '''Hand the lines not yet saved to the background writer, queue a
+        compaction once the file holds twice history_length lines, and wait
+        at most history_writer_timeout seconds for the writer to finish.
+        Whatever is left is written in the background if the interpreter
+        keeps running.'''
+        history = self.history
+        writer = self._get_writer()
+        first = history.first_position(self._journal_flushed)
+        positions = range(first, len(history))
+        for line in self._stamp([history.get_text(i) for i in positions],
+                                positions):
+            writer.append(line)
+        self._journal_lines += len(history) - first
+        self._journal_flushed = history.id_count()
+        if 0 < self.history_length < self._journal_lines // 2:
+            if history.is_mapped(self.history_filename):
+                history.unmap()
+            writer.compact(self.history_length)
+            self._journal_lines = self.history_length
+        if not writer.flush(self.history_writer_timeout):
+            log("history writer still busy after %gs"%
+                self.history_writer_timeout)
+
+    def compact_history_file(self, filename=None):
+        '''Truncate a history file to its last history_length lines.
+
+        Lines appended by other sessions are kept. The result is written to
+        a temporary file that is renamed over the original, so a crash
+        leaves either the old or the new file behind. The default history
+        file is compacted holding the history lock in shared mode.'''
+        if filename is None:
+            filename = self.history_filename
+        if self.history_shared and filename == self.history_filename:
+            lock = HistoryLock(filename)
+            lock.acquire()
+            try:
+                self._merge_shared()
+                self._compact_history_file(filename)
+                self._reset_shared()
+            finally:
+                lock.release()
+        else:
+            self._compact_history_file(filename)
+
+    def _compact_history_file(self, filename):
+        if is_database(filename):
+            try:
+                database = HistoryDatabase(filename)
+                try:
+                    nlines = database.compact(self.history_length)
+                finally:
+                    database.close()
+            except IOError:
+                return
+            if filename == self.history_filename:
+                self._journal_lines = nlines
+            return
+        if self.history.is_mapped(filename):
+            self.history.unmap()
+        try:
+            nlines = compact_file(filename, self.history_length,
+                                  self._compressed_writes(),
+                                  self._get_archive(),
+                                  self.history_timestamps)
+        except (IOError, OSError):
+            log("could not compact history file %s"%filename)
+            return
+        if filename == self.history_filename:
+            self._journal_lines = nlines
+
+    def _reset_shared(self):
+        '''Start merging the lines appended to the history file at its
+        current end, or from its start if it does not exist yet. A
+        compressed file or a database is not shared.'''
+        filename = self.history_filename
+        self._shared_offset = None
+        if (not self.history_shared or is_compressed(filename) or
+                is_database(filename)):
+            return
+        try:
+            self._shared_identity = file_identity(filename)
+            self._shared_offset = os.path.getsize(filename)
+        except OSError:
+            if not os.path.exists(filename):
+                self._shared_identity = None
+                self._shared_offset = 0
+
+    def _merge_shared(self):
+        '''Add the lines other sessions appended to the history file since
+        the last merge, called before the history is used in shared mode.
+        Only the new tail of the file is read, see read_tail. If another
+        session has rewritten the file, the lines of the new file after
+        those this session already has are added.'''
+        if not self.history_shared or self._shared_offset is None:
+            return
+        filename = self.history_filename
+        try:
+            lines, self._shared_offset, self._shared_identity, replaced = \
+                read_tail(filename, self._shared_offset,
+                          self._shared_identity)
+            if replaced and (is_compressed(filename) or
+                             is_database(filename)):
+                self._shared_offset = None
+                return
+        except (IOError, OSError):
+            return
+        bare = self.history_timestamps
+        lines, metas = split_meta(lines, bare)
+        if replaced:
+            self._journal_lines = len(lines)
+        else:
+            self._journal_lines += len(lines)
+        entries = [(ensure_unicode(line.rstrip()), meta)
+                   for line, meta in zip(lines, metas) if line.strip()]
+        if replaced:
+            entries = entries[self._known_prefix([text for text, meta in
+                                                  entries]):]
+        if not entries:
+            return
+        history = self.history
+        at_end = self.history_cursor >= len(history)
+        for text, meta in entries:
+            history.append(text, meta and parse_meta(meta, bare))
+        evicted = self._evict()
+        if at_end:
+            self.history_cursor = len(history)
+        else:
+            self.history_cursor = max(self.history_cursor - evicted, 0)
+        self._journal_flushed = history.id_count()
+        log("merged %d shared history lines"%len(entries))
+
+    def _known_prefix(self, texts):
+        '''Return the length of the longest start of texts equal to the
+        last entries of the history, the lines of a rewritten history file
+        that this session already has.'''
+        history = self.history
+        count = min(len(texts), len(history))
+        recent = [history.get_text(i) for i in
+                  range(len(history) - count, len(history))]
+        for start in range(count):
+            if (recent[start] == texts[0] and
+                    recent[start:] == texts[:count - start]):
+                return count - start
+        return 0
+
+    def _append_shared(self, texts, metas):
+        '''Append texts, with their metadata metas, to the history file
+        holding the history lock, after merging the lines other sessions
+        added before it. Returns False if the lines could not be written.'''
+        filename = self.history_filename
+        if is_compressed(filename) or is_database(filename):
+            return False
+        lock = HistoryLock(filename)
+        try:
+            lock.acquire()
+            try:
+                if self._shared_offset is None:
+                    self._reset_shared()
+                else:
+                    self._merge_shared()
+                fp = open(filename, 'ab')
+                try:
+                    self._write_lines(fp, self._stamp(texts, metas=metas))
+                    offset = fp.tell()
+                finally:
+                    fp.close()
+                self._shared_identity = file_identity(filename)
+                self._shared_offset = offset
+            finally:
+                lock.release()
+        except (IOError, OSError):
+            log("could not append to shared history file %s"%filename)
+            return False
+        return True
+
+    def _get_history_control(self):
+        control = set(self.history_control.split(":"))
+        if "ignoreboth" in control:
+            control.update(["ignorespace", "ignoredups"])
+        return control
+
+    def _erase_duplicates(self, text):
+        '''Delete all history entries equal to text.'''
+        history = self.history
+        self._sync_index(self._duplicates)
+        for eid in self._duplicates.pop(text, history.get_text_by_id):
+            pos = history.position(eid)
+            if pos is not None:
+                self._uncount([pos])
+                del history[pos]
 
     def add_history(self, line):
-        '''Append a line to the history buffer, as if it was the last line typed.'''
+        '''Append a line to the history buffer, as if it was the last line typed.
+
+        Which lines are saved is controlled by history_control, a colon
+        separated list of values as for the bash HISTCONTROL variable:
+        ignorespace, ignoredups, ignoreboth and erasedups.
+
+        With history_shared the line is appended to the history file at
+        once, so that other sessions using the file see it. With
+        history_writer it is queued for the background writer. If the
+        history file is a database the line is inserted into it.
+
+        The time it was added, the working directory and history_session
+        are kept with the line, see get_history_metadata.'''
+        try:
+            cwd = ensure_unicode(os.getcwd())
+        except OSError:
+            cwd = ""
+        meta = (time.time(), -1.0, cwd, self.history_session)
+        if self._add_history(line, meta):
+            self._command = (self.history.id_count() - 1, meta[0])
+
+    def _add_history(self, line, meta=None):
+        '''Add line with its metadata meta, returns True unless
+        history_control left it out.'''
         line = ensure_unicode(line)
         if not hasattr(line, "get_line_text"):
             line = lineobj.ReadLineTextBuffer(line)
-        if not line.get_line_text():
+        text = line.get_line_text()
+        control = self._get_history_control()
+        self._merge_shared()
+        added = False
+        if not text:
+            pass
+        elif "ignorespace" in control and text[0] == " ":
             pass
-        elif len(self.history) > 0 and self.history[-1].get_line_text() == line.get_line_text():
+        elif ("ignoredups" in control and len(self.history) > 0 and
+                self.history.get_text(-1) == text):
             pass
         else:
-            self.history.append(line)
+            added = True
+            database = self._get_database()
+            saved = (database is None and self.history_shared and
+                     self._append_shared([text],
+                                         [meta or HistoryMetadata.unknown]))
+            if "erasedups" in control:
+                self._erase_duplicates(text)
+            self.history.append(text, meta)
+            if database is not None:
+                saved = self._append_database(database, [text])
+            elif self.history_writer and not saved:
+                writer = self._get_writer()
+                for line in self._stamp([text], metas=[meta or
+                                        HistoryMetadata.unknown]):
+                    writer.append(line)
+                saved = True
+            if saved:
+                self._journal_flushed = self.history.id_count()
+                self._journal_lines += 1
+            if self.history_frecency:
+                self._sync_frecency()
+            self._evict()
         self.history_cursor = len(self.history)
+        return added
 
     def previous_history(self, current): # (C-p)
         '''Move back through the history list, fetching the previous command. '''
+        self._merge_shared()
         if self.history_cursor == len(self.history):
             self.history.append(current.copy()) #do not use add_history since we do not want to increment cursor
             
         if self.history_cursor > 0:
             self.history_cursor -= 1
-            current.set_line(self.history[self.history_cursor].get_line_text())
+            current.set_line(self.history.get_text(self.history_cursor))
             current.point = lineobj.EndOfLine
 
     def next_history(self, current): # (C-n)
         '''Move forward through the history list, fetching the next command. '''
         if self.history_cursor < len(self.history) - 1:
             self.history_cursor += 1
-            current.set_line(self.history[self.history_cursor].get_line_text())
+            current.set_line(self.history.get_text(self.history_cursor))
 
     def beginning_of_history(self): # (M-<)
         '''Move to the first line in the history.'''
@@ -135,31 +949,30 @@ class LineHistory(object):
         '''Move to the end of the input history, i.e., the line currently
         being entered.'''
         self.history_cursor = len(self.history)
-        current.set_line(self.history[-1].get_line_text())
+        current.set_line(self.history.get_text(-1))
 
     def reverse_search_history(self, searchfor, startpos=None):
+        self._merge_shared()
         if startpos is None:
             startpos = self.history_cursor
         origpos = startpos
 
         result =  lineobj.ReadLineTextBuffer("")
 
-        for idx, line in list(enumerate(self.history))[startpos:0:-1]:
-            if searchfor in line:
-                startpos = idx
-                break
+        idx = self._find(searchfor, startpos, -1)
+        if idx is not None:
+            startpos = idx
 
         #If we get a new search without change in search term it means
         #someone pushed ctrl-r and we should find the next match
         if self.last_search_for == searchfor and startpos > 0:
             startpos -= 1
-            for idx, line in list(enumerate(self.history))[startpos:0:-1]:
-                if searchfor in line:
-                    startpos = idx
-                    break
+            idx = self._find(searchfor, startpos, -1)
+            if idx is not None:
+                startpos = idx
 
         if self.history:                    
-            result = self.history[startpos].get_line_text()
+            result = self.history.get_text(startpos)
         else:
             result = ""
         self.history_cursor = startpos
@@ -168,71 +981,299 @@ class LineHistory(object):
         return result
         
     def forward_search_history(self, searchfor, startpos=None):
+        self._merge_shared()
         if startpos is None:
             startpos = min(self.history_cursor, max(0, self.get_current_history_length()-1))
         origpos = startpos
         
         result =  lineobj.ReadLineTextBuffer("")
 
-        for idx, line in list(enumerate(self.history))[startpos:]:
-            if searchfor in line:
-                startpos = idx
-                break
+        idx = self._find(searchfor, startpos, 1)
+        if idx is not None:
+            startpos = idx
 
         #If we get a new search without change in search term it means
         #someone pushed ctrl-r and we should find the next match
         if self.last_search_for == searchfor and startpos < self.get_current_history_length()-1:
             startpos += 1
-            for idx, line in list(enumerate(self.history))[startpos:]:
-                if searchfor in line:
-                    startpos = idx
-                    break
+            idx = self._find(searchfor, startpos, 1)
+            if idx is not None:
+                startpos = idx
 
         if self.history:                    
-            result = self.history[startpos].get_line_text()
+            result = self.history.get_text(startpos)
         else:
             result = ""
         self.history_cursor = startpos
         self.last_search_for = searchfor
         return result
 
+    def _find_regex(self, regex, startpos, direction):
+        '''Return the index of the nearest history entry regex matches,
+        starting at startpos and moving in direction, or None.'''
+        history = self.history
+        if direction < 0:
+            positions = range(min(startpos, len(history) - 1), -1, -1)
+        else:
+            positions = range(max(startpos, 0), len(history))
+        search = regex.search
+        get_text = history.get_text
+        for pos in positions:
+            if search(get_text(pos)):
+                return pos
+        return None
+
+    def _regex_search(self, pattern, direction, startpos):
+        self._merge_shared()
+        if startpos is None:
+            startpos = self.history_cursor
+        regex = self._patterns.compile(pattern, re.UNICODE)
+        #Searching again for the same pattern moves on to the next match
+        if self.last_regex_search_for == pattern:
+            startpos += direction
+        idx = self._find_regex(regex, startpos, direction)
+        if idx is not None:
+            self.history_cursor = idx
+        self.last_regex_search_for = pattern
+        if 0 <= self.history_cursor < len(self.history):
+            return self.history.get_text(self.history_cursor)
+        return ""
+
+    def reverse_regex_search_history(self, pattern, startpos=None):
+        '''Return the nearest history entry at or before startpos that the
+        regular expression pattern matches. A pattern that does not
+        compile, for instance because it is not fully typed yet, is matched
+        literally. Compiled patterns are kept in a PatternCache.'''
+        return self._regex_search(pattern, -1, startpos)
+
+    def forward_regex_search_history(self, pattern, startpos=None):
+        '''Like reverse_regex_search_history, searching forward.'''
+        return self._regex_search(pattern, 1, startpos)
+
+    def _find_prefix(self, prefix, current, direction):
+        '''Return the index of the nearest history entry before or after
+        the history cursor that starts with prefix and is not equal to
+        current, or None. Entries read from a history database are not
+        indexed, they are found with HistoryDatabase.prefix_search.'''
+        history = self.history
+        base = history.base
+        first = len(base) if hasattr(base, "prefix_search") else 0
+        self._sync_index(self._prefixes, first)
+        ids = self._prefixes.matches(prefix, history.get_text_by_id)
+        if first:
+            ids = base.prefix_search(prefix) + list(ids)
+        cursor = self.history_cursor
+        if cursor < 0:
+            cursor_id = -1
+        elif cursor < len(history):
+            cursor_id = history.entry_id(cursor)
+        else:
+            cursor_id = history.id_count()
+        if direction < 0:
+            i = bisect_left(ids, cursor_id) - 1
+            step = -1
+        else:
+            i = bisect_right(ids, cursor_id)
+            step = 1
+        while 0 <= i < len(ids):
+            pos = history.position(ids[i])
+            if pos is not None and history.get_text(pos) != current:
+                return pos
+            i += step
+        return None
+
+    def fuzzy_matches(self, query, limit=None):
+        '''Return the positions of the history entries best matching the
+        characters of query in order, best first. Ties go to the newest
+        entry and only the newest of equal entries is returned. The match
+        ignores case unless query has upper case characters.
+
+        All candidate entries are scored unless fuzzy_scan is set, then
+        only the newest fuzzy_scan of them are, so a search takes about as
+        long however large the history is but may miss older matches.'''
+        if limit is None:
+            limit = self.fuzzy_limit
+        history = self.history
+        fold = (query == query.lower())
+        if fold:
+            query = query.lower()
+        best = fuzzy_best_score(query)
+        heap = []
+        seen = set()
+        candidates = self._fuzzy_candidates(query, fold, self.fuzzy_scan)
+        for eid in islice(candidates, self.fuzzy_scan):
+            if history.position(eid) is None:
+                continue
+            text = history.get_text_by_id(eid)
+            if text in seen:
+                continue
+            if fold:
+                score = fuzzy_score(query, text.lower())
+            else:
+                score = fuzzy_score(query, text)
+            if score is None:
+                continue
+            if len(heap) < limit:
+                heapq.heappush(heap, (score, eid))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, eid))
+            else:
+                continue
+            seen.add(text)
+            if len(heap) == limit and heap[0][0] >= best:
+                break
+        heap.sort(reverse=True)
+        return [history.position(eid) for score, eid in heap]
+
+    def _fuzzy_candidates(self, query, fold, limit):
+        '''Generate the ids of the entries that may match query, newest
+        first. Entries are looked up in the trigram index under the rarest
+        character of query, see TrigramIndex.fuzzy_candidates, or for a
+        history database found with HistoryDatabase.fuzzy_search, which
+        returns no more than the newest limit rows if limit is not None.'''
+        base = self.history.base
+        first = len(base) if hasattr(base, "fuzzy_search") else 0
+        self._sync_trigrams(first)
+        index = self._index
+        plists = index.fuzzy_candidates(query, fold)
+        if plists is None:
+            ids = range(index.size - 1, index.first - 1, -1)
+        else:
+            ids = newest_first(plists)
+        found = 0
+        for eid in ids:
+            found += 1
+            yield eid
+        if first and (limit is None or found < limit):
+            if limit is not None:
+                limit -= found
+            for eid in reversed(base.fuzzy_search(query, fold, limit)):
+                yield eid
+
+    def fuzzy_search_history(self, searchfor):
+        '''Return the history entry best matching the characters of
+        searchfor in order, see fuzzy_matches. Searching again for the
+        same string returns the next best entry. Every entry that may match
+        is scored, set fuzzy_scan to only score the newest ones in a very
+        large history.'''
+        self._merge_shared()
+        if searchfor != self.last_fuzzy_search_for:
+            self._fuzzy_results = self.fuzzy_matches(searchfor)
+            self._fuzzy_rank = 0
+        elif self._fuzzy_rank < len(self._fuzzy_results) - 1:
+            self._fuzzy_rank += 1
+        self.last_fuzzy_search_for = searchfor
+        if not self._fuzzy_results:
+            return ""
+        self.history_cursor = self._fuzzy_results[self._fuzzy_rank]
+        return self.history.get_text(self.history_cursor)
+
+    def search_all_history(self, searchfor):
+        '''Generate the distinct history lines containing searchfor, most
+        recent first. The history is searched before the lines archived
+        when the history file was compacted, see HistoryArchive.'''
+        self._merge_shared()
+        seen = set()
+        ids = self._matches(searchfor) or []
+        history = self.history
+        for eid in reversed(ids):
+            if history.position(eid) is not None:
+                text = history.get_text_by_id(eid)
+                if text not in seen:
+                    seen.add(text)
+                    yield text
+        archive = self._get_archive()
+        if archive is None or not searchfor:
+            return
+        for text in archive.search(searchfor):
+            if text not in seen:
+                seen.add(text)
+                yield text
+
+    def archive_search_history(self, searchfor):
+        '''Return the most recent line containing searchfor in the history
+        or its archive, see search_all_history. Searching again for the
+        same string returns the next older line, or the last one found if
+        there is none.'''
+        if searchfor != self.last_archive_search_for:
+            if self._archive_results is not None:
+                self._archive_results.close()
+            self._archive_results = self.search_all_history(searchfor)
+            self._archive_line = ""
+            self.last_archive_search_for = searchfor
+        self._archive_line = next(self._archive_results, self._archive_line)
+        return self._archive_line
+
     def _search(self, direction, partial):
-        try:
-            if (self.lastcommand != self.history_search_forward and
-                    self.lastcommand != self.history_search_backward):
-                self.query = ''.join(partial[0:partial.point].get_line_text())
-            hcstart = max(self.history_cursor,0) 
+        self._merge_shared()
+        if (self.lastcommand != self.history_search_forward and
+                self.lastcommand != self.history_search_backward):
+            self.query = ''.join(partial[0:partial.point].get_line_text())
+            self._ranked = None
+        history = self.history
+        hcstart = max(self.history_cursor,0) 
+        if self.query and self.history_frecency:
+            return self._search_frecent(direction, partial)
+        if not self.query:
             hc = self.history_cursor + direction
-            while (direction < 0 and hc >= 0) or (direction > 0 and hc < len(self.history)):
-                h = self.history[hc]
-                if not self.query:
-                    self.history_cursor = hc
-                    result = lineobj.ReadLineTextBuffer(h, point=len(h.get_line_text()))
-                    return result
-                elif (h.get_line_text().startswith(self.query) and (h != partial.get_line_text())):
-                    self.history_cursor = hc
-                    result = lineobj.ReadLineTextBuffer(h, point=partial.point)
-                    return result
-                hc += direction
-            else:
-                if len(self.history) == 0:
-                    pass 
-                elif hc >= len(self.history) and not self.query:
-                    self.history_cursor = len(self.history)
-                    return lineobj.ReadLineTextBuffer("", point=0)
-                elif self.history[max(min(hcstart, len(self.history) - 1), 0)]\
-                        .get_line_text().startswith(self.query) and self.query:
-                    return lineobj.ReadLineTextBuffer(self.history\
-                            [max(min(hcstart, len(self.history) - 1),0)],
-                                point = partial.point)
-                else:                
-                    return lineobj.ReadLineTextBuffer(partial, 
-                                                      point=partial.point)
-                return lineobj.ReadLineTextBuffer(self.query, 
-                                                  point=min(len(self.query),
-                                                  partial.point))
-        except IndexError:
-            raise
+            if 0 <= hc < len(history):
+                self.history_cursor = hc
+                text = history.get_text(hc)
+                return lineobj.ReadLineTextBuffer(text, point=len(text))
+        else:
+            hc = self._find_prefix(self.query, partial.get_line_text(),
+                                   direction)
+            if hc is not None:
+                self.history_cursor = hc
+                return lineobj.ReadLineTextBuffer(history.get_text(hc),
+                                                  point=partial.point)
+        if len(history) == 0:
+            pass 
+        elif direction > 0 and not self.query:
+            self.history_cursor = len(history)
+            return lineobj.ReadLineTextBuffer("", point=0)
+        else:
+            text = history.get_text(max(min(hcstart, len(history) - 1), 0))
+            if self.query and text.startswith(self.query):
+                return lineobj.ReadLineTextBuffer(text, point=partial.point)
+            return lineobj.ReadLineTextBuffer(partial, point=partial.point)
+        return lineobj.ReadLineTextBuffer(self.query, 
+                                          point=min(len(self.query),
+                                          partial.point))
+
+    def _search_frecent(self, direction, partial):
+        '''Step through the lines starting with self.query, most relevant
+        first, see FrecencyIndex. Moving forward past the most relevant
+        line brings back the line the search started from.'''
+        if self._ranked is None:
+            self._sync_frecency()
+            self._frecent_line = partial.get_line_text()
+            self._ranked = [text for text in self._frecency.ranked(self.query)
+                            if text != self._frecent_line]
+            self._rank = -1
+        rank = self._rank - direction
+        if rank >= len(self._ranked):
+            rank = len(self._ranked) - 1
+        self._rank = rank = max(rank, -1)
+        if rank < 0:
+            text = self._frecent_line
+        else:
+            text = self._ranked[rank]
+        if self.query:
+            point = min(partial.point, len(text))
+        else:
+            point = len(text)
+        return lineobj.ReadLineTextBuffer(text, point=point)
+
+    def relevant_history(self, partial):
+        '''Recall the lines starting with the text before point, most
+        relevant first. Every line is recalled once, repeating the command
+        moves to the next line.'''
+        self._merge_shared()
+        if self.lastcommand != self.relevant_history:
+            self.query = ''.join(partial[0:partial.point].get_line_text())
+            self._ranked = None
+        return self._search_frecent(-1, partial)
 
     def history_search_forward(self, partial): # ()
         '''Search forward through the history for the string of characters
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+from __future__ import print_function, unicode_literals, absolute_import
+import os, struct, tempfile, time, zlib
+from collections import deque
+
+from pyreadline.unicode_helper import ensure_unicode
+from pyreadline.logger import log
+from .historyindex import line_grams, query_grams
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+try:
+    from multiprocessing import cpu_count
+except ImportError:
+    cpu_count = lambda: 1
+
+_segment_magic = b"PRLHA1\n\0"
+_segment_header = struct.Struct(str("<8sIII"))
+_segment_suffix = ".seg"
+
+
+class BloomFilter(object):
+    '''Bloom filter of the grams of a set of lines, see line_grams.
+
+    Bit positions are derived from crc32 and adler32 of the gram so that
+    they are the same in every process and every python version.
+    '''
+    def __init__(self, nbits, nhashes=7, bits=None):
+        self.nbits = nbits
+        self.nhashes = nhashes
+        if bits is None:
+            bits = bytearray((nbits + 7) // 8)
+        self.bits = bits
+
+    @classmethod
+    def for_lines(cls, lines):
+        grams = set()
+        for line in lines:
+            grams.update(line_grams(line))
+        bloom = cls(max(64, 10 * len(grams)))
+        for gram in grams:
+            bloom.add(gram)
+        return bloom
+
+    def _positions(self, gram):
+        data = gram.encode("utf-8")
+        h1 = zlib.crc32(data) & 0xffffffff
+        h2 = (zlib.adler32(data) & 0xffffffff) | 1
+        return [(h1 + i * h2) % self.nbits for i in range(self.nhashes)]
+
+    def add(self, gram):
+        for pos in self._positions(gram):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, gram):
+        bits = self.bits
+        for pos in self._positions(gram):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def may_contain(self, query):
+        '''Return False if no line can contain query.'''
+        for gram in query_grams(query):
+            if gram not in self:
+                return False
+        return True
+
+
+def write_segment(dirname, lines):
+    '''Write lines, bytes without newlines, as a new archive segment in
+    dirname. The segment is written to a temporary file that is renamed
+    into place, and is never changed after that. Segment names sort by
+    the time they were written.'''
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    bloom = BloomFilter.for_lines([ensure_unicode(line) for line in lines])
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".segment-")
+    try:
+        fp = os.fdopen(fd, 'wb')
+        try:
+            fp.write(_segment_header.pack(_segment_magic, bloom.nbits,
+                                          bloom.nhashes, len(lines)))
+            fp.write(bytes(bloom.bits))
+            fp.write(b"\n".join(lines))
+        finally:
+            fp.close()
+        name = os.path.join(dirname, "%015d-%d%s"%(time.time() * 1000,
+                                                   os.getpid(), _segment_suffix))
+        os.rename(tmpname, name)
+    except:
+        os.remove(tmpname)
+        raise
+    log("write_segment: %d lines to %s"%(len(lines), name))
+    return name
+
+
+def _read_segment(path, with_lines):
+    fp = open(path, 'rb')
+    try:
+        magic, nbits, nhashes, nlines = \
+            _segment_header.unpack(fp.read(_segment_header.size))
+        if magic != _segment_magic:
+            raise IOError("not a history archive segment: %s"%path)
+        bloom = BloomFilter(nbits, nhashes,
+                            bytearray(fp.read((nbits + 7) // 8)))
+        lines = fp.read() if with_lines else None
+    finally:
+        fp.close()
+    return bloom, lines
+
+
+def search_segment(path, query):
+    '''Return the lines of the segment at path containing query, newest
+    first. Run in the worker processes of HistoryArchive.search.'''
+    try:
+        data = _read_segment(path, True)[1]
+    except (IOError, OSError, struct.error):
+        return []
+    lines = ensure_unicode(data).split("\n")
+    lines.reverse()
+    return [line for line in lines if query in line]
+
+
+class HistoryArchive(object):
+    '''Directory of immutable segments holding history lines dropped when
+    the history file is compacted.
+
+    Each segment starts with a bloom filter of the grams of its lines, so a
+    search only reads the segments that may hold a match. The remaining
+    segments are searched by up to workers processes, newest first, and the
+    results are returned in that order as they come in.
+    '''
+    def __init__(self, dirname, workers=2):
+        self.dirname = dirname
+        self.workers = workers
+        self._blooms = {}
+        self._executor = None
+
+    def segments(self):
+        '''Return the paths of the segments, newest first.'''
+        try:
+            names = os.listdir(self.dirname)
+        except OSError:
+            return []
+        names = [name for name in names if name.endswith(_segment_suffix)]
+        names.sort(reverse=True)
+        return [os.path.join(self.dirname, name) for name in names]
+
+    def add(self, lines):
+        if lines:
+            write_segment(self.dirname, lines)
+
+    def _bloom(self, path):
+        bloom = self._blooms.get(path)
+        if bloom is None:
+            try:
+                bloom = self._blooms[path] = _read_segment(path, False)[0]
+            except (IOError, OSError, struct.error):
+                log("HistoryArchive: could not read %s"%path)
+                return None
+        return bloom
+
+    def candidates(self, query):
+        '''Return the paths of the segments that may hold query, newest
+        first.'''
+        result = []
+        for path in self.segments():
+            bloom = self._bloom(path)
+            if bloom is not None and bloom.may_contain(query):
+                result.append(path)
+        return result
+
+    def _get_executor(self):
+        '''Return the pool of worker processes, or None if segments are
+        to be searched in this process. A single cpu gains nothing from
+        workers.'''
+        if self._executor is None and ProcessPoolExecutor is not None:
+            try:
+                if cpu_count() < 2:
+                    raise NotImplementedError("single cpu")
+                self._executor = ProcessPoolExecutor(self.workers)
+            except (OSError, NotImplementedError, ValueError):
+                log("HistoryArchive: no worker processes, searching serially")
+                self.workers = 0
+        return self._executor
+
+    def _result(self, future, path, query):
+        try:
+            return future.result()
+        except Exception:
+            log("HistoryArchive: worker failed, searching serially")
+            self.close()
+            self.workers = 0
+            return search_segment(path, query)
+
+    def search(self, query):
+        '''Generate the archived lines containing query, newest first.
+        Closing the generator cancels the segment searches not started.'''
+        paths = deque(self.candidates(query))
+        executor = None
+        if self.workers > 0 and len(paths) > 1:
+            executor = self._get_executor()
+        if executor is None:
+            for path in paths:
+                for line in search_segment(path, query):
+                    yield line
+            return
+        pending = deque()
+        try:
+            while pending or paths:
+                if self._executor is None:
+                    #A worker failed, search the rest in this process
+                    for future, path in pending:
+                        future.cancel()
+                    paths.extendleft(reversed([path for future, path in
+                                               pending]))
+                    pending.clear()
+                    for path in paths:
+                        for line in search_segment(path, query):
+                            yield line
+                    return
+                while paths and len(pending) < self.workers:
+                    path = paths.popleft()
+                    pending.append((executor.submit(search_segment, path,
+                                                    query), path))
+                future, path = pending.popleft()
+                for line in self._result(future, path, query):
+                    yield line
+        finally:
+            for future, path in pending:
+                future.cancel()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
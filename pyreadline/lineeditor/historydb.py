@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+from __future__ import print_function, unicode_literals, absolute_import
+
+from pyreadline.unicode_helper import ensure_unicode
+from pyreadline.logger import log
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+_database_magic = b"SQLite format 3\0"
+#Lines are read BLOCK_ROWS rows at a time with a single query, the last
+#CACHE_BLOCKS blocks read are kept.
+BLOCK_ROWS = 1024
+CACHE_BLOCKS = 4
+
+_schema = """
+CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY, line TEXT NOT NULL);
+"""
+_fts_schema = """
+CREATE VIRTUAL TABLE history_fts USING fts5(line, content='history',
+    content_rowid='id', tokenize='trigram case_sensitive 1');
+CREATE TRIGGER history_ai AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts(rowid, line) VALUES (new.id, new.line);
+END;
+CREATE TRIGGER history_ad AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts(history_fts, rowid, line)
+        VALUES ('delete', old.id, old.line);
+END;
+INSERT INTO history_fts(history_fts) VALUES ('rebuild');
+"""
+
+
+def is_database(filename):
+    '''Return True if filename is a history database.'''
+    if sqlite3 is None:
+        return False
+    try:
+        fp = open(filename, 'rb')
+    except IOError:
+        return False
+    try:
+        return fp.read(len(_database_magic)) == _database_magic
+    finally:
+        fp.close()
+
+
+class HistoryDatabase(object):
+    '''History kept in a sqlite3 database, created if needed.
+
+    Lines are rows of the history table, numbered by an increasing id.
+    Lines are only ever removed from the start, by compact, so the rows
+    present when the database was opened are the contiguous ids first to
+    first + nlines - 1, and line i of the view is row first + i. Later rows
+    are not part of the view, a HistoryStore keeps the lines added since
+    in memory. An FTS5 index with the trigram tokenizer answers substring
+    searches of three or more characters when sqlite supports it.
+
+    Lines are read a block of BLOCK_ROWS rows at a time, like the blocks
+    of a CompressedHistoryFile, so going through the lines in order costs
+    one query per block instead of one per line.
+    '''
+    def __init__(self, filename):
+        if sqlite3 is None:
+            raise IOError("sqlite3 is not available")
+        self.filename = filename
+        try:
+            self.db = sqlite3.connect(filename)
+            self.db.executescript(_schema)
+            self.fts = self._create_fts()
+            first, last = self.db.execute(
+                "SELECT min(id), max(id) FROM history").fetchone()
+        except sqlite3.Error as e:
+            raise IOError("history database %s: %s"%(filename, e))
+        if first is None:
+            self.first = 1
+            self.nlines = 0
+        else:
+            self.first = first
+            self.nlines = last - first + 1
+        self._cache = []
+
+    def _create_fts(self):
+        db = self.db
+        if db.execute("SELECT 1 FROM sqlite_master WHERE name = "
+                      "'history_fts'").fetchone():
+            return True
+        try:
+            db.executescript("BEGIN;" + _fts_schema + "COMMIT;")
+        except sqlite3.OperationalError:
+            db.rollback()
+            log("HistoryDatabase: no fts5 trigram index, using plain scans")
+            return False
+        return True
+
+    def __len__(self):
+        return self.nlines
+
+    def _block(self, n):
+        for item in self._cache:
+            if item[0] == n:
+                self._cache.remove(item)
+                self._cache.append(item)
+                return item[1]
+        start = self.first + n * BLOCK_ROWS
+        stop = min(start + BLOCK_ROWS, self.first + self.nlines)
+        #Rows removed by a compaction in another session read as ""
+        lines = [""] * (stop - start)
+        for eid, line in self.db.execute(
+                "SELECT id, line FROM history WHERE id >= ? AND id < ?",
+                (start, stop)):
+            lines[eid - start] = ensure_unicode(line)
+        self._cache.append((n, lines))
+        del self._cache[:-CACHE_BLOCKS]
+        return lines
+
+    def get_text(self, index):
+        if not 0 <= index < self.nlines:
+            raise IndexError("history index out of range")
+        return self._block(index // BLOCK_ROWS)[index % BLOCK_ROWS]
+
+    def get_texts(self, start, stop):
+        '''Return the lines start to stop - 1 as a list.'''
+        start = max(start, 0)
+        stop = min(stop, self.nlines)
+        lines = []
+        for n in range(start // BLOCK_ROWS, (stop - 1) // BLOCK_ROWS + 1):
+            first = n * BLOCK_ROWS
+            lines.extend(self._block(n)[max(start - first, 0):stop - first])
+        return lines
+
+    def get_bytes(self, index):
+        return self.get_text(index).encode("utf-8")
+
+    def search(self, query):
+        '''Return the sorted indexes of the lines containing query.'''
+        last = self.first + self.nlines - 1
+        if self.fts and len(query) >= 3:
+            rows = self.db.execute(
+                "SELECT rowid FROM history_fts WHERE history_fts MATCH ? "
+                "AND rowid BETWEEN ? AND ? ORDER BY rowid",
+                ('"%s"'%query.replace('"', '""'), self.first, last))
+        else:
+            rows = self.db.execute(
+                "SELECT id FROM history WHERE instr(line, ?) > 0 "
+                "AND id BETWEEN ? AND ? ORDER BY id",
+                (query, self.first, last))
+        return [eid - self.first for eid, in rows]
+
+    def prefix_search(self, prefix):
+        '''Return the sorted indexes of the lines starting with prefix.'''
+        return self._select("substr(line, 1, ?) = ?", (len(prefix), prefix))
+
+    def fuzzy_search(self, query, fold, limit=None):
+        '''Return the sorted indexes of the lines that hold the characters
+        of query in order, a superset of those fuzzy_score matches. ASCII
+        case is ignored if fold is true. Only the last limit matches are
+        returned if limit is given.'''
+        if fold:
+            #LIKE only folds ASCII, any character can match the others
+            chars = []
+            for c in query:
+                if ord(c) > 127:
+                    c = "_"
+                elif c in "\\%_":
+                    c = "\\" + c
+                chars.append(c)
+            return self._select("line LIKE ? ESCAPE '\\'",
+                                ("%" + "%".join(chars) + "%",), limit)
+        chars = ["[%s]"%c if c in "*?[" else c for c in query]
+        return self._select("line GLOB ?", ("*" + "*".join(chars) + "*",),
+                            limit)
+
+    def _select(self, condition, args, limit=None):
+        sql = ("SELECT id FROM history WHERE %s AND id BETWEEN ? AND ? "
+               "ORDER BY id"%condition)
+        args += (self.first, self.first + self.nlines - 1)
+        if limit is None:
+            return [eid - self.first for eid, in self.db.execute(sql, args)]
+        rows = self.db.execute(sql + " DESC LIMIT ?", args + (limit,))
+        ids = [eid - self.first for eid, in rows]
+        ids.reverse()
+        return ids
+
+    def read_lines(self):
+        '''Return all lines in the database, not only those of the view.'''
+        return [ensure_unicode(line) for line, in
+                self.db.execute("SELECT line FROM history ORDER BY id")]
+
+    def append(self, lines):
+        '''Add lines at the end of the database.'''
+        try:
+            self.db.executemany("INSERT INTO history(line) VALUES (?)",
+                                [(ensure_unicode(line),) for line in lines])
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.db.rollback()
+            raise IOError("history database %s: %s"%(self.filename, e))
+
+    def replace(self, lines):
+        '''Replace all lines of the database with lines. The new rows get
+        ids after those of the old ones, so ids keep increasing and other
+        sessions read the rows they had as removed.'''
+        try:
+            last, = self.db.execute("SELECT max(id) FROM history").fetchone()
+            self.db.execute("DELETE FROM history")
+            self.db.executemany("INSERT INTO history(id, line) VALUES (?, ?)",
+                                [(eid, ensure_unicode(line)) for eid, line
+                                 in enumerate(lines, (last or 0) + 1)])
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.db.rollback()
+            raise IOError("history database %s: %s"%(self.filename, e))
+
+    def compact(self, length):
+        '''Remove all but the last length lines, none for a negative
+        length. Returns the number of lines kept.'''
+        try:
+            if length >= 0:
+                self.db.execute("DELETE FROM history WHERE id <= "
+                                "(SELECT max(id) FROM history) - ?", (length,))
+                self.db.commit()
+            return self.db.execute("SELECT count(*) FROM history").fetchone()[0]
+        except sqlite3.Error as e:
+            self.db.rollback()
+            raise IOError("history database %s: %s"%(self.filename, e))
+
+    def close(self):
+        self.db.close()
+        self.nlines = 0
+        self._cache = []
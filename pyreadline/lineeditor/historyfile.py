@@ -0,0 +1,773 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+from __future__ import print_function, unicode_literals, absolute_import
+import os, re, sys, mmap, struct, tempfile, zlib
+from array import array
+from bisect import bisect_right
+
+from pyreadline.unicode_helper import ensure_unicode, ensure_str
+from pyreadline.logger import log
+from .historydb import is_database, HistoryDatabase
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+#Files with fewer lines than this are scanned on every start instead of
+#getting a .idx sidecar next to them.
+SIDECAR_MIN_LINES = 10000
+SCAN_CHUNK = 1 << 20
+#Compressed history files are written in blocks of about this many bytes of
+#lines, the last CACHE_BLOCKS blocks used are kept decompressed.
+BLOCK_SIZE = 64 * 1024
+CACHE_BLOCKS = 4
+
+#msvcrt.locking locks a byte range, HistoryLock uses a single byte far past
+#the end of the lock file.
+_LOCK_OFFSET = 0x7ffffffe
+
+_sidecar_magic = b"PRLIDX2\n"
+_sidecar_header = struct.Struct(str("<8sQIIIII"))
+_sidecar_begin = struct.Struct(str("<Q"))
+#The history_control values that decide which lines of a file are loaded,
+#kept in the sidecar as bit flags
+_control_flags = {"ignoredups": 1, "ignorespace": 2, "erasedups": 4}
+_bare_flag = 8
+_compressed_magic = b"PRLHZ1\n\0"
+_block_entry = struct.Struct(str("<QII"))
+_compressed_trailer = struct.Struct(str("<QII8s"))
+#A "#<epoch>" line before an entry holds its metadata, as in bash history
+#files written with HISTTIMEFORMAT set. bash only reads the epoch and keeps
+#the rest of the line. The lines written by format_meta have more fields
+#after a tab, which tells them apart from entries such as "#42". A bare
+#"#<epoch>" line is only taken for metadata when the caller asks for it.
+_meta_line = re.compile(br"#(\d+)(?:\t(.*))?$")
+
+
+def _crc(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def sidecar_name(filename):
+    return filename + ".idx"
+
+
+def trigram_name(filename):
+    return filename + ".tri"
+
+
+def frecency_name(filename):
+    return filename + ".frecency"
+
+
+def lock_name(filename):
+    return filename + ".lock"
+
+
+def namespace_name(filename, namespace):
+    return "%s-%s"%(filename, namespace)
+
+
+def remove_sidecar(filename):
+    for name in (sidecar_name(filename), trigram_name(filename)):
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+class HistoryLock(object):
+    '''Exclusive advisory lock taken by sessions sharing a history file
+    while they change it.
+
+    The lock is held on a separate lock file, so that it stays valid when
+    the history file is replaced by compact_history_file. Uses fcntl.flock,
+    or msvcrt.locking on Windows. Without either the lock does nothing.
+    '''
+    def __init__(self, filename):
+        self.filename = lock_name(filename)
+        self.fp = None
+
+    def acquire(self):
+        self.fp = open(self.filename, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fp.fileno(), fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                self.fp.seek(_LOCK_OFFSET)
+                while True:
+                    try:
+                        msvcrt.locking(self.fp.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except IOError:
+                        #LK_LOCK gives up after ten seconds
+                        log("HistoryLock: still waiting for %s"%self.filename)
+        except:
+            self.fp.close()
+            self.fp = None
+            raise
+
+    def release(self):
+        if self.fp is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                self.fp.seek(_LOCK_OFFSET)
+                msvcrt.locking(self.fp.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.fp.close()
+            self.fp = None
+
+
+def file_identity(filename):
+    '''Return the (device, inode) pair of filename, which changes when the
+    file is replaced by another one.'''
+    st = os.stat(filename)
+    return (st.st_dev, st.st_ino)
+
+
+def read_tail(filename, offset, identity):
+    '''Return the complete lines added to filename after byte offset, as
+    bytes without newlines, and the offset just past the last of them. An
+    unfinished last line is left for a later call.
+
+    identity is the file_identity of the file offset was taken from, or
+    None if there was no file. If the file has been replaced or truncated
+    since, as when another session compacts it, all its lines are
+    returned. Returns lines, offset, identity and whether the file was
+    replaced.'''
+    fp = open(filename, 'rb')
+    try:
+        st = os.fstat(fp.fileno())
+        replaced = ((st.st_dev, st.st_ino) != identity or
+                    st.st_size < offset)
+        if replaced:
+            offset = 0
+            identity = (st.st_dev, st.st_ino)
+        fp.seek(offset)
+        data = fp.read(st.st_size - offset)
+    finally:
+        fp.close()
+    end = data.rfind(b"\n") + 1
+    return data[:end].split(b"\n")[:-1], offset + end, identity, replaced
+
+
+def _match_meta(line, bare):
+    match = _meta_line.match(line)
+    if match is None or (match.group(2) is None and not bare):
+        return None
+    return match
+
+
+def is_meta_line(line, bare=False):
+    '''Return True if line, bytes without trailing whitespace, holds the
+    metadata of the next entry instead of an entry. A bare "#<epoch>"
+    line does only if bare is true. The line right after a metadata line
+    is always an entry, whatever it looks like, the callers check that.'''
+    return line[:1] == b"#" and _match_meta(line, bare) is not None
+
+
+def parse_meta(line, bare=False):
+    '''Return the (timestamp, duration, cwd, session) tuple held by a
+    metadata line, or None if line is not one, see is_meta_line. Missing
+    fields, as in bash history files, are returned as
+    HistoryMetadata.unknown.'''
+    match = _match_meta(line.rstrip(), bare)
+    if match is None:
+        return None
+    if match.group(2) is None:
+        return (float(match.group(1)), -1.0, "", "")
+    fields = match.group(2).split(b"\t", 2)
+    try:
+        duration = float(fields[0])
+    except ValueError:
+        duration = -1.0
+    fields = [ensure_unicode(x) for x in fields[1:]] + ["", ""]
+    return (float(match.group(1)), duration, fields[1], fields[0])
+
+
+def format_meta(meta):
+    '''Return the metadata line for a (timestamp, duration, cwd, session)
+    tuple.'''
+    timestamp, duration, cwd, session = meta
+    clean = lambda text: re.sub("[\t\r\n]", " ", text)
+    return ensure_str("#%d\t%.6g\t%s\t%s"%(timestamp, duration,
+                                            clean(session), clean(cwd)))
+
+
+def split_meta(lines, bare=False):
+    '''Separate the entries of a list of history file lines from their
+    metadata lines, see is_meta_line. Returns the entries and, for every
+    entry, the metadata line before it or None.'''
+    entries = []
+    metas = []
+    meta = None
+    for line in lines:
+        if meta is None and is_meta_line(line.rstrip(), bare):
+            meta = line
+        else:
+            entries.append(line)
+            metas.append(meta)
+            meta = None
+    return entries, metas
+
+
+def join_meta(entries, metas):
+    '''The inverse of split_meta.'''
+    lines = []
+    for line, meta in zip(entries, metas):
+        if meta is not None:
+            lines.append(meta)
+        lines.append(line)
+    return lines
+
+
+def scan_lines(data, offset, starts, ends, prev=b"", control=("ignoredups",),
+               bare=False):
+    '''Append the start and end offsets of the lines in data[offset:] to
+    starts and ends. Trailing whitespace is not part of a line. Like
+    LineHistory.add_history, empty lines are skipped, and so are lines
+    starting with a space or equal to the line before them if ignorespace
+    or ignoredups is in control. Metadata lines, see is_meta_line, are
+    skipped too. Returns the number of lines scanned, metadata lines not
+    counted.'''
+    ignoredups = "ignoredups" in control
+    ignorespace = "ignorespace" in control
+    size = len(data)
+    nlines = 0
+    after_meta = False
+    while offset < size:
+        stop = data.find(b"\n", min(offset + SCAN_CHUNK, size - 1))
+        if stop < 0:
+            stop = size
+        else:
+            stop += 1
+        block = data[offset:stop]
+        pos = offset
+        lines = block.split(b"\n")
+        if block[-1:] == b"\n":
+            del lines[-1]
+        for line in lines:
+            stripped = line.rstrip()
+            meta = (not after_meta and stripped[:1] == b"#" and
+                    is_meta_line(stripped, bare))
+            if meta:
+                nlines -= 1
+            elif not stripped or (ignorespace and stripped[:1] == b" "):
+                pass
+            elif not ignoredups or stripped != prev:
+                starts.append(pos)
+                ends.append(pos + len(stripped))
+                prev = stripped
+            after_meta = meta
+            pos += len(line) + 1
+        nlines += block.count(b"\n")
+        offset = stop
+    if size and data[size - 1:size] != b"\n":
+        nlines += 1
+    return nlines
+
+
+def erase_duplicates(data, starts, ends, first=0):
+    '''Return the offsets of the lines left when every line equal to a
+    later one is dropped, as erasedups does when the lines are added one
+    by one. The lines before first must already be distinct.'''
+    later = set()
+    keep = []
+    for i in range(len(starts) - 1, -1, -1):
+        line = data[starts[i]:ends[i]]
+        if line not in later:
+            keep.append(i)
+            if i >= first:
+                later.add(line)
+    keep.reverse()
+    return (array(str('I'), [starts[i] for i in keep]),
+            array(str('I'), [ends[i] for i in keep]))
+
+
+class MappedHistoryFile(object):
+    '''Read-only view of the lines of a history file.
+
+    The file is memory mapped while the start and end offset of every line
+    are found, then the bytes of the last length lines, or of all lines if
+    length is not positive, are copied and the mapping is closed. The file
+    is not kept open, so other sessions can rewrite or replace it. Lines
+    are filtered by the history_control values in control like lines
+    added to the history. Bare "#<epoch>" lines are metadata if bare is
+    true, see is_meta_line. The text of a line is decoded when get_text is
+    called.
+
+    The offsets are saved to a sidecar file for large histories, so that
+    the next start only has to scan the lines appended since then.
+    signature identifies the contents of the file and the lines loaded,
+    it is used to check other files saved next to it, see
+    TrigramIndex.save.
+    '''
+    def __init__(self, filename, length=-1, control=("ignoredups",),
+                 bare=False):
+        self.filename = filename
+        self.bare = bare
+        fp = open(filename, 'rb')
+        try:
+            size = os.fstat(fp.fileno()).st_size
+            if size:
+                self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = b""
+        finally:
+            fp.close()
+        self.starts = array(str('I'))
+        self.ends = array(str('I'))
+        self.nlines = 0
+        try:
+            self._load_index(control)
+            self._release(length)
+        except:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_bytes(self, index):
+        return self.data[self.starts[index]:self.ends[index]]
+
+    def get_text(self, index):
+        return ensure_unicode(self.get_bytes(index))
+
+    def get_texts(self, start, stop):
+        '''Return the lines start to stop - 1 as a list.'''
+        data = self.data
+        return [ensure_unicode(data[begin:end]) for begin, end in
+                zip(self.starts[start:stop], self.ends[start:stop])]
+
+    def get_meta(self, index):
+        '''Return the metadata of line index, read from the metadata line
+        before it, or None. That line is an entry, not metadata, if it is
+        one of the lines loaded.'''
+        start = self.starts[index]
+        if start < 2:
+            return None
+        begin = self.data.rfind(b"\n", 0, start - 1) + 1
+        if index and self.starts[index - 1] == begin:
+            return None
+        return parse_meta(self.data[begin:start - 1], self.bare)
+
+    def timestamps(self):
+        '''Return the timestamp of every line, 0.0 if it has none, found
+        with a single scan for metadata lines.'''
+        starts = self.starts
+        nlines = len(starts)
+        times = array(str('d'), b"\0" * (8 * nlines))
+        index = 0
+        if self.bare:
+            pattern = br"(?m)^#(\d+)(?:\t[^\n]*)?\r?\n"
+        else:
+            pattern = br"(?m)^#(\d+)\t[^\n]*\n"
+        for match in re.finditer(pattern, self.data):
+            while index < nlines and starts[index] < match.start():
+                index += 1
+            if index == nlines:
+                break
+            if starts[index] == match.start():
+                #An entry that looks like metadata
+                continue
+            end = match.end()
+            while index < nlines and starts[index] < end:
+                index += 1
+            if index == nlines:
+                break
+            if starts[index] == end:
+                times[index] = float(match.group(1))
+        return times
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b""
+        self.starts = array(str('I'))
+        self.ends = array(str('I'))
+
+    def _load_index(self, control):
+        data = self.data
+        flags = sum([_control_flags.get(x, 0) for x in set(control)])
+        if self.bare:
+            flags |= _bare_flag
+        offset = self._read_sidecar(flags)
+        prev = b""
+        first = len(self.starts)
+        if first:
+            prev = self.get_bytes(first - 1)
+        scanned = scan_lines(data, offset, self.starts, self.ends, prev,
+                             control, self.bare)
+        if "erasedups" in control and len(self.starts) > first:
+            self.starts, self.ends = erase_duplicates(data, self.starts,
+                                                      self.ends, first)
+        self.nlines += scanned
+        size = len(data)
+        self.signature = _sidecar_header.pack(
+            _sidecar_magic, size, _crc(data[:min(size, 4096)]),
+            _crc(data[max(0, size - 4096):size]), flags, self.nlines,
+            len(self.starts))
+        log("MappedHistoryFile: %d lines, %d scanned"%(len(self), scanned))
+        if (scanned and self.nlines >= SIDECAR_MIN_LINES and
+                data[len(data) - 1:] == b"\n"):
+            self._write_sidecar()
+
+    def _release(self, length):
+        '''Keep the last length lines, copy their bytes, starting with the
+        line before them which may hold metadata, and close the mapping.'''
+        data = self.data
+        begin = 0
+        if 0 < length < len(self.starts):
+            first = len(self.starts) - length
+            begin = data.rfind(b"\n", 0, self.starts[first] - 1) + 1
+            if self.starts[first - 1] == begin:
+                #The line before is an entry, not metadata
+                begin = self.starts[first]
+            self.starts = array(str('I'), [x - begin for x in
+                                           self.starts[first:]])
+            self.ends = array(str('I'), [x - begin for x in
+                                         self.ends[first:]])
+        self.data = data[begin:]
+        if isinstance(data, mmap.mmap):
+            data.close()
+        self.signature += _sidecar_begin.pack(begin)
+
+    def _read_sidecar(self, flags):
+        '''Load the offsets saved by _write_sidecar if they still describe
+        the start of the file and were filtered with the same flags.
+        Returns the offset where scanning should continue.'''
+        data = self.data
+        try:
+            fp = open(sidecar_name(self.filename), 'rb')
+        except IOError:
+            return 0
+        try:
+            try:
+                header = fp.read(_sidecar_header.size)
+                (magic, size, headcrc, tailcrc, saved_flags,
+                 nlines, count) = _sidecar_header.unpack(header)
+                if (magic != _sidecar_magic or saved_flags != flags or
+                        size > len(data) or
+                        headcrc != _crc(data[:min(size, 4096)]) or
+                        tailcrc != _crc(data[max(0, size - 4096):size])):
+                    return 0
+                starts = array(str('I'))
+                ends = array(str('I'))
+                starts.fromfile(fp, count)
+                ends.fromfile(fp, count)
+            except (struct.error, EOFError, IOError, ValueError):
+                return 0
+        finally:
+            fp.close()
+        self.starts, self.ends, self.nlines = starts, ends, nlines
+        return size
+
+    def _write_sidecar(self):
+        try:
+            fp = open(sidecar_name(self.filename), 'wb')
+            try:
+                fp.write(self.signature)
+                self.starts.tofile(fp)
+                self.ends.tofile(fp)
+            finally:
+                fp.close()
+        except (IOError, OSError):
+            remove_sidecar(self.filename)
+
+
+def is_compressed(filename):
+    '''Return True if filename was written by write_compressed.'''
+    try:
+        fp = open(filename, 'rb')
+    except IOError:
+        return False
+    try:
+        return fp.read(len(_compressed_magic)) == _compressed_magic
+    finally:
+        fp.close()
+
+
+def open_history_file(filename, length=-1, control=("ignoredups",),
+                      bare=False):
+    '''Return a read-only view of the lines of a history file, plain,
+    compressed or a database. length and control are used for a plain or
+    compressed file and bare for a plain file, see MappedHistoryFile.'''
+    if is_database(filename):
+        return HistoryDatabase(filename)
+    if is_compressed(filename):
+        return CompressedHistoryFile(filename, length, control)
+    return MappedHistoryFile(filename, length, control, bare)
+
+
+def read_history_lines(filename):
+    '''Return all lines of a history file as bytes, without newlines.'''
+    if is_database(filename):
+        history = HistoryDatabase(filename)
+        try:
+            return [line.encode("utf-8") for line in history.read_lines()]
+        finally:
+            history.close()
+    if is_compressed(filename):
+        history = CompressedHistoryFile(filename)
+        try:
+            return [history.get_bytes(i) for i in range(len(history))]
+        finally:
+            history.close()
+    fp = open(filename, 'rb')
+    try:
+        data = fp.read()
+    finally:
+        fp.close()
+    lines = data.split(b"\n")
+    if lines[-1] == b"":
+        del lines[-1]
+    return lines
+
+
+def _write_blocks(fp, lines, first):
+    '''Write lines as compressed blocks at the current position of fp.
+    Returns the index entries of the blocks, first is the number of the
+    first line.'''
+    index = []
+    block = []
+    size = 0
+    for i, line in enumerate(lines):
+        block.append(line)
+        size += len(line) + 1
+        if size >= BLOCK_SIZE or i == len(lines) - 1:
+            data = zlib.compress(b"\n".join(block))
+            index.append((fp.tell(), len(data), first))
+            fp.write(data)
+            first += len(block)
+            block = []
+            size = 0
+    return index
+
+
+def _write_footer(fp, index, count):
+    offset = fp.tell()
+    for entry in index:
+        fp.write(_block_entry.pack(*entry))
+    fp.write(_compressed_trailer.pack(offset, len(index), count,
+                                      _compressed_magic))
+
+
+def write_compressed(fp, lines):
+    '''Write lines, a list of bytes without newlines, to the binary file
+    fp as a compressed history file.'''
+    fp.write(_compressed_magic)
+    index = _write_blocks(fp, lines, 0)
+    _write_footer(fp, index, len(lines))
+
+
+def append_compressed(filename, lines):
+    '''Add lines at the end of a compressed history file. The new lines
+    get blocks of their own and the index is written again after them.'''
+    fp = open(filename, 'r+b')
+    try:
+        index, count, offset = _read_footer(fp)
+        fp.seek(offset)
+        fp.truncate()
+        index.extend(_write_blocks(fp, lines, count))
+        _write_footer(fp, index, count + len(lines))
+    finally:
+        fp.close()
+
+
+def _read_footer(fp):
+    '''Return the block index, line count and index offset of a
+    compressed history file.'''
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    if size < len(_compressed_magic) + _compressed_trailer.size:
+        raise IOError("truncated compressed history file")
+    fp.seek(size - _compressed_trailer.size)
+    offset, nblocks, count, magic = \
+        _compressed_trailer.unpack(fp.read(_compressed_trailer.size))
+    if (magic != _compressed_magic or
+            offset + nblocks * _block_entry.size + _compressed_trailer.size
+            != size):
+        raise IOError("corrupt compressed history file")
+    fp.seek(offset)
+    data = fp.read(nblocks * _block_entry.size)
+    index = [_block_entry.unpack_from(data, i * _block_entry.size)
+             for i in range(nblocks)]
+    return index, count, offset
+
+
+def _replace(src, dst):
+    '''Rename src to dst, replacing dst if it exists.'''
+    if hasattr(os, "replace"):
+        os.replace(src, dst)
+    else:
+        if os.path.exists(dst) and sys.platform == "win32":
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def archive_name(filename):
+    return filename + ".archive"
+
+
+def compact_file(filename, length, compressed=False, archive=None,
+                 bare=False):
+    '''Truncate a history file to its last length lines, all of them for
+    a negative length, and return the number of lines kept. Metadata
+    lines, see is_meta_line, stay with the line after them.
+
+    The result is written to a temporary file that is renamed over the
+    original, so a crash leaves either the old or the new file behind. The
+    file is rewritten compressed if compressed is true. The lines dropped
+    are added to archive, a HistoryArchive, if it is given.'''
+    entries, metas = split_meta(read_history_lines(filename), bare)
+    if 0 <= length < len(entries):
+        if archive is not None:
+            archive.add([line.rstrip() for line in entries[:-length or None]
+                         if line.strip()])
+        entries = entries[len(entries) - length:]
+        metas = metas[len(metas) - length:]
+    if compressed:
+        lines = entries
+    else:
+        lines = join_meta(entries, metas)
+    remove_sidecar(filename)
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".history-")
+    try:
+        fp = os.fdopen(fd, 'wb')
+        if compressed:
+            write_compressed(fp, lines)
+        else:
+            for line in lines:
+                fp.write(line)
+                fp.write(b"\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+        fp.close()
+        _replace(tmpname, filename)
+    except:
+        os.remove(tmpname)
+        raise
+    log("compact_file: %d lines"%len(entries))
+    return len(entries)
+
+
+class CompressedHistoryFile(object):
+    '''Read-only view of the lines of a history file written by
+    write_compressed.
+
+    The file holds zlib compressed blocks of lines followed by an index
+    with the offset, size and number of the first line of every block.
+    Opening the file reads the index and the compressed blocks and closes
+    it, so other sessions can rewrite or replace it. Only the blocks of the
+    last length lines are kept, all of them if length is not positive, and
+    a block is decompressed when one of its lines is first used.
+
+    Unless control is None, lines are filtered by the history_control
+    values in control like those of a MappedHistoryFile, which takes a
+    pass over all blocks. lines holds the numbers in the file of the lines
+    kept.
+    '''
+    def __init__(self, filename, length=-1, control=None):
+        self.filename = filename
+        fp = open(filename, 'rb')
+        try:
+            self.index, self.nlines, offset = _read_footer(fp)
+            self.blocks = []
+            for offset, size, first in self.index:
+                fp.seek(offset)
+                self.blocks.append(fp.read(size))
+        finally:
+            fp.close()
+        self.firsts = [first for offset, size, first in self.index]
+        self._cache = []
+        if control is None:
+            self.lines = array(str('I'), range(self.nlines))
+        else:
+            self.lines = self._filter(control)
+        if 0 < length < len(self.lines):
+            self.lines = self.lines[len(self.lines) - length:]
+        if self.lines:
+            #Only the blocks of the lines kept are needed
+            first = bisect_right(self.firsts, self.lines[0]) - 1
+            self.blocks[:first] = [None] * first
+
+    def __len__(self):
+        return len(self.lines)
+
+    def _decompress(self, n):
+        try:
+            lines = zlib.decompress(self.blocks[n]).split(b"\n")
+        except (zlib.error, TypeError):
+            raise IOError("corrupt block in compressed history file")
+        return lines
+
+    def _filter(self, control):
+        '''Return the numbers of the lines left when those history_control
+        would leave out are dropped, see scan_lines and erase_duplicates.'''
+        ignoredups = "ignoredups" in control
+        ignorespace = "ignorespace" in control
+        kept = array(str('I'))
+        texts = []
+        prev = None
+        for n in range(len(self.blocks)):
+            first = self.firsts[n]
+            for i, line in enumerate(self._decompress(n)):
+                stripped = line.rstrip()
+                if not stripped or (ignorespace and stripped[:1] == b" "):
+                    continue
+                if ignoredups and stripped == prev:
+                    continue
+                kept.append(first + i)
+                texts.append(stripped)
+                prev = stripped
+        if "erasedups" in control:
+            later = set()
+            keep = []
+            for i in range(len(kept) - 1, -1, -1):
+                if texts[i] not in later:
+                    keep.append(kept[i])
+                    later.add(texts[i])
+            keep.reverse()
+            kept = array(str('I'), keep)
+        return kept
+
+    def _block(self, n):
+        for item in self._cache:
+            if item[0] == n:
+                self._cache.remove(item)
+                self._cache.append(item)
+                return item[1]
+        lines = self._decompress(n)
+        self._cache.append((n, lines))
+        del self._cache[:-CACHE_BLOCKS]
+        return lines
+
+    def get_bytes(self, index):
+        if not 0 <= index < len(self.lines):
+            raise IndexError("history index out of range")
+        line = self.lines[index]
+        n = bisect_right(self.firsts, line) - 1
+        return self._block(n)[line - self.firsts[n]]
+
+    def get_text(self, index):
+        return ensure_unicode(self.get_bytes(index))
+
+    def close(self):
+        self.blocks = []
+        self.lines = array(str('I'))
+        self._cache = []
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+'''Readers for the history files of other shells, see
+LineHistory.import_history.
+
+Every reader takes a file opened in binary mode and generates
+(text, meta) pairs, where meta is a (timestamp, duration, cwd, session)
+tuple as kept by HistoryMetadata, or None. Files are read a line at a time.
+Entries spanning several lines are joined into one line the way bash does
+with its cmdhist option.'''
+from __future__ import print_function, unicode_literals, absolute_import
+import re
+
+from .historyfile import parse_meta
+
+_zsh_extended = re.compile(br"^: *(\d+):(\d+);(.*)$", re.S)
+_fish_escape = re.compile(r"\\(.)")
+#After these a newline in a command needs no semicolon
+_no_separator = re.compile(r"(\b(do|then|else|in)|[{(|&;\\])\s*$")
+
+
+def _decode(data):
+    return data.decode("utf-8", "replace")
+
+
+def join_command(text):
+    '''Join the lines of a multi-line command into a single line.'''
+    if "\n" not in text:
+        return text
+    parts = [x for x in text.split("\n") if x.strip()]
+    result = parts[0] if parts else ""
+    for part in parts[1:]:
+        if _no_separator.search(result):
+            result = result.rstrip("\\").rstrip() + " " + part.strip()
+        else:
+            result += "; " + part.strip()
+    return result
+
+
+def read_bash(fp):
+    '''Read a bash history file, with or without the "#<epoch>" lines
+    written when HISTTIMEFORMAT is set. pyreadline history files have the
+    same format.'''
+    meta = None
+    for line in fp:
+        line = line.rstrip()
+        if line[:1] == b"#" and meta is None:
+            parsed = parse_meta(line, True)
+            if parsed is not None:
+                meta = parsed
+                continue
+        yield _decode(line), meta
+        meta = None
+
+
+def unmetafy(data):
+    '''Undo the zsh encoding of the bytes it uses internally, 0x83 to
+    0xa2, written to history files as 0x83 followed by the byte xor 0x20.'''
+    if b"\x83" not in data:
+        return data
+    result = bytearray()
+    meta = False
+    for byte in bytearray(data):
+        if meta:
+            result.append(byte ^ 0x20)
+            meta = False
+        elif byte == 0x83:
+            meta = True
+        else:
+            result.append(byte)
+    return bytes(result)
+
+
+def read_zsh(fp):
+    '''Read a zsh history file in plain or EXTENDED_HISTORY format,
+    ": <start>:<duration>;<command>". A line ending with a backslash is
+    continued on the next one.'''
+    entry = None
+    for line in fp:
+        line = unmetafy(line.rstrip(b"\r\n"))
+        if entry is None:
+            entry = line
+        else:
+            entry += b"\n" + line
+        if entry.endswith(b"\\"):
+            entry = entry[:-1]
+            continue
+        match = _zsh_extended.match(entry)
+        if match is None:
+            yield join_command(_decode(entry)), None
+        else:
+            meta = (float(match.group(1)), float(match.group(2)), "", "")
+            yield join_command(_decode(match.group(3))), meta
+        entry = None
+    if entry is not None:
+        yield join_command(_decode(entry)), None
+
+
+def _unescape_fish(match):
+    char = match.group(1)
+    return "\n" if char == "n" else char
+
+
+def read_fish(fp):
+    '''Read a fish history file, a list of "- cmd: <command>" records with
+    an optional "when: <epoch>" field. Other fields are skipped.'''
+    text = None
+    when = 0.0
+    for line in fp:
+        line = line.rstrip(b"\r\n")
+        if line.startswith(b"- cmd:"):
+            if text is not None:
+                yield text, (when, -1.0, "", "") if when else None
+            text = join_command(_fish_escape.sub(_unescape_fish,
+                                                 _decode(line[6:].strip())))
+            when = 0.0
+        elif line.startswith(b"  when:") and text is not None:
+            try:
+                when = float(line[7:].strip())
+            except ValueError:
+                pass
+    if text is not None:
+        yield text, (when, -1.0, "", "") if when else None
+
+
+importers = {"bash": read_bash, "zsh": read_zsh, "fish": read_fish}
+
+
+def detect_format(filename):
+    '''Guess the format of a shell history file from its first lines,
+    files that are neither zsh EXTENDED_HISTORY nor fish are read as
+    bash.'''
+    fp = open(filename, 'rb')
+    try:
+        for i, line in enumerate(fp):
+            if line.startswith(b"- cmd:"):
+                return "fish"
+            if _zsh_extended.match(line.rstrip(b"\r\n")):
+                return "zsh"
+            if i >= 20:
+                break
+    finally:
+        fp.close()
+    return "bash"
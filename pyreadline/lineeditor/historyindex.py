@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+from __future__ import print_function, unicode_literals, absolute_import
+import re, codecs, heapq, struct, time
+from array import array
+from collections import Counter
+from bisect import bisect_left, bisect_right
+
+_trigram_magic = b"PRLTRI1\n"
+_trigram_header = struct.Struct(str("<8sII"))
+
+
+def query_grams(text):
+    '''Return the grams used to look up text in a TrigramIndex. Queries of
+    three or more characters use their trigrams, shorter queries fall back
+    to single characters.'''
+    if len(text) >= 3:
+        return set([text[i:i + 3] for i in range(len(text) - 2)])
+    return set(text)
+
+
+def line_grams(text):
+    '''Return all grams a line is indexed under, its distinct characters
+    and its trigrams.'''
+    grams = set(text)
+    grams.update([text[i:i + 3] for i in range(len(text) - 2)])
+    return grams
+
+
+def newest_first(plists):
+    '''Generate the positions in the sorted lists plists, highest first
+    and without repeats.'''
+    last = None
+    for pos in heapq.merge(*[(-pos for pos in reversed(plist))
+                             for plist in plists]):
+        if pos != last:
+            last = pos
+            yield -pos
+
+
+class TrigramIndex(object):
+    '''Inverted index from character grams to history positions.
+
+    Every indexed line is appended at position self.size, so each posting
+    list is kept sorted without any extra work. A line can only contain a
+    query if it is found in the posting list of every gram of the query, so
+    the shortest such list is a complete set of candidates that only needs
+    to be verified with a plain substring test.
+
+    Posting lists are arrays of unsigned ints, a position costs four bytes.
+    The postings of the lines of a history file can be saved next to it
+    and loaded instead of indexing the file again, signature identifies
+    the contents of the file they were built from.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self, first=0):
+        self.postings = {}
+        self.size = first
+        self.first = first
+        self.signature = None
+
+    def add(self, text):
+        pos = self.size
+        postings = self.postings
+        for gram in line_grams(text):
+            plist = postings.get(gram)
+            if plist is None:
+                postings[gram] = array(str('I'), [pos])
+            else:
+                plist.append(pos)
+        self.size += 1
+
+    def save(self, filename, signature, size):
+        '''Write the postings of the first size positions to filename.
+        The index must start at position 0.'''
+        grams = []
+        plists = []
+        for gram, plist in self.postings.items():
+            cut = bisect_left(plist, size)
+            if cut:
+                grams.append(gram)
+                plists.append(plist[:cut])
+        fp = open(filename, 'wb')
+        try:
+            fp.write(_trigram_header.pack(_trigram_magic, len(signature),
+                                          len(grams)))
+            fp.write(signature)
+            array(str('I'), [size]).tofile(fp)
+            array(str('I'), [len(gram) for gram in grams]).tofile(fp)
+            array(str('I'), [len(plist) for plist in plists]).tofile(fp)
+            data = "".join(grams).encode("utf-8")
+            array(str('I'), [len(data)]).tofile(fp)
+            fp.write(data)
+            for plist in plists:
+                plist.tofile(fp)
+        finally:
+            fp.close()
+        self.signature = signature
+
+    def load(self, filename, signature):
+        '''Replace the postings with those saved in filename if they were
+        built from a file with the same signature. Returns False if they
+        were not.'''
+        try:
+            fp = open(filename, 'rb')
+        except IOError:
+            return False
+        try:
+            try:
+                magic, length, count = _trigram_header.unpack(
+                    fp.read(_trigram_header.size))
+                if magic != _trigram_magic or fp.read(length) != signature:
+                    return False
+                numbers = array(str('I'))
+                numbers.fromfile(fp, 2 * count + 1)
+                size = numbers[0]
+                lengths = numbers[1:count + 1]
+                counts = numbers[count + 1:]
+                numbers = array(str('I'))
+                numbers.fromfile(fp, 1)
+                text = fp.read(numbers[0]).decode("utf-8")
+                positions = array(str('I'))
+                positions.fromfile(fp, sum(counts))
+            except (struct.error, EOFError, IOError, ValueError):
+                return False
+        finally:
+            fp.close()
+        postings = {}
+        start = end = 0
+        for length, n in zip(lengths, counts):
+            postings[text[start:start + length]] = positions[end:end + n]
+            start += length
+            end += n
+        self.postings = postings
+        self.size = size
+        self.first = 0
+        self.signature = signature
+        return True
+
+    def candidates(self, query):
+        '''Return the sorted positions that may contain query, or None if
+        every position is a candidate.'''
+        best = None
+        for gram in query_grams(query):
+            plist = self.postings.get(gram)
+            if plist is None:
+                return []
+            if best is None or len(plist) < len(best):
+                best = plist
+        return best
+
+    def fuzzy_candidates(self, query, fold):
+        '''Return the posting lists of the rarest character of query, the
+        positions in any of them may hold the characters of query in
+        order. Both cases of the character are looked up if fold is true.
+        Returns None if every position is a candidate.'''
+        best = None
+        for c in set(query):
+            plists = [self.postings.get(c)]
+            if fold and c.upper() != c:
+                plists.append(self.postings.get(c.upper()))
+            plists = [plist for plist in plists if plist]
+            if best is None or (sum(map(len, plists)) <
+                                sum(map(len, best))):
+                best = plists
+        return best
+
+    def exact(self, query):
+        '''Return the sorted positions of the lines containing query if
+        query is itself a gram, None otherwise.'''
+        if len(query) in (1, 3):
+            return self.postings.get(query, [])
+        return None
+
+
+class DuplicateIndex(object):
+    '''Index from the text of a line to the ids of the entries holding it.
+
+    Only the hash of a text is kept, a get_text function is passed in to
+    tell apart texts with the same hash. Ids are handed out in the order
+    lines are added, like TrigramIndex positions.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self, first=0):
+        self.ids = {}
+        self.size = first
+
+    def add(self, text):
+        key = hash(text)
+        found = self.ids.get(key)
+        if found is None:
+            self.ids[key] = self.size
+        elif isinstance(found, list):
+            found.append(self.size)
+        else:
+            self.ids[key] = [found, self.size]
+        self.size += 1
+
+    def pop(self, text, get_text):
+        '''Forget and return the ids of all lines equal to text.'''
+        key = hash(text)
+        found = self.ids.get(key)
+        if found is None:
+            return []
+        if not isinstance(found, list):
+            found = [found]
+        same = []
+        rest = []
+        for eid in found:
+            if get_text(eid) == text:
+                same.append(eid)
+            else:
+                rest.append(eid)
+        if not rest:
+            del self.ids[key]
+        elif len(rest) == 1:
+            self.ids[key] = rest[0]
+        else:
+            self.ids[key] = rest
+        return same
+
+
+class PrefixIndex(object):
+    '''Entry ids sorted by the text of their entry.
+
+    The lines starting with a prefix are a contiguous run of this order,
+    found with two binary searches. Only the ids are stored, texts are
+    looked up with the get_text function passed in, as for DuplicateIndex.
+    Added lines are kept in a pending list and sorted in when the index is
+    next used. The ids of the lines found for the last prefix are cached
+    in id order, so that repeated searches for the same prefix only need
+    a bisect.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self, first=0):
+        self.order = array(str('I'))
+        self.pending = []
+        self.size = first
+        self._last = None
+
+    def add(self, text):
+        self.pending.append((text, self.size))
+        self.size += 1
+
+    def _bisect(self, before, get_text):
+        '''Return the first position in order whose text t does not have
+        before(t) true. before must hold for a leading run of the order.'''
+        order = self.order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if before(get_text(order[mid])):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _merge(self, get_text):
+        pending = self.pending
+        if not pending:
+            return
+        if len(pending) > len(self.order) // 16:
+            #Texts are read in id order, which is the order they are stored
+            items = [(get_text(eid), eid) for eid in sorted(self.order)]
+            items.extend(pending)
+            items.sort()
+            self.order = array(str('I'), [eid for text, eid in items])
+        else:
+            for text, eid in pending:
+                pos = self._bisect(lambda other: other <= text, get_text)
+                self.order.insert(pos, eid)
+        self.pending = []
+        self._last = None
+
+    def matches(self, prefix, get_text):
+        '''Return the sorted ids of all lines starting with prefix.'''
+        self._merge(get_text)
+        if self._last is not None and self._last[0] == prefix:
+            return self._last[1]
+        n = len(prefix)
+        lo = self._bisect(lambda text: text < prefix, get_text)
+        hi = self._bisect(lambda text: text[:n] <= prefix, get_text)
+        ids = sorted(self.order[lo:hi])
+        self._last = (prefix, ids)
+        return ids
+
+
+#Fuzzy match scores, see fuzzy_score.
+SCORE_MATCH = 16
+BONUS_BOUNDARY = 8
+BONUS_CONSECUTIVE = 4
+PENALTY_GAP_START = 3
+PENALTY_GAP_EXTENSION = 1
+
+
+def fuzzy_score(query, text):
+    '''Return how well text matches the characters of query in order,
+    or None if it does not match.
+
+    The shortest window of text holding the match is scored. Every
+    matched character gives SCORE_MATCH, plus a bonus if it starts a word.
+    A run of consecutive matches keeps the bonus of its first character,
+    but gets at least BONUS_CONSECUTIVE. Every gap between matches costs
+    PENALTY_GAP_START and PENALTY_GAP_EXTENSION per character after the
+    first.'''
+    end = -1
+    for c in query:
+        end = text.find(c, end + 1)
+        if end < 0:
+            return None
+    positions = []
+    pos = end + 1
+    for c in reversed(query):
+        pos = text.rfind(c, 0, pos)
+        positions.append(pos)
+    positions.reverse()
+    score = 0
+    chunk = 0
+    prev = -2
+    for pos in positions:
+        if pos == 0 or not text[pos - 1].isalnum():
+            bonus = BONUS_BOUNDARY
+        else:
+            bonus = 0
+        if pos == prev + 1:
+            chunk = bonus = max(chunk, bonus, BONUS_CONSECUTIVE)
+        else:
+            if prev >= 0:
+                score -= (PENALTY_GAP_START +
+                          PENALTY_GAP_EXTENSION * (pos - prev - 2))
+            chunk = bonus
+        score += SCORE_MATCH + bonus
+        prev = pos
+    return score
+
+
+def fuzzy_best_score(query):
+    '''Return the highest score fuzzy_score can give for query, that of
+    a line holding query at the start of a word.'''
+    return (SCORE_MATCH + BONUS_BOUNDARY) * len(query)
+
+
+class FrecencyIndex(object):
+    '''Frecency score of every distinct line, combining how often and how
+    recently it was used.
+
+    Every use of a line adds 0.5 ** (age / half_life) to its score, where
+    age counts the lines added since then. Instead of decaying all scores
+    whenever a line is added, scores are kept multiplied by a scale that
+    grows by the same factor, so adding a line only touches the score of
+    that line. All scores are divided by the scale once it gets too
+    large, which happens every few thousand half lives.
+    '''
+    max_scale = 1e100
+    #Scores below this are not saved, a line used once is dropped after
+    #about seven half lives.
+    min_score = 0.01
+
+    def __init__(self, half_life=1000):
+        self.half_life = half_life
+        self.clear()
+
+    def clear(self):
+        self.scores = {}
+        self.scale = 1.0
+        self.size = 0
+
+    def add(self, text):
+        self.scale *= 2.0 ** (1.0 / self.half_life)
+        if self.scale > self.max_scale:
+            scale = self.scale
+            scores = self.scores
+            for key in scores:
+                scores[key] /= scale
+            self.scale = 1.0
+        self.scores[text] = self.scores.get(text, 0.0) + self.scale
+        self.size += 1
+
+    def score(self, text):
+        return self.scores.get(text, 0.0) / self.scale
+
+    def ranked(self, prefix=""):
+        '''Return the lines starting with prefix, highest score first.'''
+        texts = [text for text in self.scores if text.startswith(prefix)]
+        texts.sort(key=self.scores.__getitem__, reverse=True)
+        return texts
+
+    def save(self, filename):
+        '''Write the scores to filename, one "score<tab>line" per line.'''
+        fp = codecs.open(filename, "w", "utf-8")
+        try:
+            for text in self.ranked():
+                score = self.score(text)
+                if score < self.min_score:
+                    break
+                fp.write("%.6g\t%s\n"%(score, text))
+        finally:
+            fp.close()
+
+    def load(self, filename, size):
+        '''Replace the scores with those saved in filename, which already
+        account for the first size lines. Returns False if the file can
+        not be read.'''
+        try:
+            fp = codecs.open(filename, "r", "utf-8")
+        except IOError:
+            return False
+        scores = {}
+        try:
+            try:
+                for line in fp:
+                    score, text = line.rstrip("\n").split("\t", 1)
+                    scores[text] = float(score)
+            except ValueError:
+                return False
+        finally:
+            fp.close()
+        self.scores = scores
+        self.scale = 1.0
+        self.size = size
+        return True
+
+
+class HistoryStats(object):
+    '''Number of uses of every distinct line and of the lines added in
+    every hour of the day.
+
+    Entries are counted by id as they are added, like the other indexes,
+    and uncounted when they leave the history, so the statistics never
+    need a scan of the history. Empty lines are not counted.
+
+    The lines are also kept grouped by their count in by_count, so the
+    most used lines are found without looking at the others.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self, first=0):
+        self.counts = Counter()
+        self.by_count = {}
+        self.hours = [0] * 24
+        self.total = 0
+        self.size = first
+
+    def _hour(self, timestamp):
+        return time.localtime(timestamp).tm_hour
+
+    def _regroup(self, text, old, new):
+        if old:
+            group = self.by_count[old]
+            del group[text]
+            if not group:
+                del self.by_count[old]
+        if new:
+            self.by_count.setdefault(new, {})[text] = None
+
+    def add(self, text, timestamp):
+        if text:
+            count = self.counts[text]
+            self.counts[text] = count + 1
+            self._regroup(text, count, count + 1)
+            self.total += 1
+            if timestamp:
+                self.hours[self._hour(timestamp)] += 1
+
+    def remove(self, text, timestamp):
+        if text:
+            count = self.counts[text] - 1
+            if count > 0:
+                self.counts[text] = count
+            else:
+                del self.counts[text]
+            self._regroup(text, count + 1, count)
+            self.total -= 1
+            if timestamp:
+                self.hours[self._hour(timestamp)] -= 1
+
+    def top(self, n):
+        '''Return the n most used lines and their counts, most used first.
+        Only the distinct counts are sorted, there are fewer than
+        sqrt(2 * total) of them, and then n lines are taken from the
+        groups of the highest counts.'''
+        result = []
+        for count in sorted(self.by_count, reverse=True):
+            for text in self.by_count[count]:
+                if len(result) >= n:
+                    return result
+                result.append((text, count))
+        return result
+
+
+class PatternCache(object):
+    '''The regular expressions compiled for the last size patterns, kept
+    in least recently used order like the blocks of CompressedHistoryFile.
+    '''
+    def __init__(self, size=32):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.patterns = {}
+        self.order = []
+
+    def compile(self, pattern, flags=0):
+        '''Return pattern compiled with flags. A pattern that is not a valid
+        regular expression, such as one still being typed, matches itself
+        literally.'''
+        key = (pattern, flags)
+        regex = self.patterns.get(key)
+        if regex is None:
+            try:
+                regex = re.compile(pattern, flags)
+            except (re.error, OverflowError):
+                regex = re.compile(re.escape(pattern), flags)
+            self.patterns[key] = regex
+            if len(self.order) >= self.size:
+                del self.patterns[self.order.pop(0)]
+        else:
+            self.order.remove(key)
+        self.order.append(key)
+        return regex
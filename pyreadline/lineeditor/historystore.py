@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+from __future__ import print_function, unicode_literals, absolute_import
+import os
+from array import array
+from bisect import bisect_left, insort
+
+from pyreadline.unicode_helper import ensure_unicode
+from . import lineobj
+
+
+def times_between(times, ordered, start, stop):
+    '''Return the indexes of the timestamps t in times such that
+    start <= t < stop, times is sorted if ordered is true.'''
+    if ordered:
+        return range(bisect_left(times, start), bisect_left(times, stop))
+    return [i for i, t in enumerate(times) if start <= t < stop]
+
+
+class HistoryMetadata(object):
+    '''Timestamp, duration, working directory and session of a list of
+    history entries, kept in one array per field. Directories and sessions
+    are interned, their columns hold indexes into names.
+
+    Entries are usually added in time order, ranges of timestamps are
+    found with bisect as long as they are and by a scan otherwise.
+    '''
+    #Timestamp 0 and duration -1 mean not known
+    unknown = (0.0, -1.0, "", "")
+
+    def __init__(self):
+        self.times = array(str('d'))
+        self.durations = array(str('d'))
+        self.cwds = array(str('I'))
+        self.sessions = array(str('I'))
+        self.names = [""]
+        self._name_ids = {"": 0}
+        self.ordered = True
+
+    def __len__(self):
+        return len(self.times)
+
+    def _intern(self, name):
+        nid = self._name_ids.get(name)
+        if nid is None:
+            nid = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return nid
+
+    def append(self, meta=None):
+        timestamp, duration, cwd, session = meta or self.unknown
+        if self.times and timestamp < self.times[-1]:
+            self.ordered = False
+        self.times.append(timestamp)
+        self.durations.append(duration)
+        self.cwds.append(self._intern(cwd))
+        self.sessions.append(self._intern(session))
+
+    def get(self, index):
+        names = self.names
+        return (self.times[index], self.durations[index],
+                names[self.cwds[index]], names[self.sessions[index]])
+
+    def drop(self, count):
+        '''Forget the first count entries.'''
+        del self.times[:count]
+        del self.durations[:count]
+        del self.cwds[:count]
+        del self.sessions[:count]
+
+    def between(self, start, stop):
+        '''Return the indexes of the entries with a timestamp t such that
+        start <= t < stop.'''
+        return times_between(self.times, self.ordered, start, stop)
+
+
+class HistoryStore(object):
+    '''List of history entries used by LineHistory.
+
+    The text of all entries is kept utf-8 encoded in a single bytearray,
+    entry i being blob[offsets[i]:offsets[i + 1]], so an entry costs a few
+    bytes more than its text instead of a full ReadLineTextBuffer. Entries
+    loaded from a history file are read from a view of the file, see
+    MappedHistoryFile.
+    Indexing the store returns a new line buffer, use get_text when only
+    the text is needed.
+
+    Every entry gets an id, its position in the order entries were added.
+    Ids do not change when an entry before them is deleted, so they can be
+    used as keys by the search indexes. Until the first deletion the id of
+    entry i is head + i, after that positions are mapped to ids by the
+    sorted array slots[slot_head:], leaving out the slots listed in the
+    sorted list deleted. Deleted slots are only removed from the array
+    once max_deleted of them have piled up, so a deletion does not move
+    the whole array.
+
+    evict removes the oldest entries by moving head or slot_head forward.
+    Once evicted entries fill half of the blob their text is dropped and
+    generation is incremented, indexes built for an older generation may
+    hold ids whose text is gone.
+
+    The metadata of the entries in the blob is kept in a HistoryMetadata
+    with the same numbering as offsets, that of file backed entries is
+    read from the file.
+    '''
+    max_deleted = 1024
+
+    def __init__(self, base=None):
+        self.base = base
+        self.blob = bytearray()
+        self.offsets = array(str('I'), [0])
+        self.meta = HistoryMetadata()
+        self._base_times = None
+        self.dropped = 0
+        self.head = 0
+        self.slots = None
+        self.slot_head = 0
+        self.deleted = []
+        self.generation = 0
+
+    def _nbase(self):
+        if self.base is None:
+            return 0
+        return len(self.base)
+
+    def id_count(self):
+        '''Return the number of ids handed out, deleted entries included.'''
+        return self._nbase() + self.dropped + len(self.offsets) - 1
+
+    def first_id(self):
+        '''Return the id of the oldest entry, or id_count() if the store
+        is empty.'''
+        if len(self) == 0:
+            return self.id_count()
+        return self.entry_id(0)
+
+    def __len__(self):
+        if self.slots is None:
+            return self.id_count() - self.head
+        return len(self.slots) - self.slot_head - len(self.deleted)
+
+    def _position(self, index):
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("history index out of range")
+        return index
+
+    def _slot(self, index):
+        '''Return the index in slots of the entry at position index.'''
+        slot = self.slot_head + index
+        deleted = self.deleted
+        #deleted[k] - k never decreases, the entry comes after the deleted
+        #slots where it is at most slot
+        lo, hi = 0, len(deleted)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if deleted[mid] - mid <= slot:
+                lo = mid + 1
+            else:
+                hi = mid
+        return slot + lo
+
+    def entry_id(self, index):
+        index = self._position(index)
+        if self.slots is None:
+            return self.head + index
+        return self.slots[self._slot(index)]
+
+    def position(self, eid):
+        '''Return the position of the entry with id eid, or None if it has
+        been deleted or evicted.'''
+        if self.slots is None:
+            if self.head <= eid < self.id_count():
+                return eid - self.head
+            return None
+        slot = bisect_left(self.slots, eid, self.slot_head)
+        if slot < len(self.slots) and self.slots[slot] == eid:
+            skipped = bisect_left(self.deleted, slot)
+            if skipped < len(self.deleted) and self.deleted[skipped] == slot:
+                return None
+            return slot - self.slot_head - skipped
+        return None
+
+    def first_position(self, eid):
+        '''Return the position of the first entry with an id of at least
+        eid, or len(self) if there is none.'''
+        if self.slots is None:
+            return min(max(eid - self.head, 0), len(self))
+        slot = bisect_left(self.slots, eid, self.slot_head)
+        return slot - self.slot_head - bisect_left(self.deleted, slot)
+
+    def get_text_by_id(self, eid):
+        '''Return the text of the entry with id eid, deleted or not. The
+        text of evicted entries is only kept until the next compaction.'''
+        nbase = self._nbase()
+        if eid < nbase:
+            return self.base.get_text(eid)
+        eid -= nbase + self.dropped
+        if eid < 0:
+            raise IndexError("history entry evicted")
+        offsets = self.offsets
+        return self.blob[offsets[eid]:offsets[eid + 1]].decode("utf-8")
+
+    def iter_text_by_id(self, start, stop):
+        '''Generate the texts of the entries with ids start to stop - 1, as
+        get_text_by_id would return them. File backed entries are read a
+        block at a time if the file supports it.'''
+        nbase = min(self._nbase(), stop)
+        get_texts = getattr(self.base, "get_texts", None)
+        if get_texts is not None:
+            for eid in range(start, nbase, 1024):
+                for text in get_texts(eid, min(eid + 1024, nbase)):
+                    yield text
+            start = max(start, nbase)
+        for eid in range(start, stop):
+            yield self.get_text_by_id(eid)
+
+    def get_text(self, index):
+        '''Return the text of an entry without creating a line buffer.'''
+        return self.get_text_by_id(self.entry_id(index))
+
+    def _get_base_meta(self, index):
+        get_meta = getattr(self.base, "get_meta", None)
+        if get_meta is not None:
+            meta = get_meta(index)
+            if meta is not None:
+                return meta
+        return HistoryMetadata.unknown
+
+    def get_meta_by_id(self, eid):
+        '''Return the (timestamp, duration, cwd, session) of the entry with
+        id eid, see HistoryMetadata.'''
+        nbase = self._nbase()
+        if eid < nbase:
+            return self._get_base_meta(eid)
+        eid -= nbase + self.dropped
+        if eid < 0:
+            raise IndexError("history entry evicted")
+        return self.meta.get(eid)
+
+    def get_meta(self, index):
+        return self.get_meta_by_id(self.entry_id(index))
+
+    def iter_time_by_id(self, start, stop):
+        '''Generate the timestamps of the entries with ids start to
+        stop - 1. Those of file backed entries are read once, like in
+        ids_between.'''
+        nbase = min(self._nbase(), stop)
+        if start < nbase:
+            if self._base_times is None:
+                self._base_times = self._read_base_times()
+            times = self._base_times[0]
+            for eid in range(start, nbase):
+                yield times[eid]
+            start = nbase
+        for eid in range(start, stop):
+            yield self.get_meta_by_id(eid)[0]
+
+    def set_duration(self, index, duration):
+        '''Set the duration of an entry added to the store, entries read
+        from a file can not be changed.'''
+        eid = self.entry_id(index) - self._nbase() - self.dropped
+        if eid >= 0:
+            self.meta.durations[eid] = duration
+
+    def ids_between(self, start, stop):
+        '''Return the sorted ids of the entries with a timestamp t such
+        that start <= t < stop, deleted or evicted ones included.'''
+        ids = []
+        nbase = self._nbase()
+        if nbase:
+            if self._base_times is None:
+                self._base_times = self._read_base_times()
+            ids.extend(times_between(self._base_times[0],
+                                     self._base_times[1], start, stop))
+        first = nbase + self.dropped
+        ids.extend([first + i for i in self.meta.between(start, stop)])
+        return ids
+
+    def _read_base_times(self):
+        '''Return the timestamps of the file backed entries and whether
+        they are sorted.'''
+        if hasattr(self.base, "timestamps"):
+            times = self.base.timestamps()
+        else:
+            times = array(str('d'), [self._get_base_meta(i)[0] for i in
+                                     range(len(self.base))])
+        ordered = all(times[i] <= times[i + 1] for i in range(len(times) - 1))
+        return times, ordered
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        return lineobj.ReadLineTextBuffer(self.get_text(key))
+
+    def append(self, line, meta=None):
+        '''Append a line buffer or a string, meta is its metadata tuple.'''
+        if hasattr(line, "get_line_text"):
+            line = line.get_line_text()
+        self.blob.extend(ensure_unicode(line).encode("utf-8"))
+        self.offsets.append(len(self.blob))
+        self.meta.append(meta)
+        if self.slots is not None:
+            self.slots.append(self.id_count() - 1)
+
+    def __delitem__(self, index):
+        index = self._position(index)
+        if self.slots is None:
+            self.slots = array(str('I'), range(self.head, self.id_count()))
+            self.slot_head = 0
+        insort(self.deleted, self._slot(index))
+        if len(self.deleted) >= self.max_deleted:
+            self._drop_slots()
+
+    def _drop_slots(self):
+        '''Remove the deleted and evicted slots from slots.'''
+        slots = self.slots
+        kept = array(str('I'))
+        start = self.slot_head
+        for slot in self.deleted:
+            kept.extend(slots[start:slot])
+            start = slot + 1
+        kept.extend(slots[start:])
+        self.slots = kept
+        self.slot_head = 0
+        self.deleted = []
+
+    def evict(self, count):
+        '''Remove the count oldest entries.'''
+        count = min(count, len(self))
+        if count <= 0:
+            return
+        if self.slots is None:
+            self.head += count
+        else:
+            if count < len(self):
+                head = self._slot(count)
+            else:
+                head = len(self.slots)
+            del self.deleted[:bisect_left(self.deleted, head)]
+            self.slot_head = head
+            if self.slot_head > len(self.slots) // 2:
+                self._drop_slots()
+        self._compact()
+
+    def _compact(self):
+        '''Drop the text of evicted entries once they fill half the blob.'''
+        garbage = self.first_id() - self._nbase() - self.dropped
+        if garbage <= 0 or garbage < (len(self.offsets) - 1) // 2:
+            return
+        cut = self.offsets[garbage]
+        del self.blob[:cut]
+        self.offsets = array(str('I'), [x - cut for x in
+                                       self.offsets[garbage:]])
+        self.meta.drop(garbage)
+        self.dropped += garbage
+        self.generation += 1
+
+    def is_mapped(self, filename):
+        '''Return True if entries are read from filename.'''
+        return (self.base is not None and
+                os.path.abspath(self.base.filename) == os.path.abspath(filename))
+
+    def unmap(self):
+        '''Copy the file backed entries into the blob and close the view
+        of the file. Entry ids are not changed.'''
+        if self.base is not None:
+            base = self.base
+            start = min(self.first_id(), len(base))
+            blob = bytearray()
+            offsets = array(str('I'), [0])
+            meta = HistoryMetadata()
+            for i in range(start, len(base)):
+                blob.extend(base.get_text(i).encode("utf-8"))
+                offsets.append(len(blob))
+                meta.append(self._get_base_meta(i))
+            size = len(blob)
+            blob.extend(self.blob)
+            offsets.extend([size + x for x in self.offsets[1:]])
+            for i in range(len(self.meta)):
+                meta.append(self.meta.get(i))
+            self.base = None
+            self._base_times = None
+            self.blob = blob
+            self.offsets = offsets
+            self.meta = meta
+            self.dropped += start
+            base.close()
+
+    def close(self):
+        if self.base is not None:
+            self.base.close()
+            self.base = None
+        self.blob = bytearray()
+        self.offsets = array(str('I'), [0])
+        self.meta = HistoryMetadata()
+        self._base_times = None
+        self.dropped = 0
+        self.head = 0
+        self.slots = None
+        self.slot_head = 0
+        self.deleted = []
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+from __future__ import print_function, unicode_literals, absolute_import
+import threading, time
+
+from pyreadline.unicode_helper import ensure_str
+from pyreadline.logger import log
+from .historyfile import is_compressed, write_compressed, append_compressed, \
+                         compact_file, split_meta
+
+
+class HistoryWriter(object):
+    '''Thread appending lines to a history file in the background.
+
+    Queued lines are written in one go once batch lines are waiting or
+    interval seconds after the first of them was queued, so a slow disk
+    never holds up the prompt. flush waits a bounded time for the queued
+    work to be written. The thread only touches the file, the caller has
+    to make sure no HistoryStore maps it when a compaction is queued.
+    Lines dropped by a compaction are added to archive if it is set, bare
+    "#<epoch>" lines are kept with the line after them if bare is set, see
+    compact_file.
+    '''
+    def __init__(self, filename, interval=5.0, batch=50, compressed=False,
+                 archive=None, bare=False):
+        self.filename = filename
+        self.interval = interval
+        self.batch = batch
+        self.compressed = compressed
+        self.archive = archive
+        self.bare = bare
+        self._lines = []
+        self._compact = None
+        self._busy = False
+        self._flushing = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run,
+                                        name="pyreadline history writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread.is_alive() and not self._stopping
+
+    def append(self, text):
+        '''Queue a line to be appended to the file.'''
+        cond = self._cond
+        cond.acquire()
+        try:
+            self._lines.append(ensure_str(text))
+            if len(self._lines) == 1 or len(self._lines) >= self.batch:
+                cond.notify_all()
+        finally:
+            cond.release()
+
+    def compact(self, length):
+        '''Truncate the file to its last length lines once the queued lines
+        are written, see compact_file.'''
+        cond = self._cond
+        cond.acquire()
+        try:
+            self._compact = length
+            cond.notify_all()
+        finally:
+            cond.release()
+
+    def flush(self, timeout):
+        '''Write the queued work now and wait at most timeout seconds for it
+        to finish. Returns True if it did.'''
+        deadline = time.time() + timeout
+        cond = self._cond
+        cond.acquire()
+        try:
+            self._flushing += 1
+            cond.notify_all()
+            try:
+                while self._lines or self._compact is not None or self._busy:
+                    left = deadline - time.time()
+                    if left <= 0 or not self._thread.is_alive():
+                        return False
+                    cond.wait(left)
+                return True
+            finally:
+                self._flushing -= 1
+        finally:
+            cond.release()
+
+    def close(self, timeout):
+        '''Flush as for flush and stop the thread once the queue is empty.'''
+        done = self.flush(timeout)
+        cond = self._cond
+        cond.acquire()
+        try:
+            self._stopping = True
+            cond.notify_all()
+        finally:
+            cond.release()
+        return done
+
+    def _ready(self):
+        return (self._stopping or self._flushing or
+                self._compact is not None or len(self._lines) >= self.batch)
+
+    def _run(self):
+        cond = self._cond
+        while True:
+            cond.acquire()
+            try:
+                self._busy = False
+                cond.notify_all()
+                while (not self._lines and self._compact is None and
+                       not self._stopping):
+                    cond.wait()
+                deadline = time.time() + self.interval
+                while not self._ready():
+                    left = deadline - time.time()
+                    if left <= 0:
+                        break
+                    cond.wait(left)
+                if (self._stopping and not self._lines and
+                        self._compact is None):
+                    return
+                lines, self._lines = self._lines, []
+                length, self._compact = self._compact, None
+                self._busy = True
+            finally:
+                cond.release()
+            try:
+                if lines:
+                    self._write(lines)
+                if length is not None:
+                    compact_file(self.filename, length, self.compressed,
+                                 self.archive, self.bare)
+            except (IOError, OSError):
+                log("HistoryWriter: could not write %s"%self.filename)
+
+    def _write(self, lines):
+        #Compressed files keep no metadata lines
+        entries = split_meta(lines)[0]
+        if is_compressed(self.filename):
+            append_compressed(self.filename, entries)
+            return
+        fp = open(self.filename, 'ab')
+        try:
+            if self.compressed and fp.tell() == 0:
+                write_compressed(fp, entries)
+            else:
+                for line in lines:
+                    fp.write(line)
+                    fp.write(b"\n")
+        finally:
+            fp.close()
@@ -9,8 +9,11 @@ from __future__ import print_function, unicode_literals, absolute_import
 import re, operator, sys
 
 from . import wordmatcher
+from .gapbuffer import GapBuffer
+from .undolog import UndoLog
 import pyreadline.clipboard as clipboard
 from pyreadline.logger import  log
+from pyreadline.py3k_compat import unicode
 from pyreadline.unicode_helper import ensure_unicode, biter
 
 kill_ring_to_clipboard = False #set to true to copy every addition to kill ring to clipboard
@@ -48,17 +51,17 @@ PrevChar = PrevChar()
 
 class NextWordStart(LinePositioner):
     def __call__(self, line):
-        return line.next_start_segment(line.line_buffer, line.is_word_token)[line.point]
+        return line.word_boundaries()[0][line.point]
 NextWordStart = NextWordStart()
 
 class NextWordEnd(LinePositioner):
     def __call__(self, line):
-        return line.next_end_segment(line.line_buffer, line.is_word_token)[line.point]
+        return line.word_boundaries()[1][line.point]
 NextWordEnd = NextWordEnd()
 
 class PrevWordStart(LinePositioner):
     def __call__(self, line):
-        return line.prev_start_segment(line.line_buffer, line.is_word_token)[line.point]
+        return line.word_boundaries()[2][line.point]
 PrevWordStart = PrevWordStart()
 
 
@@ -86,7 +89,7 @@ WordEnd = WordEnd()
 
 class PrevWordEnd(LinePositioner):
     def __call__(self, line):
-        return line.prev_end_segment(line.line_buffer, line.is_word_token)[line.point]
+        return line.word_boundaries()[3][line.point]
 PrevWordEnd = PrevWordEnd()
 
 class PrevSpace(LinePositioner):
@@ -108,7 +111,7 @@ StartOfLine = StartOfLine()
 
 class EndOfLine(LinePositioner):
     def __call__(self, line):
-        return len(line.line_buffer)
+        return len(line)
 EndOfLine = EndOfLine()
 
 class Point(LinePositioner):
@@ -166,13 +169,18 @@ PointSlice = PointSlice()
 
 class TextLine(object):
     def __init__(self, txtstr, point = None, mark = None):
+        self._cache = {}
+        self._cache_version = None
+        self._line_buffer = None
         self.line_buffer = []
         self._point = 0
         self.mark = -1
-        self.undo_stack = []
+        self.undo_log = UndoLog()
         self.overwrite = False
+        self.is_word_token = wordmatcher.is_word_token
         if isinstance(txtstr, TextLine): #copy 
             self.line_buffer = txtstr.line_buffer[:]
+            self.is_word_token = txtstr.is_word_token
             if point is None:
                 self.point = txtstr.point
             else:                
@@ -192,36 +200,54 @@ class TextLine(object):
             else:
                 self.mark = mark
 
-        self.is_word_token = wordmatcher.is_word_token
-        self.next_start_segment = wordmatcher.next_start_segment
-        self.next_end_segment = wordmatcher.next_end_segment
-        self.prev_start_segment = wordmatcher.prev_start_segment
-        self.prev_end_segment = wordmatcher.prev_end_segment
+    def get_line_buffer(self):
+        return self._line_buffer
+    def set_line_buffer(self, chars):
+        old = self._line_buffer
+        self._line_buffer = GapBuffer(chars)
+        if old is not None and old.edits is not None:
+            self._line_buffer.edits = old.edits
+            self._line_buffer._record(0, list(old), len(self._line_buffer))
+    line_buffer = property(get_line_buffer, set_line_buffer)
+
+    def get_version(self):
+        return self._line_buffer.version
+    version = property(get_version)
+
+    def _cached(self, key, compute):
+        '''Return compute(), reusing the value cached under key until
+        line buffer is next modified.'''
+        version = self._line_buffer.version
+        if self._cache_version != version:
+            self._cache = {}
+            self._cache_version = version
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = compute()
+            return value
+
+    def word_boundaries(self):
+        '''Return the next_start, next_end, prev_start and prev_end tables
+        of wordmatcher.word_boundaries for line buffer.'''
+        return self._cached(("words", self.is_word_token),
+                            lambda: wordmatcher.word_boundaries(self.line_buffer,
+                                                                self.is_word_token))
         
     def push_undo(self):
-        ltext = self.get_line_text()
-        if self.undo_stack and ltext == self.undo_stack[-1].get_line_text():
-            self.undo_stack[-1].point = self.point
-        else:
-            self.undo_stack.append(self.copy())
+        '''End the current undo step, called after every command.'''
+        self.undo_log.commit(self)
 
     def pop_undo(self):
-        if len(self.undo_stack) >= 2:
-            self.undo_stack.pop()
-            self.set_top_undo()
-            self.undo_stack.pop()
-        else:
+        if not self.undo_log.undo(self):
             self.reset_line()
-            self.undo_stack = []
-
-    def set_top_undo(self):
-        if self.undo_stack:
-            undo = self.undo_stack[-1]
-            self.line_buffer = undo.line_buffer
-            self.point = undo.point
-            self.mark = undo.mark
-        else:
-            pass
+            self.undo_log.clear(self)
+
+    def revert_line(self):
+        self.undo_log.revert(self)
+
+    def clear_undo(self):
+        self.undo_log.clear(self)
         
     def __repr__(self):
         return 'TextLine("%s",point=%s,mark=%s)'%(self.line_buffer, self.point, self.mark)
@@ -232,29 +258,58 @@ class TextLine(object):
     def set_point(self,value):
         if isinstance(value, LinePositioner):
             value = value(self)
-        assert  (value <= len(self.line_buffer))           
-        if value > len(self.line_buffer):
-            value = len(self.line_buffer)
+        assert  (value <= len(self))           
+        if value > len(self):
+            value = len(self)
         self._point = value
     def get_point(self):
         return self._point
     point = property(get_point, set_point)
 
 
+    def _prefix_length(self, position):
+        if isinstance(position, LinePositioner):
+            position = position(self)
+        return slice(None, position).indices(len(self))[1]
+
+    def _widths(self):
+        quoted_widths = [0]
+        visible_widths = [0]
+        quoted = visible = 0
+        for c, width in zip(self.line_buffer, self._cached("quoted", self._quote)[1]):
+            quoted += width
+            visible += width
+            if c == "\t":
+                visible += 7
+            if 0x2013 <= ord(c) <= 0xFFFD:
+                visible += 1
+            quoted_widths.append(quoted)
+            visible_widths.append(visible)
+        return quoted_widths, visible_widths
+
     def visible_line_width(self, position = Point):
         """Return the visible width of the text in line buffer up to position."""
-        extra_char_width = len([ None for c in self[:position].line_buffer if 0x2013 <= ord(c) <= 0xFFFD])
-        return len(self[:position].quoted_text()) + self[:position].line_buffer.count("\t")*7 + extra_char_width
+        return self._cached("widths", self._widths)[1][self._prefix_length(position)]
 
-    def quoted_text(self):
+    def quoted_width(self, position = Point):
+        """Return the length of the quoted text in line buffer up to position."""
+        return self._cached("widths", self._widths)[0][self._prefix_length(position)]
+
+    def _quote(self):
         quoted = [ quote_char(c) for c in self.line_buffer ]
-        self.line_char_width = [ len(c) for c in quoted ]
-        return ''.join(map(ensure_unicode, quoted))
+        return ''.join(map(ensure_unicode, quoted)), [ len(c) for c in quoted ]
 
-    def get_line_text(self):
+    def quoted_text(self):
+        text, self.line_char_width = self._cached("quoted", self._quote)
+        return text
+
+    def _line_text(self):
         buf = self.line_buffer
         buf = list(map(ensure_unicode, buf))
         return ''.join(buf)
+
+    def get_line_text(self):
+        return self._cached("text", self._line_text)
             
     def set_line(self, text, cursor = None):
         self.line_buffer = [ c for c in str(text) ]
@@ -278,9 +333,9 @@ class TextLine(object):
                 self.line_buffer[self.point] = c
                 self.point += 1
         else:            
-            for c in biter(text):
-                self.line_buffer.insert(self.point, c)
-                self.point += 1
+            chars = list(biter(text))
+            self.line_buffer[self.point:self.point] = chars
+            self.point += len(chars)
     
     def __getitem__(self, key):
         #Check if key is LineSlice, convert to regular slice
@@ -304,7 +359,7 @@ class TextLine(object):
                 stop = key.stop(self)
             else:
                 stop = key.stop
-            return self.__class__(self.line_buffer[start:stop], point=0)
+            return LineView(self, start, stop)
         elif isinstance(key, LinePositioner):
             return self.line_buffer[key(self)]
         elif isinstance(key, tuple):
@@ -334,9 +389,7 @@ class TextLine(object):
         else:
             start = key
             stop = key + 1
-        prev = self.line_buffer[:start]
-        rest = self.line_buffer[stop:]
-        self.line_buffer = prev + rest
+        del self.line_buffer[start:stop]
         if point > stop:
             self.point = point - (stop - start)
         elif point >= start and point <= stop:
@@ -355,13 +408,12 @@ class TextLine(object):
         else:
             start = key
             stop = key + 1
-        prev = self.line_buffer[:start]
-        value = self.__class__(value).line_buffer
-        rest = self.line_buffer[stop:]
-        out = prev + value + rest
-        if len(out) >= len(self):
-            self.point = len(self)
-        self.line_buffer = out
+        if not isinstance(value, TextLine):
+            value = self.__class__(value)
+        length = len(self)
+        self.line_buffer[start:stop] = value.line_buffer
+        if len(self) >= length:
+            self.point = length
 
     def __len__(self):
         return len(self.line_buffer)
@@ -397,6 +449,95 @@ l = lines[2]
 l.point = 5
 
 
+class LineView(TextLine):
+    '''Read-only view of line[start:stop], returned by slicing a TextLine.
+
+    The view refers to the cached text of line instead of copying its
+    buffer, so measuring or comparing a slice copies nothing up front.
+    Later edits of line do not show in the view. The view turns into an
+    independent TextLine copy the first time its line_buffer is used,
+    which every editing method does. copy() returns a line of the same
+    class as line, e.g. a ReadLineTextBuffer.
+    '''
+    def __init__(self, line, start, stop):
+        self._line_class = getattr(line, "_line_class", line.__class__)
+        self._text = line.get_line_text()
+        self._start, self._stop = slice(start, stop).indices(len(self._text))[:2]
+        self._stop = max(self._start, self._stop)
+        self._cache = {}
+        self._cache_version = None
+        self._line_buffer = None
+        self._undo_log = None
+        self._point = 0
+        self.mark = -1
+        self.overwrite = False
+        self.is_word_token = line.is_word_token
+
+    def get_line_buffer(self):
+        if self._line_buffer is None:
+            self._line_buffer = GapBuffer(self._line_text())
+            self._text = None
+        return self._line_buffer
+    line_buffer = property(get_line_buffer, TextLine.set_line_buffer)
+
+    def get_undo_log(self):
+        if self._undo_log is None:
+            self._undo_log = UndoLog()
+        return self._undo_log
+    def set_undo_log(self, undo_log):
+        self._undo_log = undo_log
+    undo_log = property(get_undo_log, set_undo_log)
+
+    def _cached(self, key, compute):
+        if self._line_buffer is None:
+            try:
+                return self._cache[key]
+            except KeyError:
+                value = self._cache[key] = compute()
+                return value
+        return TextLine._cached(self, key, compute)
+
+    def _line_text(self):
+        if self._line_buffer is None:
+            return self._text[self._start:self._stop]
+        return TextLine._line_text(self)
+
+    def copy(self):
+        return self._line_class(self)
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, TextLine):
+            value = self._line_class(value)
+        TextLine.__setitem__(self, key, value)
+
+    def _quote(self):
+        quoted = [ quote_char(c) for c in self.get_line_text() ]
+        return ''.join(map(ensure_unicode, quoted)), [ len(c) for c in quoted ]
+
+    def __len__(self):
+        if self._line_buffer is None:
+            return self._stop - self._start
+        return len(self._line_buffer)
+
+    def __eq__(self, other):
+        if isinstance(other, TextLine):
+            other = other.get_line_text()
+        if isinstance(other, unicode):
+            return self.get_line_text() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'LineView("%s",point=%s,mark=%s)'%(self.get_line_text(), self.point, self.mark)
+
+
 
 class ReadLineTextBuffer(TextLine):
     def __init__(self,txtstr, point = None, mark = None):
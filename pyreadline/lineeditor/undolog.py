@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+from __future__ import print_function, unicode_literals, absolute_import
+from collections import deque
+
+
+class UndoGroup(object):
+    '''Edits undone together by one undo, with the point and mark to
+    restore.'''
+    def __init__(self, point, mark, kind):
+        self.edits = []
+        self.point = point
+        self.mark = mark
+        self.kind = kind
+        self.last_char = None
+        self.size = 0
+
+    def add(self, edits):
+        self.edits.extend(edits)
+        size = sum(len(removed) + 1 for start, removed, inserted in edits)
+        self.size += size
+        return size
+
+
+class UndoLog(object):
+    '''Log of the edits made to a TextLine, kept as the inverse edits
+    recorded by its GapBuffer rather than as copies of the line.
+
+    Edits recorded since the last commit form the next undo group. Groups
+    made by single character inserts or deletes next to each other are
+    merged until a word starts or group_limit characters are reached, so
+    one undo takes back about a word of typing. When the groups hold more
+    than limit characters the oldest ones are dropped.
+    '''
+    group_limit = 20
+
+    def __init__(self, limit=65536):
+        self.limit = limit
+        self.groups = deque()
+        self.size = 0
+        self.pending = []
+        self.point = 0
+        self.mark = -1
+        self.origin = None
+        self.open = False
+
+    def clear(self, line):
+        '''Forget all edits and start recording the edits of line.'''
+        self.groups.clear()
+        self.size = 0
+        self.pending = []
+        self.origin = None
+        self.open = False
+        line.line_buffer.edits = self.pending
+        self.point = line.point
+        self.mark = line.mark
+
+    def _kind(self, line, edits):
+        if len(edits) == 1:
+            start, removed, inserted = edits[0]
+            if not removed and inserted == 1:
+                return "insert", line.line_buffer[start]
+            if len(removed) == 1 and not inserted:
+                return "delete", removed[0]
+        return None, None
+
+    def _continues(self, group, kind, char, start, is_word_token):
+        if not self.open or group.kind != kind or \
+                len(group.edits) >= self.group_limit:
+            return False
+        last_start, last_removed, last_inserted = group.edits[-1]
+        if kind == "insert":
+            if start != last_start + 1:
+                return False
+            #Typing a word after a space starts a new group
+            return not (is_word_token(char) and
+                        not is_word_token(group.last_char))
+        if start != last_start and start != last_start - 1:
+            return False
+        return not (is_word_token(group.last_char) and
+                    not is_word_token(char))
+
+    def commit(self, line):
+        '''Make the edits recorded since the last commit an undo group.'''
+        if line.line_buffer.edits is not self.pending:
+            self.clear(line)
+            return
+        if self.pending:
+            edits = self.pending[:]
+            del self.pending[:]
+            kind, char = self._kind(line, edits)
+            group = self.groups[-1] if self.groups else None
+            if kind is None or group is None or \
+                    not self._continues(group, kind, char, edits[0][0],
+                                        line.is_word_token):
+                group = UndoGroup(self.point, self.mark, kind)
+                self.groups.append(group)
+            group.last_char = char
+            self.size += group.add(edits)
+            self.open = kind is not None
+            self._evict(line)
+        elif (self.point, self.mark) != (line.point, line.mark):
+            self.open = False
+        self.point = line.point
+        self.mark = line.mark
+
+    def _evict(self, line):
+        if self.size <= self.limit or len(self.groups) < 2:
+            return
+        if self.origin is None:
+            chars = list(line.line_buffer)
+            for group in reversed(self.groups):
+                self._revert_group(chars, group)
+            self.origin = (chars, self.groups[0].point, self.groups[0].mark)
+        while self.size > self.limit and len(self.groups) > 1:
+            self.size -= self.groups.popleft().size
+
+    def _revert_group(self, chars, group):
+        for start, removed, inserted in reversed(group.edits):
+            chars[start:start + inserted] = removed
+
+    def _restore(self, line, revert):
+        buf = line.line_buffer
+        buf.edits = None
+        try:
+            point, mark = revert(buf)
+        finally:
+            buf.edits = self.pending
+        line.point = point
+        line.mark = mark
+        self.point = point
+        self.mark = mark
+        self.open = False
+
+    def undo(self, line):
+        '''Undo the last group of edits of line. Return False if there
+        is nothing to undo.'''
+        self.commit(line)
+        if not self.groups:
+            return False
+        group = self.groups.pop()
+        self.size -= group.size
+        def revert(buf):
+            self._revert_group(buf, group)
+            return group.point, group.mark
+        self._restore(line, revert)
+        return True
+
+    def revert(self, line):
+        '''Undo all edits of line since the log was cleared. Return False
+        if there is nothing to undo.'''
+        self.commit(line)
+        if not self.groups and self.origin is None:
+            return False
+        groups = list(self.groups)
+        origin = self.origin
+        def revert(buf):
+            if origin is not None:
+                chars, point, mark = origin
+                buf[:] = chars
+                return point, mark
+            for group in reversed(groups):
+                self._revert_group(buf, group)
+            return groups[0].point, groups[0].mark
+        self._restore(line, revert)
+        self.groups.clear()
+        self.size = 0
+        self.origin = None
+        return True
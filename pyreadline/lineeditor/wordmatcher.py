@@ -7,56 +7,71 @@
 #*****************************************************************************
 from __future__ import print_function, unicode_literals, absolute_import
 
-import re, operator
-
-
-def str_find_all(str, ch):
-    result = []
-    index = 0
-    while index >= 0:
-        index = str.find(ch, index)
-        if index >= 0:
-            result.append(index)
-            index += 1
-    return result
-        
-
-word_pattern = re.compile("(x*)")
-
-def markwords(str, iswordfun):
-    markers = {True : "x", False : "o"}
-    return "".join([markers[iswordfun(ch)] for ch in str])
-
-def split_words(str, iswordfun):
-    return [x for x in word_pattern.split(markwords(str,iswordfun)) if x != ""]
-
-def mark_start_segment(str, is_segment):
-    def mark_start(s):
-        if s[0:1] == "x":
-            return "s" + s[1:]
-        else:
-            return s
-    return "".join(map(mark_start, split_words(str, is_segment)))
-
-def mark_end_segment(str, is_segment):
-    def mark_start(s):
-        if s[0:1] == "x":
-            return s[:-1] + "s"
-        else:
-            return s
-    return "".join(map(mark_start, split_words(str, is_segment)))
-    
-def mark_start_segment_index(str, is_segment):
-    return str_find_all(mark_start_segment(str, is_segment), "s")
-
-def mark_end_segment_index(str, is_segment):
-    return [x + 1 for x in str_find_all(mark_end_segment(str, is_segment), "s")]
+import re
+
+
+def word_token(word_chars=None):
+    '''Return an is_word_token function for a set of word characters.
+
+    With word_chars None every character but whitespace is a word
+    character. Otherwise unicode letters and digits, "_" and the characters
+    in word_chars are.'''
+    if word_chars is None:
+        return is_word_token
+    pattern = re.compile("[\\w%s]+"%re.escape(word_chars), re.U)
+    def is_word_token_in(str):
+        return len(str) == 1 and pattern.match(str) is not None
+    is_word_token_in.pattern = pattern
+    return is_word_token_in
+
+
+def word_spans(str, is_segment):
+    '''Generate the (start, stop) positions of the words in str.'''
+    pattern = getattr(is_segment, "pattern", None)
+    if pattern is not None:
+        for match in pattern.finditer("".join(str)):
+            yield match.span()
+        return
+    start = None
+    for index, ch in enumerate(str):
+        if is_segment(ch):
+            if start is None:
+                start = index
+        elif start is not None:
+            yield start, index
+            start = None
+    if start is not None:
+        yield start, len(str)
+
+
+def word_boundaries(str, is_segment):
+    '''Return the next_start, next_end, prev_start and prev_end tables
+    for str, see the functions below, built in one pass over its words.'''
+    length = len(str)
+    next_start = []
+    next_end = []
+    prev_start = []
+    prev_end = []
+    start = end = 0
+    for word_start, word_end in word_spans(str, is_segment):
+        next_start.extend([word_start] * (word_start - len(next_start)))
+        prev_start.extend([start] * (word_start + 1 - len(prev_start)))
+        next_end.extend([word_end] * (word_end - len(next_end)))
+        prev_end.extend([end] * (word_end + 1 - len(prev_end)))
+        start = word_start
+        end = word_end
+    next_start.extend([length] * (length + 1 - len(next_start)))
+    next_end.extend([length] * (length + 1 - len(next_end)))
+    prev_start.extend([start] * (length + 1 - len(prev_start)))
+    prev_end.extend([length] * (length + 1 - len(prev_end)))
+    return next_start, next_end, prev_start, prev_end
 
 
 ################  Following are used in lineobj  ###########################
 
 def is_word_token(str):
     return not is_non_word_token(str)
+is_word_token.pattern = re.compile("[^ \t\n]+")
     
 def is_non_word_token(str):
     if len(str) != 1 or str in " \t\n":
@@ -65,39 +80,20 @@ def is_non_word_token(str):
         return False
 
 def next_start_segment(str, is_segment):
-    str = "".join(str)
-    result = []
-    for start in mark_start_segment_index(str, is_segment):
-        result[len(result):start] = [start for x in range(start - len(result))]
-    result[len(result):len(str)] = [len(str) for x in range(len(str) - len(result) + 1)]            
-    return result
+    '''For each position the start of the next word after it, or the
+    length of str.'''
+    return word_boundaries(str, is_segment)[0]
     
 def next_end_segment(str, is_segment):
-    str = "".join(str)
-    result = []
-    for start in mark_end_segment_index(str, is_segment):
-        result[len(result):start] = [start for x in range(start - len(result))]
-    result[len(result):len(str)] = [len(str) for x in range(len(str) - len(result) + 1)]            
-    return result    
-
+    '''For each position the end of the next word ending after it, or the
+    length of str.'''
+    return word_boundaries(str, is_segment)[1]
 
 def prev_start_segment(str, is_segment):
-    str = "".join(str)
-    result = []
-    prev = 0
-    for start in mark_start_segment_index(str, is_segment):
-        result[len(result):start+1] = [prev for x in range(start - len(result) + 1)]
-        prev=start
-    result[len(result):len(str)] = [prev for x in range(len(str) - len(result) + 1)]            
-    return result
+    '''For each position the start of the last word before it, or 0.'''
+    return word_boundaries(str, is_segment)[2]
 
 def prev_end_segment(str, is_segment):
-    str = "".join(str)
-    result = []
-    prev = 0
-    for start in mark_end_segment_index(str, is_segment):
-        result[len(result):start + 1] = [prev for x in range(start - len(result) + 1)]
-        prev=start
-    result[len(result):len(str)] = [len(str) for x in range(len(str) - len(result) + 1)]            
-    return result    
-
+    '''For each position up to the end of the last word the end of the
+    word ending before it, or 0. The length of str after the last word.'''
+    return word_boundaries(str, is_segment)[3]
@@ -13,6 +13,7 @@ import pyreadline.logger as logger
 from   pyreadline.logger import log
 from   pyreadline.keysyms.common import make_KeyPress_from_keydescr
 import pyreadline.lineeditor.lineobj as lineobj
+import pyreadline.lineeditor.wordmatcher as wordmatcher
 import pyreadline.lineeditor.history as history
 import pyreadline.clipboard as clipboard
 from pyreadline.error import ReadlineError,GetSetError
@@ -28,6 +29,8 @@ class BaseMode(object):
         self.key_dispatch = {}
         self.argument=1
         self.prevargument=None
+        self.word_characters = None
+        self.is_word_token = wordmatcher.is_word_token
         self.l_buffer=lineobj.ReadLineTextBuffer("")
         self._history=history.LineHistory()
         self.completer_delims = " \t\n\"\\'`@$><=;|&{("
@@ -62,6 +65,21 @@ class BaseMode(object):
     def __repr__(self):
         return "<BaseMode>"
 
+    def _get_l_buffer(self):
+        return self._l_buffer
+    def _set_l_buffer(self, l_buffer):
+        l_buffer.is_word_token = self.is_word_token
+        self._l_buffer = l_buffer
+    l_buffer = property(_get_l_buffer, _set_l_buffer)
+
+    def set_word_characters(self, word_chars=None):
+        '''Set the characters the word commands of this mode treat as part
+        of a word. None means every character but whitespace, otherwise
+        unicode letters and digits, "_" and the characters in word_chars.'''
+        self.word_characters = word_chars
+        self.is_word_token = wordmatcher.word_token(word_chars)
+        self.l_buffer = self.l_buffer
+
     def _gs(x):
         def g(self):
             return getattr(self.rlobj,x)
@@ -117,7 +135,9 @@ class BaseMode(object):
                     traceback.print_exc()
 
         self.l_buffer.reset_line()
+        self.l_buffer.clear_undo()
         self.prompt = prompt
+        self._history.finish_command()
 
         if self.pre_input_hook:
             try:
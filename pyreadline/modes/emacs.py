@@ -37,11 +37,23 @@ class IncrementalSearchPromptMode(object):
         #dispatch_func = self.key_dispatch.get(keytuple, default)
         revtuples = []
         fwdtuples = []
+        fuzzytuples = []
+        regexrevtuples = []
+        regexfwdtuples = []
+        archivetuples = []
         for ktuple, func in self.key_dispatch.items():
             if func == self.reverse_search_history:
                 revtuples.append(ktuple)
             elif func == self.forward_search_history:
                 fwdtuples.append(ktuple)
+            elif func == self.fuzzy_search_history:
+                fuzzytuples.append(ktuple)
+            elif func == self.reverse_regex_search_history:
+                regexrevtuples.append(ktuple)
+            elif func == self.forward_regex_search_history:
+                regexfwdtuples.append(ktuple)
+            elif func == self.archive_search_history:
+                archivetuples.append(ktuple)
         
         
         log("IncrementalSearchPromptMode %s %s"%(keyinfo, keytuple))
@@ -57,6 +69,7 @@ class IncrementalSearchPromptMode(object):
             self.prompt = self.subsearch_oldprompt
             self.process_keyevent_queue = self.process_keyevent_queue[:-1]
             self._history.history_cursor = len(self._history.history)
+            self._history.forget_search_matches()
             if keyinfo.keyname == 'escape':
                 self.l_buffer.set_line(self.subsearch_old_line)
             return True
@@ -70,6 +83,22 @@ class IncrementalSearchPromptMode(object):
             self.subsearch_fun = self._history.forward_search_history
             self.subsearch_prompt = "forward-i-search%d`%s': "
             self.line = self.subsearch_fun(self.subsearch_query)
+        elif keytuple in fuzzytuples:
+            self.subsearch_fun = self._history.fuzzy_search_history
+            self.subsearch_prompt = "fuzzy-i-search%d`%s': "
+            self.line = self.subsearch_fun(self.subsearch_query)
+        elif keytuple in regexrevtuples:
+            self.subsearch_fun = self._history.reverse_regex_search_history
+            self.subsearch_prompt = "reverse-regex-i-search%d`%s': "
+            self.line = self.subsearch_fun(self.subsearch_query)
+        elif keytuple in regexfwdtuples:
+            self.subsearch_fun = self._history.forward_regex_search_history
+            self.subsearch_prompt = "forward-regex-i-search%d`%s': "
+            self.line = self.subsearch_fun(self.subsearch_query)
+        elif keytuple in archivetuples:
+            self.subsearch_fun = self._history.archive_search_history
+            self.subsearch_prompt = "archive-i-search%d`%s': "
+            self.line = self.subsearch_fun(self.subsearch_query)
         elif keyinfo.control == False and keyinfo.meta == False:
             self.subsearch_query += keyinfo.char
             self.line = self.subsearch_fun(self.subsearch_query)
@@ -92,10 +121,22 @@ class IncrementalSearchPromptMode(object):
         self.subsearch_oldprompt = self.prompt
 
         if (self.previous_func != self.reverse_search_history and
-            self.previous_func != self.forward_search_history):
+            self.previous_func != self.forward_search_history and
+            self.previous_func != self.fuzzy_search_history and
+            self.previous_func != self.reverse_regex_search_history and
+            self.previous_func != self.forward_regex_search_history and
+            self.previous_func != self.archive_search_history):
             self.subsearch_query = self.l_buffer[0:Point].get_line_text()
 
-        if self.subsearch_fun == self.reverse_search_history:
+        if self.subsearch_fun == self._history.fuzzy_search_history:
+            self.subsearch_prompt = "fuzzy-i-search%d`%s': "
+        elif self.subsearch_fun == self._history.reverse_regex_search_history:
+            self.subsearch_prompt = "reverse-regex-i-search%d`%s': "
+        elif self.subsearch_fun == self._history.forward_regex_search_history:
+            self.subsearch_prompt = "forward-regex-i-search%d`%s': "
+        elif self.subsearch_fun == self._history.archive_search_history:
+            self.subsearch_prompt = "archive-i-search%d`%s': "
+        elif self.subsearch_fun == self.reverse_search_history:
             self.subsearch_prompt = "reverse-i-search%d`%s': "
         else:
             self.subsearch_prompt = "forward-i-search%d`%s': "
@@ -121,7 +162,13 @@ class SearchPromptMode(object):
             self.non_inc_query = self.non_inc_query[:-1]
         elif keyinfo.keyname in ['return', 'escape']:
             if self.non_inc_query:
-                if self.non_inc_direction == -1:
+                if self.non_inc_regex:
+                    history.last_regex_search_for = None
+                    if self.non_inc_direction == -1:
+                        res = history.reverse_regex_search_history(self.non_inc_query)
+                    else:
+                        res = history.forward_regex_search_history(self.non_inc_query)
+                elif self.non_inc_direction == -1:
                     res = history.reverse_search_history(self.non_inc_query)
                 else:
                     res = history.forward_search_history(self.non_inc_query)
@@ -143,8 +190,9 @@ class SearchPromptMode(object):
             pass
         self.prompt = self.non_inc_oldprompt + ":" + self.non_inc_query
 
-    def _init_non_i_search(self, direction):
+    def _init_non_i_search(self, direction, regex=False):
         self.non_inc_direction = direction
+        self.non_inc_regex = regex
         self.non_inc_query = ""
         self.non_inc_oldprompt = self.prompt
         self.non_inc_oldline = self.l_buffer.copy()
@@ -165,6 +213,16 @@ class SearchPromptMode(object):
         for a string supplied by the user.'''
         return self._init_non_i_search(1)
 
+    def non_incremental_reverse_regex_search_history(self, e):  # (M-P)
+        '''Like non_incremental_reverse_search_history, searching for lines
+        matching a regular expression.'''
+        return self._init_non_i_search(-1, regex=True)
+
+    def non_incremental_forward_regex_search_history(self, e):  # (M-N)
+        '''Like non_incremental_forward_search_history, searching for lines
+        matching a regular expression.'''
+        return self._init_non_i_search(1, regex=True)
+
 
 class LeaveModeTryNext(Exception):
     pass
@@ -330,6 +388,43 @@ class EmacsMode(DigitArgumentMode, IncrementalSearchPromptMode,
         self._init_incremental_search(self._history.forward_search_history, e)
         self.finalize()
 
+    def fuzzy_search_history(self, e):  # (M-F)
+        '''Search the history for lines holding the typed characters in
+        order, best match first. Pressing the key again moves to the next
+        best match. This is an incremental search.'''
+        log("fuzzy_search_history")
+        self._history.last_fuzzy_search_for = None
+        self._init_incremental_search(self._history.fuzzy_search_history, e)
+        self.finalize()
+
+    def reverse_regex_search_history(self, e):  # (M-R)
+        '''Search backward for lines matching a regular expression. While
+        the expression is incomplete it is matched literally. This is an
+        incremental search.'''
+        log("reverse_regex_search_history")
+        self._history.last_regex_search_for = None
+        self._init_incremental_search(
+            self._history.reverse_regex_search_history, e)
+        self.finalize()
+
+    def forward_regex_search_history(self, e):  # (M-S)
+        '''Search forward for lines matching a regular expression. This is
+        an incremental search.'''
+        log("forward_regex_search_history")
+        self._history.last_regex_search_for = None
+        self._init_incremental_search(
+            self._history.forward_regex_search_history, e)
+        self.finalize()
+
+    def archive_search_history(self, e):  # (M-A)
+        '''Search all history, including the lines archived when the
+        history file was compacted, most recent line first. Pressing the key
+        again moves to the next older match. This is an incremental search.'''
+        log("archive_search_history")
+        self._history.last_archive_search_for = None
+        self._init_incremental_search(self._history.archive_search_history, e)
+        self.finalize()
+
     def history_search_forward(self, e):  # ()
         '''Search forward through the history for the string of characters
         between the start of the current line and the point. This is a
@@ -360,6 +455,21 @@ class EmacsMode(DigitArgumentMode, IncrementalSearchPromptMode,
         self.l_buffer.point = q.point
         self.finalize()
 
+    def relevant_history(self, e):  # (M-Up)
+        '''Recall the lines starting with the text before point, most
+        relevant first, combining how often and how recently they were
+        used. Repeating the command moves to the next line.'''
+        if (self.previous_func and
+            hasattr(self._history, self.previous_func.__name__)):
+            self._history.lastcommand = getattr(self._history,
+                                                self.previous_func.__name__)
+        else:
+            self._history.lastcommand = None
+        q = self._history.relevant_history(self.l_buffer)
+        self.l_buffer = q
+        self.l_buffer.point = q.point
+        self.finalize()
+
     def yank_nth_arg(self, e):  # (M-C-y)
         '''Insert the first argument to the previous command (usually the
         second word on the previous line) at point. With an argument n,
@@ -549,6 +659,7 @@ class EmacsMode(DigitArgumentMode, IncrementalSearchPromptMode,
     def revert_line(self, e):  # (M-r)
         '''Undo all changes made to this line. This is like executing the
         undo command enough times to get back to the beginning.'''
+        self.l_buffer.revert_line()
         self.finalize()
 
     def tilde_expand(self, e):  # (M-~)
@@ -654,6 +765,7 @@ class EmacsMode(DigitArgumentMode, IncrementalSearchPromptMode,
         self._bind_key('Up',                self.history_search_backward)
         self._bind_key('Control-n',         self.next_history)
         self._bind_key('Down',              self.history_search_forward)
+        self._bind_key('Alt-Up',            self.relevant_history)
         self._bind_key('Control-a',         self.beginning_of_line)
         self._bind_key('Control-e',         self.end_of_line)
         self._bind_key('Alt-<',             self.beginning_of_history)
@@ -661,12 +773,21 @@ class EmacsMode(DigitArgumentMode, IncrementalSearchPromptMode,
         self._bind_key('Control-r',         self.reverse_search_history)
         self._bind_key('Control-s',         self.forward_search_history)
         self._bind_key('Control-Shift-r',         self.forward_search_history)
+        self._bind_key('Alt-Shift-f',       self.fuzzy_search_history)
+        self._bind_key('Alt-Shift-r',       self.reverse_regex_search_history)
+        self._bind_key('Alt-Shift-s',       self.forward_regex_search_history)
+        self._bind_key('Alt-Shift-a',       self.archive_search_history)
         self._bind_key('Alt-p',
                        self.non_incremental_reverse_search_history)
         self._bind_key('Alt-n',
                        self.non_incremental_forward_search_history)
+        self._bind_key('Alt-Shift-p',
+                       self.non_incremental_reverse_regex_search_history)
+        self._bind_key('Alt-Shift-n',
+                       self.non_incremental_forward_regex_search_history)
         self._bind_key('Control-z',         self.undo)
         self._bind_key('Control-_',         self.undo)
+        self._bind_key('Alt-r',             self.revert_line)
         self._bind_key('Escape',            self.kill_whole_line)
         self._bind_key('Meta-d',            self.kill_word)
         self._bind_key('Control-Delete',       self.forward_delete_word)
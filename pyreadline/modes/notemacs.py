@@ -503,7 +503,7 @@ class NotEmacsMode(basemode.BaseMode):
     def revert_line(self, e): # (M-r)
         '''Undo all changes made to this line. This is like executing the
         undo command enough times to get back to the beginning.'''
-        pass
+        self.l_buffer.revert_line()
 
     def tilde_expand(self, e): # (M-~)
         '''Perform tilde expansion on the current word.'''
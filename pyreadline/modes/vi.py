@@ -764,7 +764,7 @@ class ViCommand:
         self.state = _VI_END
 
     def key_v (self, char):
-        editor = ViExternalEditor (self.readline.l_buffer.line_buffer)
+        editor = ViExternalEditor (list (self.readline.l_buffer.line_buffer))
         self.readline.l_buffer.line_buffer = list (editor.result)
         self.readline.l_buffer.point = 0
         self.is_edit = True
@@ -56,6 +56,8 @@ class BaseReadline(object):
         self.mark = -1
         self.console=MockConsole()
         self.disable_readline = False
+        self.history_namespace = None
+        self._history_namespaces = {}
         # this code needs to follow l_buffer and history creation
         self.editingmodes = [mode(self) for mode in editingmodes]
         for mode in self.editingmodes:
@@ -153,6 +155,16 @@ class BaseReadline(object):
         '''Return the current contents of history item at index.'''
         return self.mode._history.get_history_item(index)
 
+    def get_history_metadata(self, index):
+        '''Return the (timestamp, duration, cwd, session) of history item
+        at index.'''
+        return self.mode._history.get_history_metadata(index)
+
+    def entries_between(self, start, stop):
+        '''Return the indexes of the history items added from time start
+        up to time stop.'''
+        return self.mode._history.entries_between(start, stop)
+
     def clear_history(self):
         '''Clear readline history'''
         self.mode._history.clear_history()
@@ -164,10 +176,63 @@ class BaseReadline(object):
         log("read_history_file from %s"%ensure_unicode(filename))
         self.mode._history.read_history_file(filename)
 
+    def history_stats(self, n=10):
+        '''Return the total and distinct number of history entries, the n
+        most used ones and the number of entries added in each hour.'''
+        return self.mode._history.history_stats(n)
+
+    def import_history(self, filename, format=None):
+        '''Add the entries of a bash, zsh or fish history file to the
+        history.'''
+        return self.mode._history.import_history(filename, format)
+
     def write_history_file(self, filename=None): 
-        '''Save a readline history file. The default filename is ~/.history.'''
+        '''Save a readline history file. The default filename is ~/.history.
+
+        Without a filename the histories of all namespaces used are saved,
+        each to its own file, see set_history_namespace.'''
+        if filename is None:
+            for name, namespace in self._history_namespaces.items():
+                if namespace is not self.mode._history:
+                    log("write_history_file namespace %s"%name)
+                    namespace.write_history_file()
         self.mode._history.write_history_file(filename)
 
+    def append_history_file(self, nelements, filename=None):
+        '''Append the last nelements items of history to a file. The default
+        filename is ~/.history.'''
+        self.mode._history.append_history_file(nelements, filename)
+
+    def set_history_namespace(self, name=None):
+        '''Switch to the history of namespace name, or back to the default
+        history if name is None.
+
+        Applications such as pdb use a namespace to keep their lines out of
+        the history of the interactive prompt. A namespace has the settings
+        of the default history and keeps its lines in a file named after
+        the default history file, with "-" and name appended. The file is
+        read the first time the namespace is used, and the namespace is
+        kept in memory for switching back to it.'''
+        if name == self.history_namespace:
+            return
+        if name is not None and not re.match(r"\w[-\w.]*$", name):
+            raise ValueError("invalid history namespace %r"%name)
+        namespaces = self._history_namespaces
+        namespaces[self.history_namespace] = self.mode._history
+        namespace = namespaces.get(name)
+        if namespace is None:
+            default = namespaces[None]
+            namespace = history.LineHistory()
+            namespace.copy_settings(default)
+            namespace.history_filename = history.namespace_name(
+                default.history_filename, name)
+            log("set_history_namespace: reading %s"%
+                ensure_unicode(namespace.history_filename))
+            namespace.read_history_file()
+            namespaces[name] = namespace
+        self.mode._history = namespace
+        self.history_namespace = name
+
     #Completer functions
 
     def set_completer(self, function=None): 
@@ -323,6 +388,46 @@ class BaseReadline(object):
         def sethistorylength(length):
             self.mode._history.history_length = int(length)
 
+        def sethistoryjournal(mode):
+            self.mode._history.history_journal = mode
+
+        def sethistorycontrol(control):
+            self.mode._history.history_control = control
+
+        def sethistoryfrecency(mode):
+            self.mode._history.history_frecency = mode
+
+        def sethistorycompression(mode):
+            self.mode._history.history_compression = mode
+
+        def sethistoryshared(mode):
+            self.mode._history.history_shared = mode
+
+        def sethistorydatabase(mode):
+            self.mode._history.history_database = mode
+
+        def sethistorytimestamps(mode):
+            self.mode._history.history_timestamps = mode
+
+        def sethistoryarchive(mode, workers=2):
+            history = self.mode._history
+            history.history_archive = mode
+            history.history_archive_workers = int(workers)
+
+        def setfuzzysearch(limit=100, scan=None):
+            history = self.mode._history
+            history.fuzzy_limit = int(limit)
+            if scan is not None:
+                scan = int(scan)
+            history.fuzzy_scan = scan
+
+        def sethistorywriter(mode, interval=5.0, batch=50, timeout=1.0):
+            history = self.mode._history
+            history.history_writer = mode
+            history.history_writer_interval = float(interval)
+            history.history_writer_batch = int(batch)
+            history.history_writer_timeout = float(timeout)
+
         def allow_ctrl_c(mode):
             log("allow_ctrl_c:%s:%s"%(self.allow_ctrl_c, mode))
             self.allow_ctrl_c = mode
@@ -342,6 +447,9 @@ class BaseReadline(object):
         def completer_delims(delims):
             self.mode.completer_delims = delims
         
+        def word_characters(word_chars=None):
+            self.mode.set_word_characters(word_chars)
+
         def complete_filesystem(delims):
             self.mode.complete_filesystem = delims.lower()
 
@@ -391,9 +499,20 @@ class BaseReadline(object):
                "show_all_if_ambiguous":show_all_if_ambiguous,
                "completer_delims":completer_delims,
                "complete_filesystem":complete_filesystem,
+               "word_characters":word_characters,
                "debug_output":debug_output,
                "history_filename":sethistoryfilename,
                "history_length":sethistorylength,
+               "history_journal":sethistoryjournal,
+               "history_control":sethistorycontrol,
+               "history_frecency":sethistoryfrecency,
+               "history_compression":sethistorycompression,
+               "history_shared":sethistoryshared,
+               "history_writer":sethistorywriter,
+               "history_database":sethistorydatabase,
+               "history_timestamps":sethistorytimestamps,
+               "history_archive":sethistoryarchive,
+               "fuzzy_search":setfuzzysearch,
                "set_prompt_color":set_prompt_color,
                "set_input_color":set_input_color,
                "allow_ctrl_c":allow_ctrl_c,
@@ -485,8 +604,8 @@ class Readline(BaseReadline):
         self._print_prompt()
         ltext = l_buffer.quoted_text()
         if l_buffer.enable_selection and (l_buffer.selection_mark >= 0):
-            start = len(l_buffer[:l_buffer.selection_mark].quoted_text())
-            stop  = len(l_buffer[:l_buffer.point].quoted_text())
+            start = l_buffer.quoted_width(l_buffer.selection_mark)
+            stop  = l_buffer.quoted_width(l_buffer.point)
             if start > stop:
                 stop,start = start,stop
             n = c.write_scrolling(ltext[:start], self.command_color)
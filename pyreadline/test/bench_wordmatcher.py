@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#*****************************************************************************
+#       Copyright (C) 2006  Jorgen Stenarson. <jorgen.stenarson@bostream.nu>
+#
+#  Distributed under the terms of the BSD License.  The full license is in
+#  the file COPYING, distributed as part of this software.
+#*****************************************************************************
+'''Time the word boundary tables of a 10000 character line, built by
+wordmatcher.word_boundaries and by the markwords and regex split code it
+replaced, which is kept below for the comparison. Run from the top of the
+source tree:
+
+    python pyreadline/test/bench_wordmatcher.py
+'''
+from __future__ import print_function, unicode_literals, absolute_import
+
+import re, sys, timeit
+sys.path.insert(0, ".")
+from pyreadline.lineeditor import wordmatcher
+
+
+#The implementation before word_boundaries, one table per call
+
+def str_find_all(str, ch):
+    result = []
+    index = 0
+    while index >= 0:
+        index = str.find(ch, index)
+        if index >= 0:
+            result.append(index)
+            index += 1
+    return result
+
+word_pattern = re.compile("(x*)")
+
+def markwords(str, iswordfun):
+    markers = {True : "x", False : "o"}
+    return "".join([markers[iswordfun(ch)] for ch in str])
+
+def split_words(str, iswordfun):
+    return [x for x in word_pattern.split(markwords(str,iswordfun)) if x != ""]
+
+def mark_start_segment(str, is_segment):
+    def mark_start(s):
+        if s[0:1] == "x":
+            return "s" + s[1:]
+        else:
+            return s
+    return "".join(map(mark_start, split_words(str, is_segment)))
+
+def mark_end_segment(str, is_segment):
+    def mark_start(s):
+        if s[0:1] == "x":
+            return s[:-1] + "s"
+        else:
+            return s
+    return "".join(map(mark_start, split_words(str, is_segment)))
+
+def mark_start_segment_index(str, is_segment):
+    return str_find_all(mark_start_segment(str, is_segment), "s")
+
+def mark_end_segment_index(str, is_segment):
+    return [x + 1 for x in str_find_all(mark_end_segment(str, is_segment), "s")]
+
+def next_start_segment(str, is_segment):
+    str = "".join(str)
+    result = []
+    for start in mark_start_segment_index(str, is_segment):
+        result[len(result):start] = [start for x in range(start - len(result))]
+    result[len(result):len(str)] = [len(str) for x in range(len(str) - len(result) + 1)]
+    return result
+
+def next_end_segment(str, is_segment):
+    str = "".join(str)
+    result = []
+    for start in mark_end_segment_index(str, is_segment):
+        result[len(result):start] = [start for x in range(start - len(result))]
+    result[len(result):len(str)] = [len(str) for x in range(len(str) - len(result) + 1)]
+    return result
+
+def prev_start_segment(str, is_segment):
+    str = "".join(str)
+    result = []
+    prev = 0
+    for start in mark_start_segment_index(str, is_segment):
+        result[len(result):start+1] = [prev for x in range(start - len(result) + 1)]
+        prev=start
+    result[len(result):len(str)] = [prev for x in range(len(str) - len(result) + 1)]
+    return result
+
+def prev_end_segment(str, is_segment):
+    str = "".join(str)
+    result = []
+    prev = 0
+    for start in mark_end_segment_index(str, is_segment):
+        result[len(result):start + 1] = [prev for x in range(start - len(result) + 1)]
+        prev=start
+    result[len(result):len(str)] = [len(str) for x in range(len(str) - len(result) + 1)]
+    return result
+
+def old_boundaries(str, is_segment):
+    return (next_start_segment(str, is_segment),
+            next_end_segment(str, is_segment),
+            prev_start_segment(str, is_segment),
+            prev_end_segment(str, is_segment))
+
+
+def best_time(function, *args):
+    return min(timeit.repeat(lambda: function(*args), number=5, repeat=3)) / 5
+
+
+def main():
+    line = ("some_words and_more  words, åäö 12.5\t" * 300)[:10000]
+    chars = list(line)
+    print("word boundary tables of a %d character line:"%len(line))
+    for name, is_segment in [("non space", wordmatcher.is_word_token),
+                             ("letters and digits",
+                              wordmatcher.word_token(""))]:
+        new = wordmatcher.word_boundaries(chars, is_segment)
+        assert new == old_boundaries(chars, is_segment), name
+        before = best_time(old_boundaries, chars, is_segment)
+        after = best_time(wordmatcher.word_boundaries, chars, is_segment)
+        print("%-20s markwords %8.2f ms  word_boundaries %8.2f ms  %5.1fx"%(
+            name, before * 1000, after * 1000, before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ sys.path.insert(0, '../..')
 from pyreadline.modes.emacs import *
 from pyreadline import keysyms
 from pyreadline.lineeditor import lineobj
+from pyreadline.keysyms.common import make_KeyPress_from_keydescr
 
 from pyreadline.test.common import *
 from pyreadline.logger import log
@@ -87,6 +88,27 @@ class TestsKeyinfo (unittest.TestCase):
         keyinfo, event = keytext_to_keyinfo_and_event ('Escape')
         self.assertEqual ('\x1b', event.char)
 
+    def test_history_search_keys (self):
+        # Alt is 0x2, Shift 0x10 and Control 0x8 in the console key state
+        r = EmacsModeTest ()
+        for char, command in [('R', r.reverse_regex_search_history),
+                              ('S', r.forward_regex_search_history),
+                              ('P', r.non_incremental_reverse_regex_search_history),
+                              ('N', r.non_incremental_forward_regex_search_history),
+                              ('A', r.archive_search_history),
+                              ('F', r.fuzzy_search_history)]:
+            keyinfo = keysyms.make_KeyPress (char, 0x2 | 0x10, ord (char))
+            self.assertEqual (command, r.key_dispatch [keyinfo.tuple ()])
+            # Control-Alt is AltGr and arrives as the plain character
+            keyinfo = keysyms.make_KeyPress (char, 0x2 | 0x8, ord (char))
+            self.assertEqual ((False, False, False, char), keyinfo.tuple ())
+        keyinfo = keysyms.make_KeyPress ('r', 0x2, ord ('R'))
+        self.assertEqual (r.revert_line, r.key_dispatch [keyinfo.tuple ()])
+        r.readline_setup ()
+        r.input ('"abc"')
+        r.input ('Alt-r')
+        self.assertEqual (r.line, '')
+
 
 class TestsMovement (unittest.TestCase):
     def test_cursor (self):
@@ -135,6 +157,28 @@ class TestsMovement (unittest.TestCase):
         self.assertEqual (r.line, 'First Second Third')
         self.assertEqual (r.line_cursor, 0)
 
+    def test_word_characters (self):
+        r = EmacsModeTest ()
+        r.set_word_characters ("")
+        r.input('"foo.bar_1 baz"')
+        r.input('Control-a')
+        r.input('Ctrl-Right')
+        self.assertEqual (r.line_cursor, 3)
+        r.input('Ctrl-Right')
+        self.assertEqual (r.line_cursor, 9)
+        r.input('Ctrl-Left')
+        self.assertEqual (r.line_cursor, 4)
+        r.l_buffer = r.l_buffer.copy ()
+        r.input('Ctrl-Left')
+        self.assertEqual (r.line_cursor, 0)
+        r.set_word_characters (".")
+        r.input('Ctrl-Right')
+        self.assertEqual (r.line_cursor, 9)
+        r.set_word_characters ()
+        r.input('Control-a')
+        r.input('Ctrl-Right')
+        self.assertEqual (r.line_cursor, 9)
+
 
 class TestsDelete (unittest.TestCase):
     def test_delete (self):
@@ -377,6 +421,46 @@ class TestsHistory (unittest.TestCase):
         self.assertEqual (r.line, line)
         self.assertEqual (r.line_cursor, cursor)
         
+
+class TestsUndo (unittest.TestCase):
+    def keys (self, r, *keys):
+        for key in keys:
+            r.process_keyevent (make_KeyPress_from_keydescr (key))
+
+    def test_undo (self):
+        r = EmacsModeTest ()
+        r.readline_setup ()
+        self.keys (r, *"hello world")
+        self.keys (r, 'Control-_')
+        self.assertEqual (r.line, 'hello ')
+        self.assertEqual (r.line_cursor, 6)
+        self.keys (r, 'Control-_')
+        self.assertEqual (r.line, '')
+        self.keys (r, *"abc def")
+        self.keys (r, 'Control-a', 'Control-k')
+        self.assertEqual (r.line, '')
+        self.keys (r, 'Control-_')
+        self.assertEqual (r.line, 'abc def')
+        self.assertEqual (r.line_cursor, 0)
+        self.keys (r, 'Control-e', 'BackSpace', 'BackSpace', 'BackSpace')
+        self.assertEqual (r.line, 'abc ')
+        self.keys (r, 'Control-_')
+        self.assertEqual (r.line, 'abc def')
+        self.assertEqual (r.line_cursor, 7)
+        r.revert_line (None)
+        self.assertEqual (r.line, '')
+        self.keys (r, 'Control-_')
+        self.assertEqual (r.line, '')
+
+    def test_undo_is_per_line (self):
+        r = EmacsModeTest ()
+        r.readline_setup ()
+        self.keys (r, *"first")
+        r.readline_setup ()
+        self.keys (r, *"second")
+        r.revert_line (None)
+        self.assertEqual (r.line, '')
+
 #----------------------------------------------------------------------
 # utility functions
 
@@ -2,13 +2,20 @@
 # Copyright (C) 2007 Jörgen Stenarson. <>
 from __future__ import print_function, unicode_literals, absolute_import
 
-import sys, unittest
+import os, sys, shutil, tempfile, time, random, unittest
 sys.path.append ('../..')
 #from pyreadline.modes.vi import *
 #from pyreadline import keysyms
 from pyreadline.lineeditor import lineobj
 from pyreadline.lineeditor.history import LineHistory
 import pyreadline.lineeditor.history as history
+from pyreadline.rlmain import BaseReadline
+import pyreadline.lineeditor.historyfile as historyfile
+import pyreadline.lineeditor.historydb as historydb
+import pyreadline.lineeditor.historyindex as historyindex
+import pyreadline.lineeditor.historyarchive as historyarchive
+import pyreadline.lineeditor.historyimport as historyimport
+from pyreadline.lineeditor.historystore import HistoryStore, HistoryMetadata
 
 import pyreadline.logger
 pyreadline.logger.sock_silent=False
@@ -19,6 +26,43 @@ from pyreadline.logger import log
 #----------------------------------------------------------------------
 RL=lineobj.ReadLineTextBuffer
 
+def items(q):
+    return [q.get_history_item(i) for i in
+            range(1, q.get_current_history_length() + 1)]
+
+class HistoryFileTest(unittest.TestCase):
+    '''Base of the tests using a history file in a temporary directory.
+    The file is created with contents unless that is None, and the
+    histories made by history get the options in settings.'''
+    contents = None
+    settings = {}
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "history")
+        if self.contents is not None:
+            fp = open(self.filename, "wb")
+            fp.write(self.contents)
+            fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def history(self, **settings):
+        q = LineHistory()
+        q.history_filename = self.filename
+        options = dict(self.settings)
+        options.update(settings)
+        for name, value in sorted(options.items()):
+            setattr(q, name, value)
+        q.read_history_file()
+        return q
+
+    def lines(self):
+        if not os.path.exists(self.filename):
+            return []
+        return open(self.filename).read().splitlines()
+
 class Test_prev_next_history(unittest.TestCase):
     t = "test text"
 
@@ -135,7 +179,1255 @@ class Test_empty_history_search_incr_fwd_backwd(unittest.TestCase):
 
     def test_forward_1(self):
         q = self.q
-        self.assertEqual(q.forward_search_history("a"), "") 
+        self.assertEqual(q.forward_search_history("a"), "")
+
+class Test_indexed_history_search(unittest.TestCase):
+    def setUp(self):
+        self.q = q = LineHistory()
+        q.history_length = -1
+        for x in range(200):
+            q.add_history(RL("line %d %s"%(x, "abcdefg"[x % 7])))
+
+    def test_backward_stepping(self):
+        q = self.q
+        self.assertEqual(q.reverse_search_history("1 e"), "line 151 e")
+        self.assertEqual(q.reverse_search_history("1 e"), "line 81 e")
+        self.assertEqual(q.reverse_search_history("1 e"), "line 11 e")
+        self.assertEqual(q.reverse_search_history("1 e"), "line 10 d")
+
+    def test_forward_stepping(self):
+        q = self.q
+        q.history_cursor = 0
+        self.assertEqual(q.forward_search_history("9 a"), "line 49 a")
+        self.assertEqual(q.forward_search_history("9 a"), "line 119 a")
+        self.assertEqual(q.forward_search_history("9 a"), "line 189 a")
+        self.assertEqual(q.forward_search_history("9 a"), "line 190 b")
+
+    def test_short_query(self):
+        q = self.q
+        self.assertEqual(q.reverse_search_history("g"), "line 195 g")
+        self.assertEqual(q.reverse_search_history("g"), "line 188 g")
+
+    def test_index_follows_clear(self):
+        q = self.q
+        self.assertEqual(q.reverse_search_history("line"), "line 199 d")
+        q.clear_history()
+        q.add_history(RL("other"))
+        q.add_history(RL("line new"))
+        q.last_search_for = ""
+        self.assertEqual(q.reverse_search_history("line"), "line new")
+
+    def test_narrowing(self):
+        q = self.q
+        matches = q._matches("line 1")
+        self.assertEqual(len(matches), 111)
+        self.assertEqual(len(q._matches("line 19")), 11)
+        self.assertEqual(len(q._matches("line 199")), 1)
+        self.assertTrue(q._matches("line 1") is matches)
+        self.assertEqual(len(q._match_stack), 1)
+        q.add_history(RL("line 1 new"))
+        self.assertEqual(len(q._matches("line 1")), 112)
+        self.assertEqual(q.reverse_search_history("line 1"), "line 1 new")
+        q.forget_search_matches()
+        self.assertEqual(q._match_stack, [])
+
+    def test_prefix_search(self):
+        q = self.q
+        a = RL("line 19", point=7)
+        found = [q.history_search_backward(a).get_line_text()
+                 for x in range(12)]
+        self.assertEqual(found, ["line %d %s"%(x, "abcdefg"[x % 7]) for x
+                                 in list(range(199, 189, -1)) + [19, 19]])
+        self.assertEqual(q.history_search_forward(a).get_line_text(),
+                         "line 190 b")
+        q.add_history(RL("line 19 new"))
+        self.assertEqual(q.history_search_backward(a).get_line_text(),
+                         "line 19 new")
+
+    def test_prefix_search_skips_current_line(self):
+        q = LineHistory()
+        q.history_control = ""
+        for x in ["ab", "ac", "ab"]:
+            q.add_history(RL(x))
+        res = q.history_search_backward(RL("ab", point=1))
+        self.assertEqual(res.get_line_text(), "ac")
+        self.assertEqual(res.point, 1)
+
+class Test_fuzzy_history_search(unittest.TestCase):
+    def setUp(self):
+        self.q = q = LineHistory()
+        for x in ["abc", "xabcx", "a_b_c", "zzabc", "ABC", "bca", "abc"]:
+            q.add_history(RL(x))
+
+    def texts(self, q, positions):
+        return [q.get_history_item(p + 1) for p in positions]
+
+    def test_ranking(self):
+        q = self.q
+        self.assertEqual(self.texts(q, q.fuzzy_matches("abc")),
+                         ["abc", "ABC", "a_b_c", "zzabc", "xabcx"])
+        self.assertEqual(self.texts(q, q.fuzzy_matches("AB")), ["ABC"])
+        self.assertEqual(self.texts(q, q.fuzzy_matches("abc", 2)),
+                         ["abc", "ABC"])
+        self.assertEqual(q.fuzzy_matches("cab"), [])
+
+    def test_cycling(self):
+        q = self.q
+        self.assertEqual(q.fuzzy_search_history("bc"), "bca")
+        self.assertEqual(q.history_cursor, 5)
+        self.assertEqual(q.fuzzy_search_history("bc"), "a_b_c")
+        self.assertEqual(q.history_cursor, 2)
+        self.assertEqual(q.fuzzy_search_history("b_c"), "a_b_c")
+        self.assertEqual(q.fuzzy_search_history("b_c"), "a_b_c")
+
+    def test_candidates(self):
+        q = self.q
+        q.add_history(RL("print(arr2)"))
+        q.add_history(RL("x = a_b?"))
+        self.assertEqual(q.fuzzy_search_history("pr"), "print(arr2)")
+        self.assertEqual(q.fuzzy_search_history("b?"), "x = a_b?")
+        self.assertEqual(q.fuzzy_search_history("Pr"), "")
+        self.assertEqual(self.texts(q, q.fuzzy_matches("")),
+                         ["x = a_b?", "print(arr2)", "abc", "bca", "ABC",
+                          "zzabc", "a_b_c", "xabcx"])
+        self.assertEqual(list(historyindex.newest_first([[1, 4], [2, 4]])),
+                         [4, 2, 1])
+
+    def test_scan(self):
+        q = self.q
+        for x in range(20):
+            q.add_history(RL("cba %d"%x))
+        #Every candidate is scored unless fuzzy_scan is set
+        self.assertEqual(q.fuzzy_scan, None)
+        self.assertEqual(self.texts(q, q.fuzzy_matches("abc")),
+                         ["abc", "ABC", "a_b_c", "zzabc", "xabcx"])
+        q.fuzzy_scan = 3
+        self.assertEqual(q.fuzzy_matches("abc"), [])
+        q = self.q = LineHistory()
+        for x in ["abc", "xabcx", "a_b_c", "zzabc", "ABC", "bca", "abc"]:
+            q.add_history(RL(x))
+        q.fuzzy_scan = 3
+        #Only abc, bca and ABC are scored
+        self.assertEqual(self.texts(q, q.fuzzy_matches("abc")),
+                         ["abc", "ABC"])
+
+class Test_history_control(unittest.TestCase):
+    def history(self, control, lines):
+        q = LineHistory()
+        q.history_control = control
+        for x in lines:
+            q.add_history(RL(x))
+        return q
+
+    def test_ignoredups(self):
+        q = self.history("ignoredups", ["aa", "aa", " bb", "aa"])
+        self.assertEqual(items(q), ["aa", " bb", "aa"])
+        q = self.history("", ["aa", "aa"])
+        self.assertEqual(items(q), ["aa", "aa"])
+
+    def test_ignorespace(self):
+        q = self.history("ignoreboth", ["aa", " bb", "aa", "aa"])
+        self.assertEqual(items(q), ["aa"])
+
+    def test_erasedups(self):
+        q = self.history("erasedups", ["aa", "bb", "cc", "aa", "bb", "dd", "aa"])
+        self.assertEqual(items(q), ["cc", "bb", "dd", "aa"])
+        self.assertEqual(q.history_cursor, 4)
+        self.assertEqual(q.reverse_search_history("b"), "bb")
+        self.assertEqual(q.reverse_search_history("b"), "cc")
+        q.history_cursor = 0
+        q.last_search_for = ""
+        self.assertEqual(q.forward_search_history("a"), "aa")
+        q.add_history(RL("cc"))
+        self.assertEqual(items(q), ["bb", "dd", "aa", "cc"])
+
+class Test_frecency(HistoryFileTest):
+    def setUp(self):
+        HistoryFileTest.setUp(self)
+        self.q = q = self.history()
+        for x in ["make clean", "make test", "ls", "make test", "ls",
+                  "make test", "make build"]:
+            q.add_history(RL(x))
+
+    def history(self):
+        q = LineHistory()
+        q.history_filename = self.filename
+        q.history_control = ""
+        q.history_frecency = True
+        q._frecency.half_life = 2
+        q.read_history_file()
+        return q
+
+    def test_scores(self):
+        q = self.q
+        self.assertAlmostEqual(q._frecency.score("make clean"), 0.125)
+        self.assertAlmostEqual(q._frecency.score("make build"), 1.0)
+        self.assertAlmostEqual(q._frecency.score("ls"), 0.75)
+        q._frecency.max_scale = 2.0
+        q.add_history(RL("ls"))
+        self.assertAlmostEqual(q._frecency.score("ls"), 1.0 + 0.75 / 2 ** 0.5)
+        self.assertAlmostEqual(q._frecency.score("make build"), 2 ** -0.5)
+
+    def test_history_search(self):
+        q = self.q
+        a = RL("make", point=4)
+        found = []
+        for direction in [-1, -1, -1, -1, 1, 1, 1]:
+            if direction < 0:
+                res = q.history_search_backward(a)
+                q.lastcommand = q.history_search_backward
+            else:
+                res = q.history_search_forward(a)
+                q.lastcommand = q.history_search_forward
+            found.append(res.get_line_text())
+            self.assertEqual(res.point, 4)
+        self.assertEqual(found, ["make test", "make build", "make clean",
+                                 "make clean", "make build", "make test",
+                                 "make"])
+
+    def test_relevant_history(self):
+        q = self.q
+        found = []
+        for x in range(5):
+            found.append(q.relevant_history(RL("")).get_line_text())
+            q.lastcommand = q.relevant_history
+        self.assertEqual(found, ["make test", "make build", "ls",
+                                 "make clean", "make clean"])
+
+    def test_saved(self):
+        self.q.write_history_file()
+        q = self.history()
+        self.assertEqual(q._frecency.size, 7)
+        for x in ["make test", "make build", "ls", "make clean"]:
+            self.assertAlmostEqual(q._frecency.score(x),
+                                   self.q._frecency.score(x), places=5)
+        q.add_history(RL("ls"))
+        self.assertEqual(q._frecency.ranked("l"), ["ls"])
+        self.assertAlmostEqual(q._frecency.score("ls"), 1.0 + 0.75 / 2 ** 0.5,
+                               places=5)
+
+class Test_history_journal(HistoryFileTest):
+    settings = {"history_journal": True}
+
+    def test_append_history_file(self):
+        q = LineHistory()
+        for x in ["aaaa", "bbbb", "cccc"]:
+            q.add_history(RL(x))
+        q.append_history_file(2, self.filename)
+        q.append_history_file(1, self.filename)
+        self.assertEqual(self.lines(), ["bbbb", "cccc", "cccc"])
+
+    def test_sessions_append(self):
+        q = self.history()
+        r = self.history()
+        q.add_history(RL("from q"))
+        r.add_history(RL("from r"))
+        q.write_history_file()
+        r.write_history_file()
+        q.write_history_file()
+        self.assertEqual(self.lines(), ["from q", "from r"])
+        self.assertEqual(self.history().get_current_history_length(), 2)
+
+    def test_compact(self):
+        q = self.history()
+        q.history_length = 3
+        for x in range(7):
+            q.add_history(RL("line %d"%x))
+            q.write_history_file()
+        self.assertEqual(len(self.lines()), 7)
+        q.add_history(RL("line 7"))
+        q.write_history_file()
+        self.assertEqual(self.lines(), ["line 5", "line 6", "line 7"])
+        q.add_history(RL("line 8"))
+        q.write_history_file()
+        self.assertEqual(self.lines(), ["line 5", "line 6", "line 7", "line 8"])
+
+
+class Test_history_store(unittest.TestCase):
+    def test_append(self):
+        h = HistoryStore()
+        h.append(RL("aaaa"))
+        h.append("b\xe5\xe4\xf6")
+        h.append("")
+        self.assertEqual(len(h), 3)
+        self.assertEqual([h.get_text(i) for i in range(3)], ["aaaa", "b\xe5\xe4\xf6", ""])
+        self.assertEqual(h.get_text(-2), "b\xe5\xe4\xf6")
+        self.assertRaises(IndexError, h.get_text, 3)
+
+    def test_recalled_buffer_is_a_copy(self):
+        h = HistoryStore()
+        h.append(RL("aaaa"))
+        line = h[0]
+        line.insert_text("b")
+        self.assertEqual(line.get_line_text(), "baaaa")
+        self.assertEqual(h[0].get_line_text(), "aaaa")
+        self.assertEqual([x.get_line_text() for x in h[-1:]], ["aaaa"])
+
+    def test_delete(self):
+        rnd = random.Random(2)
+        h = HistoryStore()
+        h.max_deleted = 4
+        ids = []
+        for i in range(400):
+            h.append("line %d"%i)
+            ids.append(i)
+            if rnd.random() < 0.6 and ids:
+                pos = rnd.randrange(len(ids))
+                del h[pos]
+                del ids[pos]
+            if rnd.random() < 0.1:
+                count = rnd.randint(1, 5)
+                h.evict(count)
+                del ids[:count]
+            self.assertEqual(len(h), len(ids))
+            self.assertEqual([h.entry_id(j) for j in range(len(h))], ids)
+            self.assertEqual([h.position(eid) for eid in ids],
+                             list(range(len(ids))))
+        self.assertEqual(h.position(ids[0] - 1), None)
+        self.assertEqual(h.first_position(ids[0] + 1), 1)
+        self.assertEqual([h.get_text(j) for j in range(len(h))],
+                         ["line %d"%eid for eid in ids])
+
+class Test_bounded_history(unittest.TestCase):
+    def setUp(self):
+        self.q = q = LineHistory()
+        q.history_length = 5
+        for x in range(12):
+            q.add_history(RL("line %d"%x))
+
+    def test_evict(self):
+        q = self.q
+        self.assertEqual(items(q), ["line %d"%x for x in range(7, 12)])
+        self.assertEqual(q.history_cursor, 5)
+        self.assertTrue(q.history.generation > 0)
+        self.assertTrue(len(q.history.offsets) - 1 <= 2 * 5 + 1)
+        l = RL("")
+        for x in range(6):
+            q.previous_history(l)
+        self.assertEqual(l.get_line_text(), "line 7")
+        q.next_history(l)
+        self.assertEqual(l.get_line_text(), "line 8")
+
+    def test_search_after_evict(self):
+        q = self.q
+        self.assertEqual(q.reverse_search_history("line"), "line 11")
+        for x in range(12, 20):
+            q.add_history(RL("line %d"%x))
+        q.last_search_for = ""
+        self.assertEqual(q.reverse_search_history("line 1"), "line 19")
+        self.assertEqual(q.reverse_search_history("line 1"), "line 18")
+        self.assertEqual(q.fuzzy_search_history("l9"), "line 19")
+        q.history_cursor = 5
+        self.assertEqual(q.history_search_backward(RL("line", point=4))
+                         .get_line_text(), "line 19")
+
+    def test_evict_with_deletions(self):
+        q = self.q
+        q.history_control = "erasedups"
+        q.add_history(RL("line 9"))
+        self.assertEqual(items(q), ["line 7", "line 8", "line 10",
+                                    "line 11", "line 9"])
+        q.add_history(RL("line 12"))
+        self.assertEqual(items(q), ["line 8", "line 10", "line 11",
+                                    "line 9", "line 12"])
+        self.assertEqual(q.history.position(q.history.entry_id(0)), 0)
+        q.history_length = 2
+        self.assertEqual(items(q), ["line 9", "line 12"])
+        self.assertEqual(q.history_cursor, 2)
+
+class Test_mapped_history_file(HistoryFileTest):
+    contents = b"aaaa\nbbbb  \n\nbbbb\r\ncccc\n   \ndddd\n"
+
+    def test_read(self):
+        q = LineHistory()
+        q.read_history_file(self.filename)
+        self.assertEqual(q.get_current_history_length(), 4)
+        self.assertEqual([q.get_history_item(i) for i in range(1, 5)],
+                         ["aaaa", "bbbb", "cccc", "dddd"])
+        self.assertEqual(q.history_cursor, 4)
+        self.assertEqual(q.reverse_search_history("bb"), "bbbb")
+        q.history_filename = self.filename
+        q.add_history(RL("eeee"))
+        q.history.unmap()
+        self.assertEqual([q.get_history_item(i) for i in range(1, 6)],
+                         ["aaaa", "bbbb", "cccc", "dddd", "eeee"])
+        q.write_history_file()
+        self.assertEqual(open(self.filename).read().splitlines(),
+                         ["aaaa", "bbbb", "cccc", "dddd", "eeee"])
+
+    def test_sidecar(self):
+        old = historyfile.SIDECAR_MIN_LINES
+        historyfile.SIDECAR_MIN_LINES = 1
+        try:
+            historyfile.MappedHistoryFile(self.filename).close()
+            self.assertTrue(os.path.exists(self.filename + ".idx"))
+            fp = open(self.filename, "ab")
+            fp.write(b"eeee\n")
+            fp.close()
+            m = historyfile.MappedHistoryFile(self.filename)
+            self.assertEqual([m.get_text(i) for i in range(len(m))],
+                             ["aaaa", "bbbb", "cccc", "dddd", "eeee"])
+            m.close()
+        finally:
+            historyfile.SIDECAR_MIN_LINES = old
+
+    def test_not_mapped(self):
+        q = LineHistory()
+        q.history_length = 2
+        fp = open(self.filename, "ab")
+        fp.write(b"#1000\t-1\ts\t/\neeee\n")
+        fp.close()
+        q.read_history_file(self.filename)
+        self.assertEqual(type(q.history.base.data), bytes)
+        self.assertEqual(len(q.history.base), 2)
+        os.remove(self.filename)
+        self.assertEqual([q.get_history_item(i) for i in range(1, 3)],
+                         ["dddd", "eeee"])
+        self.assertEqual(q.history.get_meta(1)[0], 1000.0)
+        self.assertEqual(q.history.get_meta(0), HistoryMetadata.unknown)
+
+    def test_history_control(self):
+        fp = open(self.filename, "wb")
+        fp.write(b"aaaa\n bbbb\ncccc\ncccc\naaaa\ndddd\ncccc\n")
+        fp.close()
+        old = historyfile.SIDECAR_MIN_LINES
+        historyfile.SIDECAR_MIN_LINES = 1
+        try:
+            for control in ["", "ignoredups", "ignoreboth", "erasedups",
+                            "ignorespace:erasedups", "ignoredups",
+                            "erasedups", "erasedups"]:
+                if control == "erasedups":
+                    fp = open(self.filename, "ab")
+                    fp.write(b"aaaa\ndddd\n")
+                    fp.close()
+                lines = [x.rstrip() for x in open(self.filename)]
+                q = LineHistory()
+                q.history_control = control
+                q.history_length = -1
+                q.read_history_file(self.filename)
+                expected = LineHistory()
+                expected.history_control = control
+                expected.history_length = -1
+                for line in lines:
+                    expected.add_history(RL(line))
+                self.assertEqual(
+                    [q.history.get_text(i) for i in range(len(q.history))],
+                    [expected.history.get_text(i) for i in
+                     range(len(expected.history))])
+        finally:
+            historyfile.SIDECAR_MIN_LINES = old
+
+    def test_trigram_sidecar(self):
+        old = historyfile.SIDECAR_MIN_LINES
+        historyfile.SIDECAR_MIN_LINES = 1
+        try:
+            q = LineHistory()
+            q.history_length = -1
+            q.read_history_file(self.filename)
+            q.add_history(RL("bbcc"))
+            self.assertEqual(q.reverse_search_history("bb"), "bbcc")
+            self.assertTrue(os.path.exists(self.filename + ".tri"))
+            postings = q._index.postings
+            self.assertEqual(postings["b"].typecode, "I")
+            q = LineHistory()
+            q.history_length = -1
+            q.read_history_file(self.filename)
+            added = []
+            q._index.add = added.append
+            self.assertEqual(q.reverse_search_history("cc"), "cccc")
+            self.assertEqual(added, [])
+            self.assertEqual(q._index.postings["b"].tolist(), [1])
+            self.assertEqual(q._index.postings["bbb"].tolist(), [1])
+            q.history.close()
+            fp = open(self.filename, "ab")
+            fp.write(b"bbbb\n")
+            fp.close()
+            q = LineHistory()
+            q.history_length = -1
+            q.read_history_file(self.filename)
+            self.assertEqual(q.reverse_search_history("bb"), "bbbb")
+            self.assertEqual(q._index.postings["bbb"].tolist(), [1, 4])
+        finally:
+            historyfile.SIDECAR_MIN_LINES = old
+
+
+class Test_compressed_history_file(HistoryFileTest):
+    settings = {"history_compression": True, "history_length": 30}
+
+    def setUp(self):
+        HistoryFileTest.setUp(self)
+        self.old = historyfile.BLOCK_SIZE, historyfile.CACHE_BLOCKS
+        historyfile.BLOCK_SIZE = 20
+        historyfile.CACHE_BLOCKS = 2
+
+    def tearDown(self):
+        historyfile.BLOCK_SIZE, historyfile.CACHE_BLOCKS = self.old
+        HistoryFileTest.tearDown(self)
+
+    def history(self, journal=False, **settings):
+        return HistoryFileTest.history(self, history_journal=journal,
+                                       **settings)
+
+    def test_write_read(self):
+        q = self.history()
+        for x in range(40):
+            q.add_history(RL("line %d"%x))
+        q.write_history_file()
+        self.assertTrue(historyfile.is_compressed(self.filename))
+        q = self.history()
+        base = q.history.base
+        self.assertTrue(isinstance(base, historyfile.CompressedHistoryFile))
+        self.assertEqual(len(base.index), 10)
+        self.assertEqual(base._cache, [])
+        self.assertEqual(q.get_history_item(5), "line 14")
+        self.assertEqual([n for n, lines in base._cache], [1])
+        self.assertEqual(items(q), ["line %d"%x for x in range(10, 40)])
+        self.assertEqual(len(base._cache), 2)
+        self.assertEqual(q.reverse_search_history("line 2"), "line 29")
+
+    def test_file_closed(self):
+        q = self.history()
+        for x in range(40):
+            q.add_history(RL("line %d"%x))
+        q.write_history_file()
+        opened = []
+        def tracking_open(*args):
+            opened.append(open(*args))
+            return opened[-1]
+        historyfile.open = tracking_open
+        try:
+            q = self.history()
+        finally:
+            del historyfile.open
+        self.assertTrue(opened)
+        self.assertTrue(all(fp.closed for fp in opened))
+        self.assertEqual(items(q), ["line %d"%x for x in range(10, 40)])
+
+    def test_control(self):
+        fp = open(self.filename, "wb")
+        historyfile.write_compressed(fp, [b"aaaa", b"aaaa", b" bbbb", b"",
+                                          b"cccc", b"aaaa", b"dddd"])
+        fp.close()
+        q = self.history(history_control="ignoreboth")
+        self.assertEqual(items(q), ["aaaa", "cccc", "aaaa", "dddd"])
+        q = self.history(history_control="erasedups")
+        self.assertEqual(items(q), [" bbbb", "cccc", "aaaa", "dddd"])
+        q = self.history(history_control="ignoredups", history_length=2)
+        self.assertEqual(items(q), ["aaaa", "dddd"])
+
+    def test_journal(self):
+        q = self.history(journal=True)
+        for x in range(10):
+            q.add_history(RL("line %d"%x))
+        q.write_history_file()
+        q = self.history(journal=True)
+        for x in range(10, 15):
+            q.add_history(RL("line %d"%x))
+        q.write_history_file()
+        self.assertEqual(historyfile.read_history_lines(self.filename),
+                         [("line %d"%x).encode("ascii") for x in range(15)])
+        q.history_length = 5
+        q.compact_history_file()
+        self.assertTrue(historyfile.is_compressed(self.filename))
+        self.assertEqual(items(self.history()),
+                         ["line %d"%x for x in range(10, 15)])
+
+    def test_plain(self):
+        fp = open(self.filename, "wb")
+        fp.write(b"aaaa\nbbbb\n")
+        fp.close()
+        q = self.history()
+        self.assertEqual(items(q), ["aaaa", "bbbb"])
+        q.add_history(RL("cccc"))
+        q.read_history_file()
+        self.assertEqual(items(q), ["aaaa", "bbbb", "cccc",
+                                    "aaaa", "bbbb"])
+        q.write_history_file()
+        self.assertTrue(historyfile.is_compressed(self.filename))
+        q.add_history(RL("dddd"))
+        q.read_history_file()
+        self.assertEqual(items(q)[-6:], ["dddd", "aaaa", "bbbb", "cccc",
+                                         "aaaa", "bbbb"])
+
+
+class Test_shared_history(HistoryFileTest):
+    contents = b"old 1\nold 2\n"
+    settings = {"history_shared": True, "history_length": 10}
+
+    def test_append_and_merge(self):
+        q = self.history()
+        r = self.history()
+        q.add_history(RL("from q"))
+        r.add_history(RL("from r"))
+        self.assertEqual(self.lines(), ["old 1", "old 2", "from q", "from r"])
+        self.assertEqual(items(r), ["old 1", "old 2", "from q", "from r"])
+        self.assertEqual(items(q), ["old 1", "old 2", "from q"])
+        line = RL("")
+        q.previous_history(line)
+        self.assertEqual(line.get_line_text(), "from r")
+        q.previous_history(line)
+        self.assertEqual(line.get_line_text(), "from q")
+        q.write_history_file()
+        r.write_history_file()
+        self.assertEqual(self.lines(), ["old 1", "old 2", "from q", "from r"])
+
+    def test_merge_reads_tail_only(self):
+        q = self.history()
+        fp = open(self.filename, "ab")
+        fp.write(b"other 1\nother")
+        fp.close()
+        self.assertEqual(q.reverse_search_history("other"), "other 1")
+        self.assertEqual(q._shared_offset, len(b"old 1\nold 2\nother 1\n"))
+        fp = open(self.filename, "ab")
+        fp.write(b" 2\n")
+        fp.close()
+        q.add_history(RL("mine"))
+        self.assertEqual(items(q), ["old 1", "old 2", "other 1",
+                                    "other 2", "mine"])
+        self.assertEqual(q._shared_offset, os.path.getsize(self.filename))
+
+    def test_merge_evicts(self):
+        q = self.history()
+        fp = open(self.filename, "ab")
+        for x in range(12):
+            fp.write(("other %d\n"%x).encode("ascii"))
+        fp.close()
+        q.add_history(RL("mine"))
+        self.assertEqual(items(q), ["other %d"%x for x in range(3, 12)]
+                         + ["mine"])
+
+    def test_compact(self):
+        q = self.history()
+        r = self.history()
+        q.history_length = 3
+        for x in range(8):
+            q.add_history(RL("line %d"%x))
+        q.write_history_file()
+        self.assertEqual(self.lines(), ["line 5", "line 6", "line 7"])
+        r.add_history(RL("from r"))
+        self.assertEqual(self.lines(), ["line 5", "line 6", "line 7",
+                                        "from r"])
+        q.add_history(RL("from q"))
+        self.assertEqual(items(q), ["line 7", "from r", "from q"])
+
+    def test_merge_after_rewrite(self):
+        q = self.history()
+        r = self.history()
+        r.add_history(RL("b1"))
+        q.add_history(RL("a2"))
+        for x in range(20):
+            q.add_history(RL("x%d"%x))
+        q.write_history_file()
+        r.add_history(RL("b2"))
+        self.assertEqual(items(r), ["x%d"%x for x in range(11, 20)] + ["b2"])
+        #Lines already merged are not added again
+        for x in range(20, 25):
+            q.add_history(RL("x%d"%x))
+        self.assertEqual(r.reverse_search_history("x2"), "x24")
+        q.write_history_file()
+        r.add_history(RL("b3"))
+        self.assertEqual(items(r), ["x17", "x18", "x19", "b2", "x20", "x21",
+                                    "x22", "x23", "x24", "b3"])
+
+    def test_missing_file(self):
+        os.remove(self.filename)
+        q = self.history()
+        r = self.history()
+        q.add_history(RL("a1"))
+        r.add_history(RL("b1"))
+        self.assertEqual(items(r), ["a1", "b1"])
+        q.add_history(RL("a2"))
+        self.assertEqual(items(q), ["a1", "b1", "a2"])
+        self.assertEqual(self.lines(), ["a1", "b1", "a2"])
+
+
+class Test_history_writer(HistoryFileTest):
+    def setUp(self):
+        HistoryFileTest.setUp(self)
+        self.q = q = LineHistory()
+        q.history_filename = self.filename
+        q.history_writer = True
+        q.history_writer_interval = 60.0
+        q.history_writer_batch = 3
+
+    def tearDown(self):
+        if self.q._writer is not None:
+            self.q._writer.close(1.0)
+        HistoryFileTest.tearDown(self)
+
+    def test_batch(self):
+        q = self.q
+        q.add_history(RL("aaaa"))
+        q.add_history(RL("bbbb"))
+        self.assertEqual(self.lines(), [])
+        q.add_history(RL("cccc"))
+        self.assertTrue(q._writer.flush(1.0))
+        self.assertEqual(self.lines(), ["aaaa", "bbbb", "cccc"])
+
+    def test_interval(self):
+        q = self.q
+        q.history_writer_interval = 0.01
+        q.add_history(RL("aaaa"))
+        for i in range(100):
+            if self.lines():
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.lines(), ["aaaa"])
+
+    def test_write_history_file(self):
+        q = self.q
+        q.add_history(RL("aaaa"))
+        q.write_history_file()
+        self.assertEqual(self.lines(), ["aaaa"])
+        q.add_history(RL("bbbb"))
+        q.write_history_file()
+        self.assertEqual(self.lines(), ["aaaa", "bbbb"])
+        q.read_history_file()
+        q.write_history_file()
+        self.assertEqual(self.lines(), ["aaaa", "bbbb"])
+
+    def test_compact(self):
+        q = self.q
+        q.history_length = 3
+        for x in range(8):
+            q.add_history(RL("line %d"%x))
+        q.write_history_file()
+        self.assertEqual(self.lines(), ["line 5", "line 6", "line 7"])
+
+    def test_bounded_wait(self):
+        q = self.q
+        q.history_writer_timeout = 0.05
+        writer = q._get_writer()
+        writer._write = lambda lines: time.sleep(0.5)
+        q.add_history(RL("aaaa"))
+        start = time.time()
+        q.write_history_file()
+        self.assertTrue(time.time() - start < 0.4)
+
+
+@unittest.skipIf(historydb.sqlite3 is None, "sqlite3 is not available")
+class Test_history_database(HistoryFileTest):
+    settings = {"history_database": True, "history_length": -1}
+
+    def setUp(self):
+        HistoryFileTest.setUp(self)
+        self.open = []
+        q = self.history()
+        for x in ["make test", "ls", "make build", "git status", "ls"]:
+            q.add_history(RL(x))
+        q.write_history_file()
+
+    def tearDown(self):
+        for q in self.open:
+            q.clear_history()
+            if q._database is not None:
+                q._database.close()
+        HistoryFileTest.tearDown(self)
+
+    def history(self):
+        q = HistoryFileTest.history(self)
+        self.open.append(q)
+        return q
+
+    def rows(self):
+        db = historydb.HistoryDatabase(self.filename)
+        try:
+            return db.read_lines()
+        finally:
+            db.close()
+
+    def test_insert(self):
+        self.assertTrue(historydb.is_database(self.filename))
+        self.assertEqual(self.rows(), ["make test", "ls", "make build",
+                                       "git status", "ls"])
+        q = self.history()
+        self.assertTrue(isinstance(q.history.base, historydb.HistoryDatabase))
+        self.assertEqual(q.get_current_history_length(), 5)
+        self.assertEqual(q.get_history_item(3), "make build")
+        q.add_history(RL("make clean"))
+        self.assertEqual(self.rows()[-1], "make clean")
+        self.assertEqual(len(q.history.blob), len("make clean"))
+
+    def test_search(self):
+        q = self.history()
+        q.add_history(RL("make clean"))
+        self.assertEqual(q.reverse_search_history("make"), "make clean")
+        self.assertEqual(q.reverse_search_history("make"), "make build")
+        self.assertEqual(q.forward_search_history("ls"), "ls")
+        self.assertEqual(q.history_cursor, 4)
+        self.assertEqual(q.reverse_search_history("stat"), "git status")
+
+    def test_search_without_fts(self):
+        q = self.history()
+        q.history.base.fts = False
+        self.assertEqual(q.reverse_search_history("ake b"), "make build")
+        self.assertEqual(q._matches("ls"), [1, 4])
+
+    def test_prefix_search(self):
+        q = self.history()
+        q.add_history(RL("make all"))
+        self.assertEqual(q.history.base.prefix_search("make"), [0, 2])
+        q.history_cursor = 6
+        self.assertEqual(q._find_prefix("make", "", -1), 5)
+        q.history_cursor = 5
+        self.assertEqual(q._find_prefix("make", "", -1), 2)
+        q.history_cursor = 2
+        self.assertEqual(q._find_prefix("make", "", -1), 0)
+        self.assertEqual(q._find_prefix("make", "", 1), 5)
+        self.assertEqual(q._prefixes.size, 6)
+
+    def test_fuzzy_search(self):
+        db = historydb.HistoryDatabase(self.filename)
+        try:
+            db.append(["100%_done", "Git Status", "1000 done", "a*b"])
+        finally:
+            db.close()
+        q = self.history()
+        base = q.history.base
+        self.assertEqual(base.fuzzy_search("mkt", True), [0])
+        self.assertEqual(base.fuzzy_search("gs", True), [3, 6])
+        self.assertEqual(base.fuzzy_search("GS", False), [6])
+        self.assertEqual(base.fuzzy_search("%_", True), [5])
+        self.assertEqual(base.fuzzy_search("*", False), [8])
+        #Any character stands in for one LIKE can not fold
+        self.assertEqual(base.fuzzy_search("så", True), [0, 3, 6])
+        q.add_history(RL("git show"))
+        self.assertEqual([q.history.get_text(i) for i in q.fuzzy_matches("gs")],
+                         ["git show", "Git Status", "git status"])
+        self.assertEqual(q._index.first, 9)
+        self.assertEqual(base.fuzzy_search("gs", True, 1), [6])
+        q.fuzzy_scan = 2
+        self.assertEqual([q.history.get_text(i) for i in q.fuzzy_matches("gs")],
+                         ["git show", "Git Status"])
+
+    def test_blocks(self):
+        old = historydb.BLOCK_ROWS, historydb.CACHE_BLOCKS
+        historydb.BLOCK_ROWS, historydb.CACHE_BLOCKS = 2, 1
+        try:
+            q = self.history()
+            self.assertEqual(items(q), ["make test", "ls", "make build",
+                                        "git status", "ls"])
+            self.assertEqual(q.history.base.get_texts(1, 4),
+                             ["ls", "make build", "git status"])
+            self.assertEqual(list(q.history.iter_text_by_id(3, 5)),
+                             ["git status", "ls"])
+        finally:
+            historydb.BLOCK_ROWS, historydb.CACHE_BLOCKS = old
+
+    def test_compact(self):
+        q = self.history()
+        q.history_length = 2
+        q.compact_history_file()
+        self.assertEqual(self.rows(), ["git status", "ls"])
+        self.assertEqual(items(self.history()), ["git status", "ls"])
+
+    def test_replace(self):
+        old = historydb.HistoryDatabase(self.filename)
+        try:
+            q = LineHistory()
+            for x in ["a", "b"]:
+                q.add_history(RL(x))
+            q.write_history_file(self.filename)
+            self.assertEqual(self.rows(), ["a", "b"])
+            #The rows of the old view read as removed, not as the new rows
+            self.assertEqual(old.get_texts(0, 5), [""] * 5)
+        finally:
+            old.close()
+        db = historydb.HistoryDatabase(self.filename)
+        try:
+            self.assertEqual((db.first, db.nlines), (6, 2))
+        finally:
+            db.close()
+
+    def test_read_into_history(self):
+        q = LineHistory()
+        q.add_history(RL("first"))
+        q.read_history_file(self.filename)
+        self.assertEqual(items(q), ["first", "make test", "ls",
+                                    "make build", "git status", "ls"])
+        q.write_history_file(self.filename)
+        self.assertEqual(self.rows(), items(q))
+
+    def test_plain_file_kept(self):
+        q = LineHistory()
+        q.history_filename = os.path.join(self.dir, "plain")
+        q.add_history(RL("aaaa"))
+        q.write_history_file()
+        self.assertFalse(historydb.is_database(q.history_filename))
+
+
+class Test_regex_search(unittest.TestCase):
+    def setUp(self):
+        self.q = q = LineHistory()
+        for x in ["import os", "x = f(1)", "print(x)", "import sys", "y = 2"]:
+            q.add_history(RL(x))
+
+    def test_reverse(self):
+        q = self.q
+        self.assertEqual(q.reverse_regex_search_history(r"^import \w+$"),
+                         "import sys")
+        self.assertEqual(q.reverse_regex_search_history(r"^import \w+$"),
+                         "import os")
+        self.assertEqual(q.history_cursor, 0)
+        self.assertEqual(q.reverse_regex_search_history(r"^import \w+$"),
+                         "import os")
+
+    def test_forward(self):
+        q = self.q
+        q.history_cursor = 0
+        self.assertEqual(q.forward_regex_search_history(r"\d"), "x = f(1)")
+        self.assertEqual(q.forward_regex_search_history(r"\d"), "y = 2")
+        self.assertEqual(q.history_cursor, 4)
+
+    def test_incomplete_pattern(self):
+        q = self.q
+        self.assertEqual(q.reverse_regex_search_history("f("), "x = f(1)")
+        self.assertEqual(q.reverse_regex_search_history("f(1"), "x = f(1)")
+        self.assertEqual(q.reverse_regex_search_history(r"f\(1\)"), "x = f(1)")
+
+    def test_no_match(self):
+        q = self.q
+        q.history_cursor = 2
+        self.assertEqual(q.reverse_regex_search_history("zzz"), "print(x)")
+        self.assertEqual(q.history_cursor, 2)
+
+    def test_pattern_cache(self):
+        cache = historyindex.PatternCache(size=2)
+        a = cache.compile("a+")
+        self.assertTrue(cache.compile("a+") is a)
+        self.assertTrue(cache.compile("a+", 2) is not a)
+        cache.compile("b+")
+        self.assertEqual(sorted(cache.patterns), [("a+", 2), ("b+", 0)])
+        self.assertEqual(cache.compile("a(").pattern, "a\\(")
+
+
+class Test_history_metadata(HistoryFileTest):
+    contents = b"#100\nold 1\nplain\n#300\t2.5\ts1\t/tmp\nold 2\n"
+    settings = {"history_timestamps": True}
+
+    def test_read_mapped(self):
+        q = self.history()
+        self.assertEqual(q.get_current_history_length(), 3)
+        self.assertEqual(q.get_history_item(1), "old 1")
+        self.assertEqual(q.get_history_metadata(1), (100.0, -1.0, "", ""))
+        self.assertEqual(q.get_history_metadata(2), (0.0, -1.0, "", ""))
+        self.assertEqual(q.get_history_metadata(3), (300.0, 2.5, "/tmp", "s1"))
+        self.assertEqual(q.entries_between(100, 300), [1])
+        self.assertEqual(q.entries_between(200, 400), [3])
+
+    def test_stats(self):
+        q = self.history()
+        q.add_history(RL("plain"))
+        stats = q.history_stats(1)
+        self.assertEqual(stats["total"], 4)
+        self.assertEqual(stats["top"], [("plain", 2)])
+        hours = [0] * 24
+        for t in [100, 300, time.time()]:
+            hours[time.localtime(t).tm_hour] += 1
+        self.assertEqual(stats["hours"], hours)
+
+    def test_read_eager(self):
+        q = LineHistory()
+        q.history_timestamps = True
+        q.add_history(RL("first"))
+        q.read_history_file(self.filename)
+        self.assertEqual(q.get_history_item(4), "old 2")
+        self.assertEqual(q.get_history_metadata(4), (300.0, 2.5, "/tmp", "s1"))
+
+    def test_bare_lines(self):
+        #Without history_timestamps only lines written with all fields are
+        #metadata, "#100" could be a line typed by the user
+        q = LineHistory()
+        q.read_history_file(self.filename)
+        self.assertEqual([q.get_history_item(i) for i in range(1, 5)],
+                         ["#100", "old 1", "plain", "old 2"])
+        self.assertEqual(q.get_history_metadata(2), (0.0, -1.0, "", ""))
+        self.assertEqual(q.get_history_metadata(4), (300.0, 2.5, "/tmp", "s1"))
+        self.assertEqual(q.entries_between(1, 1000), [4])
+        q = LineHistory()
+        q.add_history(RL("first"))
+        q.read_history_file(self.filename)
+        self.assertEqual(q.get_history_item(2), "#100")
+        historyfile.compact_file(self.filename, 1)
+        self.assertEqual(open(self.filename).read(),
+                         "#300\t2.5\ts1\t/tmp\nold 2\n")
+
+    def test_entries_like_metadata(self):
+        #The line after a metadata line is an entry even if it looks like one
+        q = self.history()
+        for x in ["a", "#42", "#7\t1\ts\t/", "b"]:
+            q.add_history(RL(x))
+        q.write_history_file()
+        expected = ["old 1", "plain", "old 2", "a", "#42", "#7\t1\ts\t/", "b"]
+        q = self.history()
+        self.assertEqual(items(q), expected)
+        self.assertEqual(q.entries_between(1, 1000), [1, 3])
+        self.assertTrue(q.get_history_metadata(7)[0] > 1000)
+        r = LineHistory()
+        r.history_timestamps = True
+        r.add_history(RL("first"))
+        r.read_history_file(self.filename)
+        self.assertEqual(items(r)[1:], expected)
+        q = self.history(history_length=2)
+        self.assertEqual(items(q), expected[-2:])
+        self.assertTrue(q.get_history_metadata(1)[0] > 1000)
+        self.assertEqual(q.entries_between(1, 1000), [])
+
+    def test_add(self):
+        q = self.history()
+        before = time.time()
+        q.add_history(RL("new"))
+        timestamp, duration, cwd, session = q.get_history_metadata(4)
+        self.assertTrue(before <= timestamp <= time.time())
+        self.assertEqual((duration, cwd, session),
+                         (-1.0, os.getcwd(), q.history_session))
+        self.assertEqual(q.entries_between(before, time.time() + 1), [4])
+        q.finish_command()
+        self.assertTrue(q.get_history_metadata(4)[1] >= 0)
+
+    def test_write(self):
+        q = self.history()
+        q.add_history(RL("new"))
+        q.write_history_file()
+        q = self.history()
+        self.assertEqual([q.get_history_item(i) for i in range(1, 5)],
+                         ["old 1", "plain", "old 2", "new"])
+        self.assertEqual(q.get_history_metadata(3), (300.0, 2.5, "/tmp", "s1"))
+        self.assertEqual(q.get_history_metadata(4)[3], q.history_session)
+
+    def test_compact(self):
+        q = self.history()
+        q.history_length = 2
+        q.compact_history_file()
+        q = self.history()
+        self.assertEqual(q.get_current_history_length(), 2)
+        self.assertEqual(q.get_history_metadata(1)[0], 0.0)
+        self.assertEqual(q.get_history_metadata(2)[0], 300.0)
+
+    def test_timestamps_sorted(self):
+        meta = HistoryMetadata()
+        meta.append((200.0, -1.0, "/a", "s"))
+        meta.append((100.0, 1.0, "/a", "s"))
+        meta.append((300.0, 1.0, "/b", "s"))
+        self.assertEqual(meta.names, ["", "/a", "s", "/b"])
+        self.assertFalse(meta.ordered)
+        self.assertEqual(list(meta.between(150, 250)), [0])
+        self.assertEqual(list(meta.between(0, 250)), [0, 1])
+
+
+class Test_history_namespace(HistoryFileTest):
+    def setUp(self):
+        HistoryFileTest.setUp(self)
+        fp = open(self.filename + "-pdb", "wb")
+        fp.write(b"where\n")
+        fp.close()
+        self.rl = rl = BaseReadline()
+        rl.mode._history.history_filename = self.filename
+        rl.mode._history.history_length = 50
+        rl.add_history("import pdb")
+
+    def test_switch(self):
+        rl = self.rl
+        default = rl.mode._history
+        rl.set_history_namespace("pdb")
+        self.assertEqual(rl.history_namespace, "pdb")
+        self.assertEqual(items(self.rl), ["where"])
+        self.assertEqual(rl.get_history_length(), 50)
+        rl.add_history("next")
+        rl.set_history_namespace()
+        self.assertTrue(rl.mode._history is default)
+        self.assertEqual(items(self.rl), ["import pdb"])
+        rl.set_history_namespace("pdb")
+        self.assertEqual(items(self.rl), ["where", "next"])
+
+    def test_write(self):
+        rl = self.rl
+        rl.set_history_namespace("pdb")
+        rl.add_history("next")
+        rl.write_history_file()
+        self.assertEqual(open(self.filename + "-pdb", "rb").read(),
+                         b"where\nnext\n")
+        self.assertEqual(open(self.filename, "rb").read(), b"import pdb\n")
+
+    def test_invalid_name(self):
+        self.assertRaises(ValueError, self.rl.set_history_namespace, "../x")
+
+
+class Test_history_archive(HistoryFileTest):
+    def setUp(self):
+        HistoryFileTest.setUp(self)
+        self.q = q = LineHistory()
+        q.history_filename = self.filename
+        q.history_archive = True
+        q.history_archive_workers = 0
+
+    def tearDown(self):
+        self.q.forget_search_matches()
+        if self.q._archive is not None:
+            self.q._archive.close()
+        HistoryFileTest.tearDown(self)
+
+    def roll(self, lines):
+        fp = open(self.filename, "ab")
+        for line in lines:
+            fp.write(line.encode("ascii") + b"\n")
+        fp.close()
+        self.q.history_length = 1
+        self.q.compact_history_file()
+
+    def test_bloom_filter(self):
+        bloom = historyarchive.BloomFilter.for_lines(["import os", "ls -l"])
+        self.assertTrue(bloom.may_contain("port"))
+        self.assertTrue(bloom.may_contain("-"))
+        self.assertFalse(bloom.may_contain("zzzq"))
+
+    def test_compact_archives(self):
+        self.roll(["print 1", "print 2", "x = 1"])
+        archive = self.q._get_archive()
+        self.assertEqual(len(archive.segments()), 1)
+        self.assertEqual(open(self.filename, "rb").read(), b"x = 1\n")
+        self.assertEqual(list(archive.search("print")),
+                         ["print 2", "print 1"])
+        self.assertEqual(archive.candidates("zzzq"), [])
+
+    def search(self):
+        q = self.q
+        self.roll(["print 1", "print 2", "x = 1"])
+        time.sleep(0.002)
+        self.roll(["print 3", "print 1", "y = 1"])
+        time.sleep(0.002)
+        self.roll(["print 4", "z = 1"])
+        q.add_history(RL("print 5"))
+        self.assertEqual(list(q.search_all_history("print")),
+                         ["print 5", "print 4", "print 1", "print 3",
+                          "print 2"])
+
+    def test_search_serial(self):
+        self.search()
+
+    def test_search_workers(self):
+        self.q.history_archive_workers = 2
+        cpu_count = historyarchive.cpu_count
+        historyarchive.cpu_count = lambda: 2
+        try:
+            self.search()
+        finally:
+            historyarchive.cpu_count = cpu_count
+
+    def test_archive_search_history(self):
+        q = self.q
+        self.roll(["print 1", "print 2", "x = 1"])
+        q.add_history(RL("print 3"))
+        self.assertEqual(q.archive_search_history("print"), "print 3")
+        self.assertEqual(q.archive_search_history("print"), "print 2")
+        self.assertEqual(q.archive_search_history("print"), "print 1")
+        self.assertEqual(q.archive_search_history("print"), "print 1")
+        self.assertEqual(q.archive_search_history("print 2"), "print 2")
+
+
+class Test_history_import(HistoryFileTest):
+    def setUp(self):
+        HistoryFileTest.setUp(self)
+        self.filename = os.path.join(self.dir, "shell_history")
+
+    def load(self, data, format=None, control="ignoredups"):
+        fp = open(self.filename, "wb")
+        fp.write(data)
+        fp.close()
+        q = LineHistory()
+        q.history_control = control
+        q.add_history(RL("first"))
+        self.count = q.import_history(self.filename, format)
+        return q
+
+    def test_bash(self):
+        q = self.load(b"ls\n#1600000000\ncd /tmp\ncd /tmp\n\n ls -a\nls\n")
+        self.assertEqual(self.count, 4)
+        self.assertEqual(items(q), ["first", "ls", "cd /tmp", " ls -a",
+                                    "ls"])
+        self.assertEqual(q.get_history_metadata(3)[0], 1600000000.0)
+        self.assertEqual(q.get_history_metadata(2)[0], 0.0)
+
+    def test_history_control(self):
+        q = self.load(b"ls\npwd\n ls -a\nls\n", "bash",
+                      "ignoreboth:erasedups")
+        self.assertEqual(items(q), ["first", "pwd", "ls"])
+
+    def test_zsh(self):
+        q = self.load(b": 1600000000:0;ls\n"
+                      b": 1600000005:3;for x in a b; do\\\necho $x\\\ndone\n"
+                      b": 1600000009:0;echo \xc3\x83\xa4\n")
+        self.assertEqual(items(q), ["first", "ls",
+                                    "for x in a b; do echo $x; done",
+                                    "echo \xc4"])
+        self.assertEqual(q.get_history_metadata(3)[:2], (1600000005.0, 3.0))
+
+    def test_fish(self):
+        q = self.load(b"- cmd: echo hi\n  when: 1600000000\n  paths:\n"
+                      b"    - hi\n- cmd: echo a\\nb\\\\c\n")
+        self.assertEqual(items(q), ["first", "echo hi",
+                                    "echo a; b\\c"])
+        self.assertEqual(q.get_history_metadata(2)[0], 1600000000.0)
+        self.assertEqual(q.get_history_metadata(3)[0], 0.0)
+
+    def test_detect_format(self):
+        self.load(b"- cmd: ls\n")
+        self.assertEqual(historyimport.detect_format(self.filename), "fish")
+        self.load(b"ls\n: 1:0;ls\n")
+        self.assertEqual(historyimport.detect_format(self.filename), "zsh")
+        self.load(b"#1\nls\n")
+        self.assertEqual(historyimport.detect_format(self.filename), "bash")
+
+
+class Test_history_stats(unittest.TestCase):
+    def test_counts(self):
+        q = LineHistory()
+        for x in ["ls", "pwd", "ls", "make", "ls", "pwd"]:
+            q.add_history(RL(x))
+        stats = q.history_stats(2)
+        self.assertEqual(stats["total"], 6)
+        self.assertEqual(stats["distinct"], 3)
+        self.assertEqual(stats["top"], [("ls", 3), ("pwd", 2)])
+        hour = time.localtime().tm_hour
+        self.assertEqual(stats["hours"][hour], 6)
+        self.assertEqual(sum(stats["hours"]), 6)
+
+    def test_evict_and_erase(self):
+        q = LineHistory()
+        q.history_length = 3
+        for x in ["a", "b", "a", "c"]:
+            q.add_history(RL(x))
+        self.assertEqual(sorted(q.history_stats()["top"]),
+                         [("a", 1), ("b", 1), ("c", 1)])
+        q.history_control = "erasedups"
+        q.add_history(RL("b"))
+        q.add_history(RL("d"))
+        stats = q.history_stats()
+        self.assertEqual(stats["total"], 3)
+        self.assertEqual(sorted(stats["top"]), [("b", 1), ("c", 1), ("d", 1)])
+        q.clear_history()
+        self.assertEqual(q.history_stats()["total"], 0)
+
+    def test_matches_scan(self):
+        rnd = random.Random(1)
+        q = LineHistory()
+        q.history_length = 20
+        for i in range(300):
+            q.history_control = rnd.choice(["ignoredups", "erasedups"])
+            q.add_history(RL("cmd %d"%rnd.randint(0, 30)))
+            if i % 7 == 0:
+                stats = q.history_stats(5)
+                texts = [q.get_history_item(j) for j in
+                         range(1, q.get_current_history_length() + 1)]
+                self.assertEqual(stats["total"], len(texts))
+                self.assertEqual(stats["distinct"], len(set(texts)))
+                top = stats["top"][0]
+                self.assertEqual(texts.count(top[0]), top[1])
+                counts = sorted([texts.count(x) for x in set(texts)],
+                                reverse=True)
+                self.assertEqual([c for x, c in stats["top"]], counts[:5])
+                for x, c in stats["top"]:
+                    self.assertEqual(texts.count(x), c)
 
 
 #----------------------------------------------------------------------
@@ -5,7 +5,8 @@ import sys, unittest
 sys.path.append ('../..')
 #from pyreadline.modes.vi import *
 #from pyreadline import keysyms
-from pyreadline.lineeditor import lineobj
+from pyreadline.lineeditor import lineobj, wordmatcher
+from pyreadline.lineeditor.gapbuffer import GapBuffer
 
 #----------------------------------------------------------------------
 
@@ -372,6 +373,262 @@ class Test_movement (unittest.TestCase):
             self.assertEqual(p,cmd(l))
 
 
+class Test_gapbuffer (unittest.TestCase):
+    def test_list_operations (self):
+        chars = list("0123456789")
+        buf = GapBuffer(chars)
+        edits = [(lambda x: x.insert(3, "a")),
+                 (lambda x: x.insert(-2, "b")),
+                 (lambda x: x.insert(100, "c")),
+                 (lambda x: x.append("d")),
+                 (lambda x: x.__setitem__(slice(2, 5), "xyz!")),
+                 (lambda x: x.__setitem__(slice(8, 8), ["e", "f"])),
+                 (lambda x: x.__setitem__(-1, "g")),
+                 (lambda x: x.__setitem__(0, "h")),
+                 (lambda x: x.__delitem__(slice(4, 7))),
+                 (lambda x: x.__delitem__(-3)),
+                 (lambda x: x.__delitem__(slice(100, None))),
+                 (lambda x: x.__delitem__(slice(5, None))),
+                 (lambda x: x.extend("ijk")),
+                 (lambda x: x.insert(0, "l")),
+                 ]
+        for edit in edits:
+            edit(chars)
+            edit(buf)
+            self.assertEqual(chars, buf)
+            self.assertEqual(chars, list(buf))
+            self.assertEqual(len(chars), len(buf))
+            for i in range(-len(chars), len(chars)):
+                self.assertEqual(chars[i], buf[i])
+            for i in range(-2, len(chars) + 2):
+                self.assertEqual(chars[:i], buf[:i])
+                self.assertEqual(chars[i:], buf[i:])
+                self.assertEqual(chars[i:i + 3], buf[i:i + 3])
+            self.assertEqual(chars[::2], buf[::2])
+        self.assertRaises(IndexError, buf.__getitem__, len(chars))
+        self.assertEqual(chars.count("a"), buf.count("a"))
+        self.assertEqual(repr(chars), repr(buf))
+        buf[0:0] = buf
+        self.assertEqual(chars + chars, buf)
+
+    def test_edit_long_line (self):
+        l = lineobj.ReadLineTextBuffer("x" * 10000, point=5000)
+        l.insert_text("abc")
+        self.assertEqual(5003, l.point)
+        l.backward_delete_char(2)
+        self.assertEqual(5001, l.point)
+        text = l.get_line_text()
+        self.assertEqual(10001, len(text))
+        self.assertEqual("xxa", text[4998:5001])
+        del l[0:10]
+        self.assertEqual(text[10:], l.get_line_text())
+        self.assertEqual(4991, l.point)
+
+
+class Test_cache (unittest.TestCase):
+    def test_invalidated_by_edits (self):
+        l = lineobj.ReadLineTextBuffer("first second", point=5)
+        version = l.version
+        self.assertEqual("first second", l.get_line_text())
+        self.assertEqual(6, lineobj.NextWordStart(l))
+        self.assertEqual(version, l.version)
+        edits = [(lambda: l.insert_text("x"), "firstx second"),
+                 (lambda: l.line_buffer.append("!"), "firstx second!"),
+                 (lambda: l.line_buffer.__setitem__(0, "F"), "Firstx second!"),
+                 (lambda: l.__delitem__(slice(0, 7)), "second!"),
+                 (lambda: l.set_line("a b"), "a b"),
+                 (lambda: l.upper(), "A B"),
+                 ]
+        for edit, text in edits:
+            edit()
+            self.assertNotEqual(version, l.version)
+            version = l.version
+            self.assertEqual(text, l.get_line_text())
+            self.assertEqual(text, l.quoted_text())
+        l.point = 0
+        self.assertEqual(2, lineobj.NextWordStart(l))
+        self.assertEqual(version, l.version)
+
+    def test_widths (self):
+        text = "a\tb\u2014c \u4e2d"
+        l = lineobj.ReadLineTextBuffer(text, point=3)
+        for pos in range(-2, len(text) + 2):
+            prefix = text[:pos]
+            width = (len(prefix) + prefix.count("\t") * 7 +
+                     len([c for c in prefix if 0x2013 <= ord(c) <= 0xFFFD]))
+            self.assertEqual(width, l.visible_line_width(pos))
+            self.assertEqual(len(prefix), l.quoted_width(pos))
+        self.assertEqual(10, l.visible_line_width())
+        self.assertEqual(16, l.visible_line_width(lineobj.EndOfLine))
+
+
+class Test_undo (unittest.TestCase):
+    def test_inverse_edits (self):
+        l = lineobj.ReadLineTextBuffer("first second", point=5)
+        l.clear_undo()
+        edits = [(lambda: l.insert_text(" and"), "first and second"),
+                 (lambda: l.__delitem__(slice(0, 6)), "and second"),
+                 (lambda: l.line_buffer.__setitem__(0, "A"), "And second"),
+                 (lambda: l.set_line("other"), "other"),
+                 (lambda: l.upper(), "OTHER"),
+                 (lambda: l.line_buffer.__setitem__(slice(None, None, 2), "abc"), "aTbEc"),
+                 ]
+        texts = ["first second"]
+        points = [5]
+        for edit, text in edits:
+            edit()
+            l.push_undo()
+            self.assertEqual(text, l.get_line_text())
+            texts.append(text)
+            points.append(l.point)
+        while len(texts) > 1:
+            texts.pop()
+            points.pop()
+            l.pop_undo()
+            self.assertEqual(texts[-1], l.get_line_text())
+            self.assertEqual(points[-1], l.point)
+        l.pop_undo()
+        self.assertEqual("", l.get_line_text())
+
+    def test_coalescing (self):
+        l = lineobj.ReadLineTextBuffer("")
+        l.clear_undo()
+        for c in "ab cd  ef":
+            l.insert_text(c)
+            l.push_undo()
+        self.assertEqual(3, len(l.undo_log.groups))
+        l.pop_undo()
+        self.assertEqual("ab cd  ", l.get_line_text())
+        l.point = 3
+        l.push_undo()
+        l.insert_text("x")
+        l.push_undo()
+        l.insert_text("y")
+        l.push_undo()
+        self.assertEqual("ab xycd  ", l.get_line_text())
+        self.assertEqual(3, len(l.undo_log.groups))
+        l.point = 9
+        l.push_undo()
+        l.insert_text("z")
+        l.push_undo()
+        self.assertEqual(4, len(l.undo_log.groups))
+        l.pop_undo()
+        l.pop_undo()
+        self.assertEqual("ab cd  ", l.get_line_text())
+        self.assertEqual(3, l.point)
+
+    def test_memory_limit (self):
+        l = lineobj.ReadLineTextBuffer("start", point=5)
+        l.clear_undo()
+        l.undo_log.limit = 100
+        for i in range(200):
+            l.insert_text(" w%d"%i)
+            l.push_undo()
+        self.assertTrue(l.undo_log.size <= 100)
+        self.assertTrue(len(l.undo_log.groups) < 200)
+        text = l.get_line_text()
+        l.pop_undo()
+        self.assertEqual(text[:-5], l.get_line_text())
+        l.revert_line()
+        self.assertEqual("start", l.get_line_text())
+        self.assertEqual(5, l.point)
+
+
+class Test_lineview (unittest.TestCase):
+    def test_view (self):
+        l = lineobj.ReadLineTextBuffer("first second third", point=7)
+        v = l[lineobj.Point:lineobj.EndOfLine]
+        self.assertTrue(isinstance(v, lineobj.LineView))
+        self.assertEqual("econd third", v.get_line_text())
+        self.assertEqual("econd third", v.quoted_text())
+        self.assertEqual(11, len(v))
+        self.assertEqual(0, v.point)
+        self.assertTrue(v == "econd third")
+        self.assertTrue(v == l[7:])
+        self.assertTrue(v != l[6:])
+        self.assertEqual("con", v[1:4].get_line_text())
+        self.assertEqual(0, len(l[10:3]))
+        self.assertEqual("third", l[-5:].get_line_text())
+        self.assertTrue(v._line_buffer is None)
+
+    def test_copy_on_write (self):
+        l = lineobj.ReadLineTextBuffer("first second", point=0)
+        v = l[0:5]
+        l.insert_text("the ")
+        self.assertEqual("first", v.get_line_text())
+        self.assertEqual("FIRST", v.upper().get_line_text())
+        self.assertEqual("the first second", l.get_line_text())
+        v.point = 5
+        v._insert_text("!")
+        self.assertEqual("FIRST!", v.get_line_text())
+        l[0:3] = v
+        self.assertEqual("FIRST! first second", l.get_line_text())
+        l.point = 8
+        l.upcase_word()
+        self.assertEqual("FIRST! FIRST second", l.get_line_text())
+
+    def test_copy (self):
+        l = lineobj.ReadLineTextBuffer("first second", point=0)
+        c = l[6:].copy()
+        self.assertTrue(isinstance(c, lineobj.ReadLineTextBuffer))
+        self.assertEqual("second", c.get_line_text())
+        c.insert_text("the ")
+        self.assertEqual("the second", c.get_line_text())
+        self.assertEqual([], c.kill_ring)
+        c = l[6:][1:4].copy()
+        self.assertTrue(isinstance(c, lineobj.ReadLineTextBuffer))
+        self.assertEqual("eco", c.get_line_text())
+        c = lineobj.TextLine("first second")[:5].copy()
+        self.assertEqual(lineobj.TextLine, type(c))
+        self.assertEqual("first", c.get_line_text())
+        self.assertEqual("first second", l.get_line_text())
+
+    def test_setitem (self):
+        l = lineobj.ReadLineTextBuffer("first second", point=0)
+        v = l[6:]
+        v[0:3] = "SEC"
+        self.assertEqual("SECond", v.get_line_text())
+        v[0:3] = l[0:5]
+        self.assertEqual("firstond", v.get_line_text())
+        v[0] = l[5:6]
+        self.assertEqual(" irstond", v.get_line_text())
+        self.assertEqual("first second", l.get_line_text())
+        l[0:5] = v
+        self.assertEqual(" irstond second", l.get_line_text())
+
+
+class Test_wordmatcher (unittest.TestCase):
+    def test_boundaries (self):
+        tables = wordmatcher.word_boundaries(list(" ab  cd"), wordmatcher.is_word_token)
+        self.assertEqual(([1, 5, 5, 5, 5, 7, 7, 7],
+                          [3, 3, 3, 7, 7, 7, 7, 7],
+                          [0, 0, 1, 1, 1, 1, 5, 5],
+                          [0, 0, 0, 0, 3, 3, 3, 3]), tables)
+        self.assertEqual(tables[0],
+                         wordmatcher.next_start_segment(" ab  cd", wordmatcher.is_word_token))
+        self.assertEqual(([1, 3, 3, 3],
+                          [2, 2, 3, 3],
+                          [0, 0, 1, 1],
+                          [0, 0, 0, 3]),
+                         wordmatcher.word_boundaries(" ab", lambda c: c == "a"))
+        self.assertEqual(([0], [0], [0], [0]),
+                         wordmatcher.word_boundaries("", wordmatcher.is_word_token))
+
+    def test_word_token (self):
+        is_word = wordmatcher.word_token("-")
+        for c in "a\u00e59_-":
+            self.assertTrue(is_word(c))
+        for c in ". \t":
+            self.assertFalse(is_word(c))
+        self.assertFalse(is_word("ab"))
+        self.assertFalse(is_word(""))
+        l = lineobj.ReadLineTextBuffer("x-y.z \u00e5\u00e4", point=0)
+        l.is_word_token = is_word
+        self.assertEqual(3, lineobj.NextWordEnd(l))
+        self.assertEqual(4, lineobj.NextWordStart(l))
+        self.assertTrue(l.copy().is_word_token is is_word)
+
+
 #----------------------------------------------------------------------
 # utility functions
 
@@ -12,6 +12,7 @@ __all__ = [ 'parse_and_bind',
             'read_init_file',
             'read_history_file',
             'write_history_file',
+            'append_history_file',
             'get_current_history_length',
             'get_history_length',
             'get_history_item',
@@ -44,6 +45,9 @@ else:
         return rl.console
     __all__.append("GetOutputFile")
 
+    set_history_namespace = rl.set_history_namespace
+    __all__.append("set_history_namespace")
+
     import pyreadline.console as console
 
     # make these available so this looks like the python readline module
@@ -54,6 +58,7 @@ else:
     insert_text = rl.insert_text
 
     write_history_file = rl.write_history_file
+    append_history_file = rl.append_history_file
     read_history_file = rl.read_history_file
 
     get_completer_delims = rl.get_completer_delims